@@ -1,9 +1,16 @@
+import logging
 import click
+from arcana.core.data.set import Dataset
 from arcana.core.deploy.command import entrypoint_opts
 from arcana.flywheel.deploy import ExampleApp
+from arcana.flywheel.deploy.gear import GearJob
+from arcana.flywheel.data import Flywheel
 from arcana.core.cli.ext import ext
 
 
+logger = logging.getLogger("arcana")
+
+
 @ext.group(
     name="flywheel",
     help="CLI extensions for interacting with BIDS datasets"
@@ -21,6 +28,10 @@ DATASET_LOCATOR string containing the nickname of the data store, the ID of the
 dataset (e.g. XNAT project ID or file-system directory) and the dataset's name
 in the format <store-nickname>//<dataset-id>[@<dataset-name>]
 
+When run within a Flywheel gear, the inputs staged by the gear job are used in place
+instead of being downloaded again, and the dataset is loaded from the snapshot handed
+to the job by its launcher (if any) after checking it is up to date.
+
 """,
 )
 @click.argument("dataset_locator")
@@ -36,7 +47,95 @@ def app_entrypoint(
 
     image_spec = ExampleApp.load(spec_path)
 
+    gear_job = GearJob.detect()
+    if gear_job is not None:
+        logger.info("Running within Flywheel gear job %s", gear_job.job_id)
+        image_spec.command.gear_job = gear_job
+
     image_spec.command.execute(
         dataset_locator,
         **kwargs,
     )
+
+
+@flywheel_group.command(
+    name="batch-launch",
+    help="""Launches a gear on every row of a dataset at the given frequency, with a
+bounded number of jobs in flight, and waits for all of them to finish while printing
+the progress of the batch.
+
+DATASET_LOCATOR string containing the nickname of the data store, the ID of the
+dataset (e.g. XNAT project ID or file-system directory) and the dataset's name
+in the format <store-nickname>//<dataset-id>[@<dataset-name>]
+
+GEAR_ID the ID of the gear to launch
+""",
+)
+@click.argument("dataset_locator")
+@click.argument("gear_id")
+@click.option(
+    "--frequency",
+    default="session",
+    show_default=True,
+    help="the frequency of the rows to launch the gear on",
+)
+@click.option(
+    "--config",
+    "config",
+    nargs=2,
+    multiple=True,
+    metavar="<name> <value>",
+    help="a configuration value of the gear passed to every job",
+)
+@click.option(
+    "--max-in-flight",
+    type=int,
+    default=100,
+    show_default=True,
+    help="the maximum number of jobs that are pending or running at any time",
+)
+@click.option(
+    "--min-poll-interval",
+    type=float,
+    default=10.0,
+    show_default=True,
+    help="the minimum interval between polls of the states of the jobs (seconds)",
+)
+@click.option(
+    "--max-poll-interval",
+    type=float,
+    default=300.0,
+    show_default=True,
+    help="the maximum interval between polls of the states of the jobs (seconds)",
+)
+@click.option(
+    "--snapshot/--no-snapshot",
+    default=True,
+    show_default=True,
+    help="hand each job a snapshot of the dataset so it doesn't rescan the project",
+)
+def batch_launch(
+    dataset_locator,
+    gear_id,
+    frequency,
+    config,
+    max_in_flight,
+    min_poll_interval,
+    max_poll_interval,
+    snapshot,
+):
+    dataset = Dataset.load(dataset_locator)
+    if not isinstance(dataset.store, Flywheel):
+        raise click.UsageError(f"{dataset_locator} is not in a Flywheel store")
+    with dataset.tree:
+        progress = dataset.store.launch_batch(
+            gear_id,
+            dataset.rows(frequency),
+            config=dict(config),
+            max_in_flight=max_in_flight,
+            min_poll_interval=min_poll_interval,
+            max_poll_interval=max_poll_interval,
+            snapshot=snapshot,
+            on_progress=lambda p: click.echo(p.summary()),
+        )
+    click.echo(f"Finished batch in {progress.elapsed:.0f}s: {progress.summary()}")
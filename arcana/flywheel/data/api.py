@@ -3,17 +3,64 @@ Flywheel api class
 """
 from __future__ import annotations
 import typing as ty
+import json
+import shutil
+import os
+import hashlib
+import weakref
+import threading
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 import attrs
+import urllib3
 from fileformats.core import FileSet
 from arcana.core.data.store import RemoteStore
 from arcana.core.data.row import DataRow
 from arcana.core.data.tree import DataTree
 from arcana.core.data.entry import DataEntry
+from arcana.core.exceptions import ArcanaError, ArcanaUsageError
+from arcana.core.utils.misc import JSON_ENCODING
 
 from arcana.common import Clinical
 
 import flywheel
+from flywheel.file_spec import FileSpec
+from .tree import (
+    TreeLeaf,
+    TreeSnapshot,
+    TreeFilter,
+    LeafTable,
+    TREE_VIEW_COLUMNS,
+    sort_leaves,
+)
+from .index import (
+    EntryIndex,
+    PagedEntryIndex,
+    IndexedEntry,
+    fileset_entry,
+    release_row_entries,
+    ROW_CONTAINER_TYPES,
+    RowKey,
+)
+from .buffer import InfoBuffer
+from .provenance import PROVENANCE_INFO_KEY, encode_provenance, decode_provenance
+from .checksums import calculate_digests, parse_digest, DigestCache, ContainerDigests
+from .pool import ClientPool, ThreadLocalConnectionManager
+from .scheduler import RequestScheduler, ScheduledClient
+from .metrics import Metrics, instrumented
+from .blobs import BlobStore
+from .cache import CacheManager
+from .prefetch import Prefetcher
+from .resolver import ContainerResolver
+from .transfer import local_path, stream_to_file, iter_local_files, UploadJournal
+from .archive import iter_tar_members
+from .job import JobSnapshot, SNAPSHOT_KEY
+from .batch import BatchLauncher, BatchProgress
+
+if ty.TYPE_CHECKING:
+    from arcana.flywheel.deploy.gear import StagedFile
 
 # from flywheel.models.project_input import ProjectInput
 
@@ -22,6 +69,15 @@ import logging
 logger = logging.getLogger("arcana")
 
 
+# Metadata flag of the internal fields of the store that are carried over when it is
+# pickled (see `Flywheel.__getstate__`)
+PICKLED = "pickled"
+
+# Reserved info key of the project the definitions of its datasets are saved under
+# (keyed by name)
+DATASET_DEFINITIONS_INFO_KEY = "__arcana_datasets__"
+
+
 @attrs.define(kw_only=True, slots=False)
 class Flywheel(RemoteStore):
     """
@@ -37,17 +93,317 @@ class Flywheel(RemoteStore):
           to the node.
         * allow derivative data to be stored within in separate namespaces for different
           analyses on the same data
+
+    Parameters
+    ----------
+    bulk_tree_scan : bool
+        Scan the sessions of a project in a single paged data-view query instead of
+        listing the sessions of each subject separately, by default True
+    page_size : int
+        The maximum number of records to request from the server per call in paged
+        queries, by default 1000
+    tree_snapshots : bool
+        Save a snapshot of the scanned tree in the cache directory and only query the
+        server for subjects and sessions modified since it was taken on subsequent
+        opens of the dataset, by default True
+    tree_snapshot_max_age : int
+        The time (in seconds) after which the project is fully rescanned instead of
+        refreshing the snapshot, which is required to pick up deleted subjects,
+        by default 86400 (i.e. one day)
+    download_threads : int
+        The number of files of a file-set that are downloaded concurrently,
+        by default 8
+    upload_threads : int
+        The number of files of a file-set that are uploaded concurrently, by default 4
+    checksum_algorithm : str
+        The hash algorithm the server uses to calculate the digests of files, by
+        default "sha384"
+    checksum_processes : int, optional
+        The maximum number of processes used to hash files, by default the number
+        of CPUs
+    chunk_size : int
+        The size (in bytes) of the chunks files are streamed to and from the server
+        in, by default 1 MiB
+    max_connections : int
+        The maximum number of authenticated clients that are kept in the pool of the
+        store and can be connected at once, by default 10
+    resolver_ttl : int
+        The time (in seconds) the index resolving subject and session labels to
+        Flywheel container IDs is reused for before it is rebuilt, by default 600
+    create_threads : int
+        The number of subjects/sessions created concurrently by `create_data_tree`,
+        by default 8
+    max_concurrent_requests : int
+        The maximum number of requests the store will have in flight to the server
+        at once. The actual limit adapts to the error rate and latency of the server
+        below this maximum, by default 32
+    max_retries : int
+        The maximum number of times requests to idempotent endpoints are retried when
+        the server is overloaded or unreachable, by default 5
+    content_addressed_cache : bool
+        Store the downloaded files in a blob store in the cache directory keyed by
+        their digests, and create the files of cached entries as (reflinks or hard)
+        links to the blobs, so that identical files in different entries, projects
+        or datasets are only downloaded and stored once, by default True
+    index_page_size : int
+        The number of sessions whose entries are indexed together (in a few bulk
+        requests) when the first of their rows is populated. Projects with more
+        sessions are indexed one page at a time as their rows are accessed,
+        by default 1000
+    max_resident_rows : int, optional
+        The maximum number of populated rows whose entries are kept in memory. The
+        entries of the least recently used rows beyond it are released (along with
+        the index pages that aren't needed for the resident rows), and repopulated if
+        the rows are accessed again, by default None (i.e. unbounded)
+    archive_downloads : bool
+        When a file-set of a row that isn't in the cache is retrieved, download the
+        acquisitions of the row that aren't cached in a single archive generated by
+        the server, which is extracted into the cache as it is streamed, instead of
+        requesting their files one at a time. Suits rows with many small files (e.g.
+        DICOM series), by default False
+    cache_max_bytes : int, optional
+        The byte budget of the cache directory. When it is exceeded, the least
+        recently used entries (and blobs) that aren't pinned by a running process
+        are evicted. Entries retrieved within a connection context (i.e. a
+        ``with store.connection:`` block) are pinned until it exits, so the context
+        should be held open while they are in use, by default None (i.e. the cache
+        grows without bound)
+    metrics_file : str, optional
+        Path to dump the metrics recorded by the store (see `Flywheel.metrics`) to when
+        the process exits, with the ID of the process inserted before its extension
+        (e.g. "metrics.1234.json") so that workers don't overwrite each other's
+        metrics. Paths ending in ".prom" or ".txt" are written in the Prometheus text
+        format, otherwise JSON, by default None (i.e. not dumped)
     """
 
-    # Uncomment if the remote store supports datasets with specific data space/hierarchy,
-    # or have obvious defaults
-    # DEFAULT_SPACE = Clinical
-    # DEFAULT_HIERARCHY = ["subject", "timepoint"]
+    bulk_tree_scan: bool = True
+    page_size: int = 1000
+    tree_snapshots: bool = True
+    tree_snapshot_max_age: int = 86400
+    download_threads: int = 8
+    upload_threads: int = 4
+    checksum_algorithm: str = "sha384"
+    checksum_processes: ty.Optional[int] = None
+    chunk_size: int = 1048576
+    max_connections: int = 10
+    resolver_ttl: int = 600
+    create_threads: int = 8
+    max_concurrent_requests: int = 32
+    max_retries: int = 5
+    content_addressed_cache: bool = True
+    index_page_size: int = 1000
+    max_resident_rows: ty.Optional[int] = None
+    archive_downloads: bool = False
+    cache_max_bytes: ty.Optional[int] = None
+    metrics_file: ty.Optional[str] = None
+
+    connection: ThreadLocalConnectionManager = attrs.field(
+        factory=ThreadLocalConnectionManager,
+        init=False,
+        hash=False,
+        repr=False,
+        eq=False,
+    )
+    # Indices of the entries in each dataset, populated on the first call to
+    # `populate_row` and dropped when the tree of the dataset is rescanned
+    _entry_indices: ty.Dict[str, PagedEntryIndex] = attrs.field(
+        factory=dict, init=False, repr=False, eq=False
+    )
+    # Entries of the rows handed to the job the store is used in by its launcher (see
+    # `install_job_snapshot`), which are used instead of indexing the project
+    _job_rows: ty.Dict[str, ty.Dict[RowKey, ty.List[IndexedEntry]]] = attrs.field(
+        factory=dict, init=False, repr=False, eq=False, metadata={PICKLED: True}
+    )
+    _entry_indices_lock: threading.Lock = attrs.field(
+        factory=threading.Lock, init=False, repr=False, eq=False
+    )
+    _container_digests: ty.Dict[str, ContainerDigests] = attrs.field(
+        factory=dict, init=False, repr=False, eq=False
+    )
+    _container_digests_lock: threading.Lock = attrs.field(
+        factory=threading.Lock, init=False, repr=False, eq=False
+    )
+    # Weak references to the populated rows in least recently used order, keyed by
+    # the ID of their dataset, their frequency and their ID, along with the number of
+    # entries they were populated with
+    _resident_rows: ty.Dict[
+        ty.Tuple[str, str, str], ty.Tuple[weakref.ref, int]
+    ] = attrs.field(
+        factory=OrderedDict, init=False, repr=False, eq=False
+    )
+    _resident_rows_lock: threading.Lock = attrs.field(
+        factory=threading.Lock, init=False, repr=False, eq=False
+    )
+    # Guards the population and release of the entries of rows, which background
+    # threads (e.g. prefetching) share with the thread processing the rows
+    _rows_lock: threading.RLock = attrs.field(
+        factory=threading.RLock, init=False, repr=False, eq=False
+    )
+    # Pins on the cache entries in use by the process, along with the number of
+    # threads holding each, and the cache entries held by each thread until its
+    # outermost connection context exits
+    _cache_pins: ty.Dict[Path, ty.List[ty.Any]] = attrs.field(
+        factory=dict, init=False, repr=False, eq=False
+    )
+    _cache_pins_lock: threading.Lock = attrs.field(
+        factory=threading.Lock, init=False, repr=False, eq=False
+    )
+    _held_cache_entries: threading.local = attrs.field(
+        factory=threading.local, init=False, repr=False, eq=False
+    )
+    # Criteria on the subjects and sessions included in each dataset, which are pushed
+    # down to the queries used to scan it
+    _tree_filters: ty.Dict[str, ty.Optional[TreeFilter]] = attrs.field(
+        factory=dict, init=False, repr=False, eq=False
+    )
+    # The leaves of each populated tree, held in columns
+    _leaf_tables: ty.Dict[str, LeafTable] = attrs.field(
+        factory=dict, init=False, repr=False, eq=False
+    )
+    # Indices resolving the labels of rows to container IDs, rebuilt with the tree
+    _resolvers: ty.Dict[str, ContainerResolver] = attrs.field(
+        factory=dict, init=False, repr=False, eq=False
+    )
+    _resolvers_lock: threading.Lock = attrs.field(
+        factory=threading.Lock, init=False, repr=False, eq=False
+    )
+    # Field values and provenance records waiting to be uploaded when the connection
+    # is closed
+    _field_buffer: InfoBuffer = attrs.field(
+        factory=InfoBuffer, init=False, repr=False, eq=False
+    )
+    _provenance_buffer: InfoBuffer = attrs.field(
+        factory=InfoBuffer, init=False, repr=False, eq=False
+    )
+    # Provenance records of the entries in each container that has been loaded
+    _provenance_cache: ty.Dict[str, ty.Dict[str, ty.Any]] = attrs.field(
+        factory=dict, init=False, repr=False, eq=False
+    )
+    _provenance_lock: threading.Lock = attrs.field(
+        factory=threading.Lock, init=False, repr=False, eq=False
+    )
+    _client_pool: ClientPool = attrs.field(
+        default=attrs.Factory(
+            lambda self: ClientPool(
+                factory=flywheel.Client,
+                max_clients=self.max_connections,
+                http_pool_size=max(self.download_threads, self.upload_threads),
+                # Overloaded responses are retried by the scheduler instead, so that
+                # they feed back into the concurrency limit
+                max_retries=urllib3.util.Retry(
+                    total=None, connect=3, read=0, status=0, other=0, redirect=5
+                ),
+            ),
+            takes_self=True,
+        ),
+        init=False,
+        repr=False,
+        eq=False,
+    )
+    _metrics: Metrics = attrs.field(
+        default=attrs.Factory(
+            lambda self: Metrics(dump_path=self.metrics_file), takes_self=True
+        ),
+        init=False,
+        repr=False,
+        eq=False,
+    )
+    _cache_manager: CacheManager = attrs.field(
+        default=attrs.Factory(
+            lambda self: CacheManager(
+                self.cache_dir,
+                max_bytes=self.cache_max_bytes,
+                checksum_suffix=self.CHECKSUM_SUFFIX,
+                sidecar_suffixes=(DigestCache.SUFFIX, UploadJournal.SUFFIX),
+                blob_dir=self.BLOB_STORE_DIR,
+            ),
+            takes_self=True,
+        ),
+        init=False,
+        repr=False,
+        eq=False,
+    )
+    _prefetchers: ty.List[Prefetcher] = attrs.field(
+        factory=list, init=False, repr=False, eq=False
+    )
+    # Files staged on local disk by Flywheel for the gear job the store is used in,
+    # keyed by the ID of their container and their name
+    _staged_files: ty.Dict[ty.Tuple[str, str], StagedFile] = attrs.field(
+        factory=dict, init=False, repr=False, eq=False, metadata={PICKLED: True}
+    )
+    # Shared by all the clients of the store, as they are all talking to one server
+    _scheduler: RequestScheduler = attrs.field(
+        default=attrs.Factory(
+            lambda self: RequestScheduler(
+                max_limit=self.max_concurrent_requests,
+                max_retries=self.max_retries,
+                metrics=self._metrics,
+            ),
+            takes_self=True,
+        ),
+        init=False,
+        repr=False,
+        eq=False,
+    )
+
+    TREE_SNAPSHOT_DIR = "__tree_snapshots__"
+    BLOB_STORE_DIR = "__blobs__"
+    CONTAINER_DIGESTS_DIR = "__container_digests__"
+    # Overlap between successive listings of modified containers to allow for clock
+    # skew between this host and the server (re-applying a change is harmless)
+    MODIFIED_FILTER_OVERLAP = timedelta(minutes=5)
+
+    def __getstate__(self):
+        # Only the configuration of the store is pickled (e.g. when it is passed to
+        # pydra workers), as its internal state holds locks, open connections and
+        # caches that are specific to the process. The exception is state handed to
+        # the process it is used in (e.g. by a gear job), which is flagged with
+        # PICKLED in the metadata of its field
+        return {
+            f.name: getattr(self, f.name)
+            for f in attrs.fields(type(self))
+            if f.init or f.metadata.get(PICKLED)
+        }
+
+    def __setstate__(self, state):
+        for field in attrs.fields(type(self)):
+            if field.name in state:
+                value = state[field.name]
+            elif field.default.takes_self:
+                value = field.default.factory(self)
+            else:
+                value = field.default.factory()
+            object.__setattr__(self, field.name, value)
+        self.__attrs_post_init__()
+
+    @property
+    def metrics(self) -> Metrics:
+        """The number of calls, latencies, errors and bytes transferred of the
+        operations performed by the store (kind "store") and the requests they made
+        to the server (kind "sdk") since it was created in this process"""
+        return self._metrics
+
+    def dump_metrics(self, path: ty.Union[str, Path], format: ty.Optional[str] = None):
+        """Writes the metrics recorded by the store to a file
+
+        Parameters
+        ----------
+        path : str or Path
+            the path to write the metrics to
+        format : str, optional
+            either "json" or "prometheus", by default inferred from the extension of
+            the path
+        """
+        self._metrics.dump(path, format=format)
+
+    DEFAULT_SPACE = Clinical
+    DEFAULT_HIERARCHY = ["subject", "session"]
 
     #############################
     # DataStore abstractmethods #
     #############################
 
+    @instrumented
     def populate_tree(self, tree: DataTree):
         """Scans the data present in the dataset and populates the nodes of the data
         tree with those found in the dataset using the ``DataTree.add_leaf`` method for
@@ -57,6 +413,14 @@ class Flywheel(RemoteStore):
         between reads, because it is used to give default values to the ID's of data
         space axes not explicitly in the hierarchy of the tree.
 
+        If the dataset includes a subset of the subjects and/or sessions of the
+        project (see ``Dataset.include``), the criteria are pushed down to the queries
+        sent to the server, so only the matching subtree is listed (unless there is an
+        up-to-date snapshot of the tree to filter instead).
+
+        The leaves are kept in a columnar table (see `leaf_table`), and the metadata
+        dicts passed to ``DataTree.add_leaf`` are only created as each leaf is added.
+
         Parameters
         ----------
         tree : DataTree
@@ -65,25 +429,45 @@ class Flywheel(RemoteStore):
 
         with self.connection:
             logger.debug(f"DATASET ID: {tree.dataset_id}")
-            fwproject = self.connection.lookup(f"arcana_tests/{tree.dataset_id}")
-            subjects = sorted(fwproject.subjects(), key=lambda x: x.label)
-            for fwsubject in subjects:
-                fwsessions = sorted(
-                    fwsubject.sessions(),
-                    key=lambda x: x.timestamp,
+            self._entry_indices.pop(tree.dataset_id, None)
+            self._tree_filters[tree.dataset_id] = TreeFilter.from_dataset(
+                getattr(tree, "dataset", None)
+            )
+            project_id, leaves = self._scan_dataset(tree.dataset_id)
+            table = LeafTable.consume(leaves)
+            self._leaf_tables[tree.dataset_id] = table
+            # The scan already holds the IDs of every subject and session, so the
+            # resolver is rebuilt along with the tree for free
+            with self._resolvers_lock:
+                self._resolvers[tree.dataset_id] = ContainerResolver.from_table(
+                    project_id, table
                 )
-                for fwsess in fwsessions:
-                    date = fwsess.date.strftime("%Y%m%d") if fwsess.timestamp else None
-                    metadata = {
-                        "session": {
-                            "date": date,
-                            "age": fwsess.age / 31536000
-                            if fwsess.age is not None
-                            else -1,
-                        }
-                    }
-                    tree.add_leaf([fwsubject.label, fwsess.label], metadata=metadata)
+            for i in range(len(table)):
+                tree.add_leaf(table.tree_path(i), metadata=table.metadata(i))
+
+    def leaf_table(self, dataset_id: str) -> LeafTable:
+        """Returns the columnar table of the leaves (sessions) of the dataset, which
+        can be used to select rows by their metadata (see ``LeafTable.select``). The
+        table of the last populated tree is returned, otherwise the dataset is scanned
 
+        Parameters
+        ----------
+        dataset_id : str
+            the ID of the dataset
+
+        Returns
+        -------
+        LeafTable
+            the leaves of the dataset
+        """
+        table = self._leaf_tables.get(dataset_id)
+        if table is None:
+            with self.connection:
+                _, leaves = self._scan_dataset(dataset_id)
+            table = self._leaf_tables[dataset_id] = LeafTable.consume(leaves)
+        return table
+
+    @instrumented
     def populate_row(self, row: DataRow):
         """Scans a node in the data tree corresponding to the data row and populates a
         row with all data entries found in the corresponding node in the data
@@ -104,9 +488,27 @@ class Flywheel(RemoteStore):
         row : DataRow
             The row to populate with entries
         """
+        key = EntryIndex.row_key(row)
+        if key is None:
+            logger.debug("No Flywheel container corresponds to %s", row)
+            return
+        # Entries handed over by the launcher are read (not consumed), so rows that
+        # are released and repopulated don't go back to the server
+        row_entries = self._job_rows.get(row.dataset.id, {}).get(key)
+        if row_entries is None:
+            row_entries = self._get_entry_index(row.dataset.id, key).row_entries(key)
+        with self._rows_lock:
+            for entry in row_entries:
+                row.add_entry(
+                    path=entry.path,
+                    datatype=entry.datatype,
+                    uri=entry.uri,
+                    order=entry.order,
+                    checksums=entry.checksums,
+                )
+            self._row_used(row, num_entries=len(row_entries))
 
-        raise NotImplementedError
-
+    @instrumented
     def save_dataset_definition(
         self, dataset_id: str, definition: dict[str, ty.Any], name: str
     ):
@@ -123,8 +525,16 @@ class Flywheel(RemoteStore):
         name: str
             Name for the dataset definition to distinguish it from other
             definitions for the same directory/project"""
-        raise NotImplementedError
-
+        with self.connection:
+            project = self._lookup_project(dataset_id)
+            info = self.connection.get(project.id).info or {}
+            definitions = dict(info.get(DATASET_DEFINITIONS_INFO_KEY) or {})
+            definitions[name] = definition
+            self.connection.modify_container_info(
+                project.id, {"set": {DATASET_DEFINITIONS_INFO_KEY: definitions}}
+            )
+
+    @instrumented
     def load_dataset_definition(self, dataset_id: str, name: str) -> dict[str, ty.Any]:
         """Load definition of a dataset saved within the store
 
@@ -142,7 +552,10 @@ class Flywheel(RemoteStore):
             A dictionary containing the dataset definition that was saved in the
             data store
         """
-        raise NotImplementedError
+        with self.connection:
+            project = self._lookup_project(dataset_id)
+            info = self.connection.get(project.id).info or {}
+        return (info.get(DATASET_DEFINITIONS_INFO_KEY) or {}).get(name)
 
     def connect(self):
         """
@@ -150,13 +563,15 @@ class Flywheel(RemoteStore):
 
         Parameters
         ----------
-        session : Any
-            the session object returned by `connect` to be closed gracefully
+        Returns
+        -------
+        session : flywheel.Client
+            a client borrowed from the pool of the store, which is reused between
+            connections (and shared by any threads transferring files through it).
+            All calls made through it are routed through the request scheduler of
+            the store
         """
-
-        # Flywheel Client is not designed to be a context manager
-        return flywheel.Client()
-        # raise NotImplementedError
+        return ScheduledClient(self._client_pool.acquire(), self._scheduler)
 
     def disconnect(self, session):
         """
@@ -167,8 +582,60 @@ class Flywheel(RemoteStore):
         session : Any
             the session object returned by `connect` to be closed gracefully
         """
-        # raise NotImplementedError
+        try:
+            self._flush_writes(session)
+        finally:
+            self._client_pool.release(session.client)
+            self._release_cache_pins()
+
+    @instrumented
+    def flush_writes(self):
+        """Uploads the field values and provenance records that have been written to
+        the store but not yet uploaded. Called automatically when the outermost
+        connection context exits, so writes should be batched within a
+        ``with store.connection:`` block"""
+        with self.connection:
+            self._flush_writes(self.connection.session)
+
+    def _flush_writes(self, client):
+        """Uploads the buffered field values and provenance records with one info
+        update per container"""
+        fields = self._field_buffer.drain()
+        provenance = self._provenance_buffer.drain()
+        container_ids = list(dict.fromkeys(list(fields) + list(provenance)))
+        for i, container_id in enumerate(container_ids):
+            info_update = dict(fields.get(container_id, {}))
+            records = None
+            try:
+                if container_id in provenance:
+                    # The records of the other entries in the container are re-read
+                    # just before they are merged, to narrow the window in which
+                    # concurrent writers to the same container could clobber them
+                    info = client.get(container_id).info or {}
+                    records = decode_provenance(info.get(PROVENANCE_INFO_KEY))
+                    records.update(provenance[container_id])
+                    info_update[PROVENANCE_INFO_KEY] = encode_provenance(records)
+                client.modify_container_info(container_id, {"set": info_update})
+            except BaseException:
+                remaining = container_ids[i:]
+                self._field_buffer.restore(
+                    {c: fields[c] for c in remaining if c in fields}
+                )
+                self._provenance_buffer.restore(
+                    {c: provenance[c] for c in remaining if c in provenance}
+                )
+                raise
+            if records is not None:
+                with self._provenance_lock:
+                    self._provenance_cache[container_id] = records
+        logger.debug(
+            "Flushed %s field values and %s provenance records to %s containers",
+            sum(len(v) for v in fields.values()),
+            sum(len(v) for v in provenance.values()),
+            len(container_ids),
+        )
 
+    @instrumented
     def get_provenance(self, entry: DataEntry) -> dict[str, ty.Any]:
         """Retrieves provenance information for a given data entry in the store
 
@@ -183,8 +650,13 @@ class Flywheel(RemoteStore):
             The provenance data stored in the repository for the data entry.
             Returns `None` if no provenance data has been stored
         """
-        raise NotImplementedError
+        container_id = self.resolve_container_id(entry.row)
+        found, provenance = self._provenance_buffer.get(container_id, entry.path)
+        if found:
+            return provenance
+        return self._container_provenance(container_id).get(entry.path)
 
+    @instrumented
     def put_provenance(self, provenance: dict[str, ty.Any], entry: DataEntry):
         """Stores provenance information for a given data item in the store
 
@@ -195,8 +667,13 @@ class Flywheel(RemoteStore):
         provenance: dict[str, Any]
             The provenance data to store for the data entry
         """
-        raise NotImplementedError
+        # The provenance records of all the entries in a container are stored in a
+        # single compressed blob in its info, which is uploaded along with any field
+        # values written to the container when the connection is closed
+        container_id = self.resolve_container_id(entry.row)
+        self._provenance_buffer.put(container_id, entry.path, provenance)
 
+    @instrumented
     def create_data_tree(
         self,
         id: str,
@@ -229,26 +706,649 @@ class Flywheel(RemoteStore):
             Not used, but should be kept here to allow compatibility with future
             stores that may need to be passed other arguments
         """
+        leaves = [(str(subj), str(sess)) for subj, sess in leaves]
         with self.connection:
+            try:
+                project_id = self._lookup_project(id).id
+            except flywheel.ApiException as e:
+                if e.status != 404:
+                    raise
+                project_id = self.connection.add_project(
+                    {"group": "arcana_tests", "label": id}
+                )
+            client = self.connection.session
+            # Subjects and sessions that already exist are skipped, so re-running the
+            # creation of a tree that exists is a couple of listing requests
+            subject_ids = self._list_subject_ids(project_id)
+            self._create_containers(
+                client.add_subject,
+                {
+                    subj: {"project": project_id, "label": subj}
+                    for subj in set(s for s, _ in leaves)
+                    if subj not in subject_ids
+                },
+            )
+            subject_ids = self._list_subject_ids(project_id)
+            existing_sessions = self._list_session_keys(project_id, subject_ids)
+            self._create_containers(
+                client.add_session,
+                {
+                    leaf: {
+                        "project": project_id,
+                        "subject": {"_id": subject_ids[leaf[0]]},
+                        "label": leaf[1],
+                    }
+                    for leaf in set(leaves)
+                    if leaf not in existing_sessions
+                },
+            )
+            # Confirm that the whole tree is present before returning
+            missing = set(leaves) - self._list_session_keys(
+                project_id, self._list_subject_ids(project_id)
+            )
+            if missing:
+                raise ArcanaError(
+                    f"Failed to create {len(missing)} sessions in {id}: "
+                    + ", ".join("/".join(leaf) for leaf in sorted(missing))
+                )
+        self._leaf_tables.pop(id, None)
+        with self._resolvers_lock:
+            self._resolvers.pop(id, None)
+
+    def _list_subject_ids(self, project_id: str) -> ty.Dict[str, str]:
+        return {
+            s.label: s.id
+            for s in self._iter_pages(self.connection.get_project_subjects, project_id)
+        }
+
+    def _list_session_keys(
+        self, project_id: str, subject_ids: ty.Dict[str, str]
+    ) -> ty.Set[ty.Tuple[str, str]]:
+        subject_labels = {i: label for label, i in subject_ids.items()}
+        return set(
+            (subject_labels[s.parents.subject], s.label)
+            for s in self._iter_pages(self.connection.get_project_sessions, project_id)
+            if s.parents.subject in subject_labels
+        )
 
-            group = self.connection.get("arcana_tests")
-            project = group.add_project(label=id)
-            for ids_tuple in leaves:
-                logger.debug(ids_tuple)
-                subject_id, session_id = ids_tuple
-                try:
-                    # Create subject
-                    subject = project.add_subject(label=f"{subject_id}")
-                except flywheel.ApiException:
-                    # subject already exists
-                    continue
-                # Create session
-                subject.add_session(label=f"{session_id}")
+    def _create_containers(self, add_method, bodies: ty.Dict[ty.Any, dict]):
+        """Creates containers concurrently, treating conflicts (i.e. containers created
+        by another process in the meantime) as successes"""
+        if not bodies:
+            return
+
+        def create(body):
+            try:
+                add_method(body)
+            except flywheel.ApiException as e:
+                if e.status != 409:
+                    raise
+
+        with ThreadPoolExecutor(max_workers=self.create_threads) as pool:
+            for future in [pool.submit(create, b) for b in bodies.values()]:
+                future.result()
+        logger.debug("Created %s containers with %s", len(bodies), add_method)
 
     ################################
     # RemoteStore-specific methods #
     ################################
 
+    def get_fileset(self, entry: DataEntry, datatype: type) -> FileSet:
+        for prefetcher in list(self._prefetchers):
+            prefetcher.accessed(entry)
+        if self._staged_files and not self._is_cached(entry):
+            self._link_staged(entry)
+        if (
+            self.archive_downloads
+            and self._parse_uri(entry.uri)[0] == "acquisitions"
+            and not self._is_cached(entry)
+        ):
+            try:
+                self.download_row(entry.row)
+            except Exception as e:
+                logger.warning(
+                    "Could not download the acquisitions of %s as an archive, falling "
+                    "back to downloading their files individually: %s",
+                    entry.row,
+                    e,
+                )
+        fileset = super().get_fileset(entry, datatype)
+        self._record_cache_access(self.cache_path(entry.uri))
+        self._row_used(entry.row)
+        return fileset
+
+    def put_fileset(self, fileset: FileSet, entry: DataEntry) -> FileSet:
+        cached = super().put_fileset(fileset, entry)
+        self._record_cache_access(self.cache_path(entry.uri))
+        return cached
+
+    @instrumented
+    def download_row(self, row: DataRow) -> ty.List[DataEntry]:
+        """Downloads the acquisitions of a row that aren't already in the cache in a
+        single archive generated by the server, which is extracted into the cache
+        entries of the acquisitions as it is streamed (i.e. without writing the
+        archive to disk). The contents of each file are verified against the digest
+        reported by the server, and files already in the blob store aren't written
+        again. Entries that aren't completely filled by the archive are left to be
+        downloaded file by file when they are retrieved
+
+        Parameters
+        ----------
+        row : DataRow
+            the row to download the acquisitions of
+
+        Returns
+        -------
+        list[DataEntry]
+            the entries that were downloaded into the cache
+        """
+        # Expected archive members keyed by "<acquisition label>/<file name>", which
+        # are matched against the tail of the paths of the members in the archive
+        expected = {}
+        pending = {}
+        with self._rows_lock:
+            row_entries = list(row.entries)
+        try:
+            for entry in row_entries:
+                if (
+                    self._parse_uri(entry.uri)[0] != "acquisitions"
+                    or not entry.checksums
+                    or self._is_cached(entry)
+                ):
+                    continue
+                download_dir = Path(str(self.cache_path(entry.uri)) + ".download")
+                try:
+                    download_dir.mkdir(parents=True)
+                except FileExistsError:
+                    continue  # being downloaded by another process
+                pending[entry.uri] = (entry, download_dir)
+                for name in entry.checksums:
+                    expected[f"{entry.path}/{name}"] = (entry, name)
+            if not pending:
+                return []
+            num_bytes, extracted = self._extract_archive(
+                [self._parse_uri(u)[1] for u in pending],
+                expected,
+                {u: d for u, (_, d) in pending.items()},
+            )
+            downloaded = []
+            for uri, (entry, download_dir) in pending.items():
+                if not set(entry.checksums) <= extracted.get(uri, set()):
+                    logger.debug("%s was not completely filled by the archive", uri)
+                    continue
+                cache_path = self.cache_path(uri)
+                if cache_path.exists():
+                    shutil.rmtree(cache_path)
+                shutil.move(download_dir / "files", cache_path)
+                with open(
+                    str(cache_path) + self.CHECKSUM_SUFFIX, "w", **JSON_ENCODING
+                ) as f:
+                    json.dump(entry.checksums, f, indent=2)
+                downloaded.append(entry)
+        finally:
+            for _, download_dir in pending.values():
+                shutil.rmtree(download_dir, ignore_errors=True)
+        self._metrics.add_bytes("store", "download_row", num_bytes)
+        self._cache_manager.record_added(num_bytes)
+        logger.debug(
+            "Downloaded %s bytes of %s acquisitions of %s in an archive",
+            num_bytes,
+            len(downloaded),
+            row,
+        )
+        return downloaded
+
+    def _extract_archive(
+        self,
+        acquisition_ids: ty.List[str],
+        expected: ty.Dict[str, ty.Tuple[DataEntry, str]],
+        download_dirs: ty.Dict[str, Path],
+    ) -> ty.Tuple[int, ty.Dict[str, ty.Set[str]]]:
+        """Requests an archive of the acquisitions from the server and extracts the
+        expected members into the download directories of their entries as it is
+        streamed, returning the number of bytes downloaded and the names of the files
+        that were verified and extracted for each entry"""
+        request = flywheel.Download(
+            nodes=[
+                flywheel.DownloadNode(level="acquisition", id=i)
+                for i in acquisition_ids
+            ],
+            optional=True,
+        )
+        num_bytes = 0
+        extracted = defaultdict(set)
+        blobs = self.blob_store if self.content_addressed_cache else None
+        with self.connection:
+            ticket = self.connection.create_download_ticket(request).ticket
+            resp = self.connection.files_api.download_ticket_with_http_info(
+                ticket, _return_http_data_only=True, _preload_content=False
+            )
+            try:
+                for member_name, contents in iter_tar_members(
+                    resp.iter_content(chunk_size=self.chunk_size), self.chunk_size
+                ):
+                    parts = member_name.split("/")
+                    match = next(
+                        (
+                            expected["/".join(parts[i:])]
+                            for i in range(len(parts))
+                            if "/".join(parts[i:]) in expected
+                        ),
+                        None,
+                    )
+                    if match is None:
+                        continue
+                    entry, name = match
+                    if name in extracted[entry.uri]:
+                        continue
+                    download_dir = download_dirs[entry.uri]
+                    dest = local_path(download_dir / "files", name)
+                    digest = entry.checksums[name]
+                    if blobs is not None and blobs.link(digest, dest):
+                        extracted[entry.uri].add(name)
+                        continue
+                    parsed = parse_digest(digest)
+                    hasher = hashlib.new(parsed[0]) if parsed else None
+                    num_bytes += stream_to_file(
+                        contents, dest, download_dir, hasher=hasher
+                    )
+                    if hasher is not None:
+                        if hasher.hexdigest() != parsed[1]:
+                            logger.warning(
+                                "Contents of '%s' in the archive of %s don't match the "
+                                "digest reported by the server (%s)",
+                                name,
+                                entry.uri,
+                                digest,
+                            )
+                            dest.unlink()
+                            continue
+                        if blobs is not None:
+                            blobs.add(dest, digest)
+                    extracted[entry.uri].add(name)
+            finally:
+                resp.close()
+        self._metrics.add_bytes("sdk", "download_ticket_with_http_info", num_bytes)
+        return num_bytes, extracted
+
+    def _is_cached(self, entry: DataEntry) -> bool:
+        """Whether the cached copy of a file-set entry is up to date"""
+        checksums_path = Path(str(self.cache_path(entry.uri)) + self.CHECKSUM_SUFFIX)
+        try:
+            with open(checksums_path, **JSON_ENCODING) as f:
+                return json.load(f) == entry.checksums
+        except (OSError, ValueError):
+            return False
+
+    def prefetch(
+        self,
+        rows: ty.Iterable[DataRow],
+        columns: ty.Optional[ty.Sequence[str]] = None,
+        depth: int = 2,
+        max_bytes: ty.Optional[int] = None,
+    ) -> Prefetcher:
+        """Starts downloading the file-sets of the given rows into the cache in the
+        background, keeping `depth` rows ahead of the row being processed, so that
+        downloading the inputs of the next rows overlaps with the processing of the
+        current one. The returned prefetcher yields the rows when iterated and should
+        be closed (or used as a context manager) when the rows have been processed,
+        e.g.
+
+            with store.prefetch(dataset.rows("session")) as rows:
+                for row in rows:
+                    ...
+
+        Parameters
+        ----------
+        rows : Iterable[DataRow]
+            the rows in the order they will be processed
+        columns : Sequence[str], optional
+            the names of the columns to prefetch the file-sets of, by default all
+            source columns of the dataset
+        depth : int
+            the number of rows ahead of the row being processed to prefetch,
+            by default 2
+        max_bytes : int, optional
+            the maximum number of bytes of prefetched file-sets waiting to be
+            processed, by default unlimited (within `depth`)
+
+        Returns
+        -------
+        Prefetcher
+            the prefetcher downloading the file-sets
+        """
+        rows = list(rows)
+        if columns is None:
+            columns = (
+                [n for n, c in rows[0].dataset.columns.items() if not c.is_sink]
+                if rows
+                else []
+            )
+        return Prefetcher(
+            self, rows, columns, depth=depth, max_bytes=max_bytes
+        ).start()
+
+    def register_prefetcher(self, prefetcher: Prefetcher):
+        """Notifies the prefetcher of the file-sets retrieved from the store until it
+        is unregistered"""
+        self._prefetchers.append(prefetcher)
+
+    def unregister_prefetcher(self, prefetcher: Prefetcher):
+        if prefetcher in self._prefetchers:
+            self._prefetchers.remove(prefetcher)
+
+    def job_snapshot(self, dataset_id: str, rows: ty.Iterable[DataRow]) -> JobSnapshot:
+        """Takes a snapshot of the tree of the dataset and the entries of the rows a
+        job is to be launched on, which is handed to the job so that it can start
+        from it (see `install_job_snapshot`) instead of scanning the project
+
+        Parameters
+        ----------
+        dataset_id : str
+            the ID of the dataset
+        rows : Iterable[DataRow]
+            the rows the job is launched on
+
+        Returns
+        -------
+        JobSnapshot
+            the snapshot
+        """
+        taken = datetime.now(timezone.utc)
+        with self.connection:
+            if self.tree_snapshots and self._tree_filters.get(dataset_id) is None:
+                tree = self._load_tree_snapshot(dataset_id)
+            else:
+                fwproject = self._lookup_project(dataset_id)
+                tree = TreeSnapshot(
+                    project_id=fwproject.id,
+                    scanned=taken,
+                    taken=taken,
+                    leaves=self._scan_project(fwproject),
+                )
+            # Pages indexed before the snapshot was taken may be out of date
+            with self._entry_indices_lock:
+                self._entry_indices.pop(dataset_id, None)
+            job_rows = {}
+            for row in rows:
+                key = EntryIndex.row_key(row)
+                if key is not None:
+                    job_rows[key] = self._get_entry_index(dataset_id, key).row_entries(
+                        key
+                    )
+        return JobSnapshot(dataset_id=dataset_id, tree=tree, taken=taken, rows=job_rows)
+
+    def install_job_snapshot(self, snapshot: JobSnapshot) -> ty.Set[RowKey]:
+        """Starts from a snapshot handed to the job by its launcher (see
+        `job_snapshot`) instead of scanning the project. The tree snapshot is saved in
+        the cache, where it is refreshed with the subjects and sessions modified since
+        it was taken as usual (unless there is a more recent one), and the entries of
+        the rows are checked with a few listings of the containers modified since they
+        were taken. Rows with modified containers are indexed as usual
+
+        Parameters
+        ----------
+        snapshot : JobSnapshot
+            the snapshot handed to the job
+
+        Returns
+        -------
+        set[RowKey]
+            the keys of the rows whose entries are out of date
+        """
+        path = self.tree_snapshot_path(snapshot.dataset_id)
+        cached = TreeSnapshot.load(path)
+        if cached is None or cached.taken < snapshot.tree.taken:
+            snapshot.tree.save(path)
+        with self.connection:
+            stale = self._stale_job_rows(snapshot)
+        self._job_rows[snapshot.dataset_id] = {
+            k: v for k, v in snapshot.rows.items() if k not in stale
+        }
+        logger.debug(
+            "Installed job snapshot of %s with %s rows (%s out of date)",
+            snapshot.dataset_id,
+            len(snapshot.rows),
+            len(stale),
+        )
+        return stale
+
+    def _stale_job_rows(self, snapshot: JobSnapshot) -> ty.Set[RowKey]:
+        """Returns the keys of the rows in the snapshot whose containers (or their
+        acquisitions) have been modified since it was taken"""
+        if not snapshot.rows:
+            return set()
+        project_id = snapshot.tree.project_id
+        modified_filter = self._modified_filter(snapshot.taken)
+        modified = set()
+        for method, parent in (
+            (self.connection.get_project_subjects, None),
+            (self.connection.get_project_sessions, None),
+            (self.connection.get_project_acquisitions, "session"),
+        ):
+            for container in self._iter_pages(method, project_id, filter=modified_filter):
+                modified.add(
+                    getattr(container.parents, parent) if parent else container.id
+                )
+        resolver = ContainerResolver.from_leaves(project_id, snapshot.tree.leaves)
+        stale = {
+            k
+            for k in snapshot.rows
+            if k != () and resolver.resolve(k) in modified
+        }
+        if () in snapshot.rows:
+            fwproject = self._lookup_project(snapshot.dataset_id)
+            if fwproject.modified > snapshot.taken - self.MODIFIED_FILTER_OVERLAP:
+                stale.add(())
+        return stale
+
+    def launch_job(
+        self,
+        gear_id: str,
+        row: DataRow,
+        config: ty.Optional[ty.Dict[str, ty.Any]] = None,
+        tags: ty.Optional[ty.List[str]] = None,
+        inputs: ty.Optional[ty.Dict[str, flywheel.FileReference]] = None,
+        snapshot: bool = True,
+    ) -> str:
+        """Launches a gear on the container that corresponds to a row
+
+        Parameters
+        ----------
+        gear_id : str
+            the ID of the gear to launch
+        row : DataRow
+            the row to launch the gear on
+        config : dict[str, Any], optional
+            the configuration of the gear
+        tags : list[str], optional
+            tags to add to the job
+        inputs : dict[str, flywheel.FileReference], optional
+            files to stage as inputs of the job (in addition to those the gear
+            selects itself), e.g. the tree uploaded by `upload_job_tree`
+        snapshot : bool
+            hand the job a snapshot of the tree of the dataset and the entries of the
+            row (see `job_snapshot`) in its configuration, so it doesn't need to scan
+            the project. Skipped if the configuration already holds one
+
+        Returns
+        -------
+        str
+            the ID of the job
+        """
+        key = EntryIndex.row_key(row)
+        if key is None:
+            raise ArcanaUsageError(
+                f"Cannot launch jobs on {row} as it doesn't correspond to a Flywheel "
+                "container"
+            )
+        destination = flywheel.JobDestination(
+            type=ROW_CONTAINER_TYPES[len(key)][:-1], id=self.resolve_container_id(row)
+        )
+        config = dict(config or {})
+        with self.connection:
+            if snapshot and SNAPSHOT_KEY not in config:
+                config[SNAPSHOT_KEY] = json.dumps(
+                    self.job_snapshot(row.dataset.id, [row]).asdict(),
+                    separators=(",", ":"),
+                )
+            created = self.connection.add_job(
+                flywheel.Job(
+                    gear_id=gear_id,
+                    destination=destination,
+                    config=config,
+                    tags=tags or [],
+                    inputs=inputs or None,
+                )
+            )
+        return created.id
+
+    def upload_job_tree(self, snapshot: JobSnapshot, name: str) -> flywheel.FileReference:
+        """Uploads the tree of a snapshot to a file of the project, so that it can be
+        handed to each of a batch of jobs as an input (see `launch_job`) instead of
+        being copied into the configuration of every job
+
+        Parameters
+        ----------
+        snapshot : JobSnapshot
+            the snapshot taken for the batch
+        name : str
+            the name of the file to upload the tree to
+
+        Returns
+        -------
+        flywheel.FileReference
+            the reference to the uploaded file
+        """
+        contents = json.dumps(snapshot.tree_asdict(), separators=(",", ":"))
+        project_id = snapshot.tree.project_id
+        with self.connection:
+            self.connection.upload_file_to_container(
+                project_id, FileSpec(name, contents=contents.encode("utf-8"))
+            )
+        return flywheel.FileReference(type="project", id=project_id, name=name)
+
+    def list_jobs(self, tag: str, since: ty.Optional[datetime] = None) -> list:
+        """Lists the jobs with the given tag, e.g. of a batch (see `launch_batch`)
+
+        Parameters
+        ----------
+        tag : str
+            the tag of the jobs
+        since : datetime, optional
+            only list the jobs modified since the given time (e.g. that have changed
+            state since the previous listing)
+
+        Returns
+        -------
+        list[flywheel.JobListEntry]
+            the jobs
+        """
+        kwargs = {"tags": tag}
+        if since is not None:
+            kwargs["filter"] = self._modified_filter(since)
+        with self.connection:
+            return list(self._iter_pages(self.connection.jobs_api.get_all_jobs, **kwargs))
+
+    def launch_batch(
+        self, gear_id: str, rows: ty.Iterable[DataRow], **kwargs
+    ) -> BatchProgress:
+        """Launches a gear on each of the given rows with a bounded number of jobs in
+        flight, waiting for all of them to finish (see `BatchLauncher`)
+
+        Parameters
+        ----------
+        gear_id : str
+            the ID of the gear to launch
+        rows : Iterable[DataRow]
+            the rows to launch the gear on
+        **kwargs
+            passed through to `BatchLauncher`
+
+        Returns
+        -------
+        BatchProgress
+            the progress of the batch once all of its jobs have finished
+        """
+        return BatchLauncher(store=self, gear_id=gear_id, rows=rows, **kwargs).run()
+
+    def register_staged_files(self, staged_files: ty.Iterable[StagedFile]):
+        """Registers files that have already been staged on local disk (e.g. the
+        inputs of the gear job the store is used in), so that file-sets made up of
+        them are linked into the cache in place instead of being downloaded. The
+        staged files are trusted to be the current versions of the files on the
+        server, so they aren't hashed again
+
+        Parameters
+        ----------
+        staged_files : Iterable[StagedFile]
+            the staged files
+        """
+        for staged_file in staged_files:
+            self._staged_files[(staged_file.container_id, staged_file.name)] = (
+                staged_file
+            )
+
+    def _link_staged(self, entry: DataEntry) -> bool:
+        """Fills the cache entry of a file-set from staged files if all of its files
+        have been staged, marking it as up to date"""
+        if not entry.checksums:
+            return False
+        _, container_id = self._parse_uri(entry.uri)
+        staged = [self._staged_files.get((container_id, n)) for n in entry.checksums]
+        if None in staged:
+            return False
+        cache_path = self.cache_path(entry.uri)
+        if cache_path.exists():
+            shutil.rmtree(cache_path)
+        cache_path.mkdir(parents=True)
+        for staged_file in staged:
+            os.symlink(staged_file.path.absolute(), cache_path / staged_file.name)
+        with open(str(cache_path) + self.CHECKSUM_SUFFIX, "w", **JSON_ENCODING) as f:
+            json.dump(entry.checksums, f, indent=2)
+        logger.debug("Using %s files staged for %s in place", len(staged), entry.uri)
+        return True
+
+    @property
+    def cache_manager(self) -> CacheManager:
+        """Manages the space used by the cache directory (see `cache_max_bytes`)"""
+        return self._cache_manager
+
+    def _record_cache_access(self, cache_path: Path):
+        """Marks the entry as recently used, and pins it until the outermost
+        connection context of the thread exits if the cache is size-bounded, as the
+        thread is presumably using it until then"""
+        self._cache_manager.touch(cache_path)
+        if self.cache_max_bytes is None:
+            return
+        held = self._held_cache_entries.__dict__.setdefault("paths", set())
+        if cache_path in held:
+            return
+        with self._cache_pins_lock:
+            pin = self._cache_pins.get(cache_path)
+            if pin is None:
+                self._cache_pins[cache_path] = [self._cache_manager.pin(cache_path), 1]
+            else:
+                pin[1] += 1
+        held.add(cache_path)
+
+    def _release_cache_pins(self):
+        """Releases the cache entries held by the current thread, unpinning those that
+        aren't held by any other thread"""
+        held = getattr(self._held_cache_entries, "paths", None)
+        if not held:
+            return
+        self._held_cache_entries.paths = set()
+        with self._cache_pins_lock:
+            for cache_path in held:
+                pin = self._cache_pins[cache_path]
+                pin[1] -= 1
+                if not pin[1]:
+                    del self._cache_pins[cache_path]
+                    self._cache_manager.unpin(pin[0])
+        logger.debug("Released %s pinned cache entries", len(held))
+
+    @instrumented
     def download_files(self, entry: DataEntry, download_dir: Path) -> Path:
         """Download files associated with the given entry in the data store, using
         `download_dir` as temporary storage location (will be monitored by downloads
@@ -270,8 +1370,40 @@ class Flywheel(RemoteStore):
         output_dir : Path
             a directory containing the downloaded files/directories and nothing else
         """
-        raise NotImplementedError
+        container_type, container_id = self._parse_uri(entry.uri)
+        output_dir = download_dir / "files"
+        output_dir.mkdir()
+        with self.connection:
+            fwfiles = self.connection.get(container_id).files or []
+            # The SDK client is thread-safe, but the connection manager isn't so the
+            # session is passed to the worker threads directly
+            client = self.connection.session
+            with ThreadPoolExecutor(max_workers=self.download_threads) as pool:
+                futures = [
+                    pool.submit(
+                        self._fetch_file,
+                        client,
+                        container_type,
+                        container_id,
+                        fwfile,
+                        local_path(output_dir, fwfile.name),
+                        download_dir,
+                    )
+                    for fwfile in fwfiles
+                ]
+                num_bytes = sum(f.result() for f in futures)
+        self._metrics.add_bytes("store", "download_files", num_bytes)
+        self._cache_manager.record_added(num_bytes)
+        logger.debug(
+            "Downloaded %s bytes of %s files from %s (the rest were linked from the "
+            "blob store)",
+            num_bytes,
+            len(fwfiles),
+            entry.uri,
+        )
+        return output_dir
 
+    @instrumented
     def upload_files(self, cache_path: Path, entry: DataEntry):
         """Upload all files contained within `input_dir` to the specified entry in the
         data store
@@ -284,13 +1416,46 @@ class Flywheel(RemoteStore):
             the entry in the data store to upload the files to
         """
 
-        if "@" in entry.uri:
-            analysis = self.connection.get(entry.uri)
-            analysis.upload_output(cache_path)
-        else:
-            acquisition = self.connection.get(entry.uri)
-            acquisition.upload_file(cache_path)
+        container_type, container_id = self._parse_uri(entry.uri)
+        journal = UploadJournal.load(cache_path, entry.uri)
+        with self.connection:
+            remote_sizes = {
+                f.name: f.size
+                for f in (self.connection.get(container_id).files or [])
+            }
+            to_upload = []
+            for name, fspath in iter_local_files(cache_path):
+                size = fspath.stat().st_size
+                if journal.is_uploaded(name, size, remote_sizes):
+                    logger.debug("Skipping %s, already uploaded to %s", name, entry)
+                else:
+                    to_upload.append((name, fspath, size))
+            client = self.connection.session
+            with ThreadPoolExecutor(max_workers=self.upload_threads) as pool:
+                futures = [
+                    pool.submit(
+                        self._upload_file,
+                        client,
+                        container_type,
+                        container_id,
+                        name,
+                        fspath,
+                        size,
+                        journal,
+                    )
+                    for name, fspath, size in to_upload
+                ]
+                for future in futures:
+                    future.result()
+        self._metrics.add_bytes(
+            "store", "upload_files", sum(size for _, _, size in to_upload)
+        )
+        self._cache_manager.record_added(
+            sum(p.stat().st_size for _, p in iter_local_files(cache_path))
+        )
+        journal.clear()
 
+    @instrumented
     def download_value(
         self, entry: DataEntry
     ) -> ty.Union[float, int, str, list[float], list[int], list[str]]:
@@ -307,8 +1472,28 @@ class Flywheel(RemoteStore):
         value : float or int or str or list[float] or list[int] or list[str]
             The value of the Field
         """
-        raise NotImplementedError
-
+        _, container_id = self._parse_uri(entry.uri)
+        # Values that have been written but not flushed yet
+        found, value = self._field_buffer.get(container_id, entry.path)
+        if found:
+            return value
+        # Values listed when the entries of the dataset were indexed
+        key = EntryIndex.row_key(entry.row)
+        index = self._entry_indices.get(entry.row.dataset.id)
+        if index is not None and key is not None:
+            found, value = index.field_value(key, entry.path)
+            if found:
+                return value
+        with self.connection:
+            info = self.connection.get(container_id).info or {}
+        try:
+            return info[entry.path]
+        except KeyError:
+            raise ArcanaUsageError(
+                f"No value stored for field {entry.path} in {entry.uri}"
+            ) from None
+
+    @instrumented
     def upload_value(
         self,
         value: ty.Union[float, int, str, list[float], list[int], list[str]],
@@ -323,8 +1508,16 @@ class Flywheel(RemoteStore):
         entry : DataEntry
             the entry to store the value in
         """
-        raise NotImplementedError
-
+        _, container_id = self._parse_uri(entry.uri)
+        # Writes are buffered and uploaded in a single info update per container when
+        # the outermost connection context exits (see `flush_writes`)
+        self._field_buffer.put(container_id, entry.path, value)
+        key = EntryIndex.row_key(entry.row)
+        index = self._entry_indices.get(entry.row.dataset.id)
+        if index is not None and key is not None:
+            index.set_field_value(key, entry.path, value, entry.uri)
+
+    @instrumented
     def create_fileset_entry(
         self, path: str, datatype: type, row: DataRow
     ) -> DataEntry:
@@ -346,30 +1539,35 @@ class Flywheel(RemoteStore):
             the created entry for the field
         """
 
-        # Determine level (proj, sub, sess)
-        fwrow = determine_fwrow(row)  # noqa
-
-        if "@" in entry.uri:  # noqa
-            # file_refs refer to to the input files used to generate the
-            # analysis results
-            # calculate with: file_ref = acquisition.get_file("FILENAME").ref()
-            file_refs = "it worked"
-            analysis = fwrow.add_analysis(label=row.label, inputs=[file_refs])
-            fw_id = analysis.id
-        else:
-            # COPY XNAT EXCEPTION
-            acquisition = fwrow.add_acquisition(f"label={row.label}")
-            fw_id = acquisition.id
-
-        logger.debug("Created entry %s", fw_id)
+        with self.connection:
+            container_id = self.resolve_container_id(row)
+            project_id = self._get_resolver(row.dataset.id).project_id
+            if DataEntry.path_is_derivative(path):
+                # Derivatives are stored in analyses labelled with the entry path,
+                # which can be attached to projects, subjects or sessions
+                if row.frequency == Clinical.dataset:
+                    container_type = "project"
+                else:
+                    container_type = row.frequency.name
+                add_analysis = getattr(self.connection, f"add_{container_type}_analysis")
+                fw_id = add_analysis(container_id, flywheel.AnalysisInput(label=path))
+                uri = self._entry_uri(project_id, "analyses", fw_id)
+            elif row.frequency == Clinical.session:
+                fw_id = self.connection.add_acquisition(
+                    flywheel.Acquisition(label=path, session=container_id)
+                )
+                uri = self._entry_uri(project_id, "acquisitions", fw_id)
+            else:
+                raise ArcanaUsageError(
+                    f"Cannot create non-derivative entry '{path}' in {row}, as "
+                    "Flywheel only supports acquisitions within sessions"
+                )
+        logger.debug("Created entry %s", uri)
+        self._discard_job_row(row)
         # Add corresponding entry to row
-        entry = row.add_entry(
-            path=path,
-            datatype=datatype,
-            uri=fw_id,
-        )
-        return entry
+        return row.add_entry(path=path, datatype=datatype, uri=uri)
 
+    @instrumented
     def create_field_entry(self, path: str, datatype: type, row: DataRow) -> DataEntry:
         """
         Creates a new data entry to store a field
@@ -388,8 +1586,24 @@ class Flywheel(RemoteStore):
         entry : DataEntry
             the created entry for the field
         """
-        raise NotImplementedError
+        # Fields are stored in the info of the container corresponding to the row, so
+        # the entry doesn't need to be created on the server until it is written to
+        container_id = self.resolve_container_id(row)
+        container_type = ROW_CONTAINER_TYPES[len(EntryIndex.row_key(row))]
+        uri = self._entry_uri(
+            self._get_resolver(row.dataset.id).project_id, container_type, container_id
+        )
+        self._discard_job_row(row)
+        return row.add_entry(path=path, datatype=datatype, uri=uri)
+
+    def _discard_job_row(self, row: DataRow):
+        """Stops populating a row from the entries handed over by the launcher once
+        entries have been created in it, as they are no longer complete"""
+        job_rows = self._job_rows.get(row.dataset.id)
+        if job_rows:
+            job_rows.pop(EntryIndex.row_key(row), None)
 
+    @instrumented
     def get_checksums(self, uri: str) -> dict[str, str]:
         """
         Downloads the checksum digests associated with the files in the file-set.
@@ -407,8 +1621,51 @@ class Flywheel(RemoteStore):
             the checksums downloaded from the remote store. Keys are the
             paths of the files and the values are the checksums of their contents
         """
-        raise NotImplementedError
+        project_id = self._uri_project_id(uri)
+        _, container_id = self._parse_uri(uri)
+        with self.connection:
+            container = self.connection.get(container_id)
+        with self._container_digests_lock:
+            return self._get_container_digests(project_id).update(container)
+
+    @instrumented
+    def get_checksums_batch(
+        self, uris: ty.Iterable[str]
+    ) -> ty.Dict[str, ty.Dict[str, str]]:
+        """Downloads the checksum digests of many entries at once. The containers in
+        each project are listed in a few paged requests, and only those modified
+        since they were last listed are returned by the server, with the digests of
+        the remaining containers read from the cache
+
+        Parameters
+        ----------
+        uris : Iterable[str]
+            uris of the data items to download the checksums for
 
+        Returns
+        -------
+        checksums : dict[str, dict[str, str]]
+            the checksums downloaded from the remote store keyed by the uri of each
+            item (see `get_checksums`)
+        """
+        by_project = defaultdict(list)
+        for uri in uris:
+            by_project[self._uri_project_id(uri)].append(uri)
+        checksums = {}
+        with self.connection:
+            for project_id, project_uris in by_project.items():
+                container_types = set(self._parse_uri(u)[0] for u in project_uris)
+                with self._container_digests_lock:
+                    digests = self._list_container_digests(project_id, container_types)
+                for uri in project_uris:
+                    container_checksums = digests.lookup(self._parse_uri(uri)[1])
+                    if container_checksums is None:
+                        # e.g. containers that have since been moved to another project
+                        container_checksums = self.get_checksums(uri)
+                    checksums[uri] = container_checksums
+        return checksums
+
+    @instrumented
     def calculate_checksums(self, fileset: FileSet) -> dict[str, str]:
         """
         Calculates the checksum digests associated with the files in the file-set.
@@ -417,8 +1674,8 @@ class Flywheel(RemoteStore):
 
         Parameters
         ----------
-        uri: str
-            uri of the data item to download the checksums for
+        fileset : FileSet
+            the file-set to calculate the checksums for
 
         Returns
         -------
@@ -426,25 +1683,692 @@ class Flywheel(RemoteStore):
             the checksums calculated from the local file-set. Keys are the
             paths of the files and the values are the checksums of their contents
         """
-        raise NotImplementedError
+        root = fileset.parent
+        files = {}
+        for fspath in fileset.fspaths:
+            for _, path in iter_local_files(fspath):
+                files[path.relative_to(root).as_posix()] = path
+        # Only persist digests of file-sets within the cache, so as not to litter
+        # the directories of file-sets passed to the store with sidecars
+        if self.cache_dir.resolve() in root.resolve().parents:
+            sidecar = Path(str(root) + DigestCache.SUFFIX)
+        else:
+            sidecar = None
+        return calculate_digests(
+            files,
+            self.checksum_algorithm,
+            sidecar=sidecar,
+            max_workers=self.checksum_processes,
+        )
 
     ##################
     # Helper methods #
     ##################
 
-    def get_fwrow(self, row: DataRow):
-        """ """
+    def container_digests_path(self, project_id: str) -> Path:
+        """Path to the cached digests of the containers of the given project"""
+        return self.cache_dir / self.CONTAINER_DIGESTS_DIR / (project_id + ".json")
 
+    @property
+    def blob_store(self) -> BlobStore:
+        """The content-addressed store of the files downloaded into the cache"""
+        return BlobStore(self.cache_dir / self.BLOB_STORE_DIR)
+
+    def tree_snapshot_path(self, dataset_id: str) -> Path:
+        """Path to the snapshot of the tree of the given dataset in the cache"""
+        return self.cache_dir / self.TREE_SNAPSHOT_DIR / (
+            str(dataset_id).replace("/", "__") + ".json"
+        )
+
+    def _lookup_project(self, dataset_id: str):
+        return self.connection.lookup(f"arcana_tests/{dataset_id}")
+
+    def _scan_dataset(self, dataset_id: str) -> ty.Tuple[str, ty.List[TreeLeaf]]:
+        """Scans the leaves of a dataset, from its snapshot if enabled, returning them
+        along with the ID of its project. The leaves of datasets that only include
+        some of the subjects of the project are filtered from an up-to-date
+        snapshot if there is one, otherwise just the matching leaves are scanned (and
+        not saved as a snapshot, as they are only part of the project)"""
+        tree_filter = self._tree_filters.get(dataset_id)
+        if self.tree_snapshots:
+            snapshot = self._load_tree_snapshot(
+                dataset_id, rescan=tree_filter is None
+            )
+            if snapshot is not None:
+                leaves = snapshot.leaves
+                if tree_filter is not None:
+                    leaves = [leaf for leaf in leaves if tree_filter.matches(leaf)]
+                return snapshot.project_id, leaves
+        fwproject = self._lookup_project(dataset_id)
+        return fwproject.id, self._scan_project(fwproject, tree_filter)
+
+    def _scan_project(
+        self, fwproject, tree_filter: ty.Optional[TreeFilter] = None
+    ) -> list[TreeLeaf]:
+        if self.bulk_tree_scan:
+            leaves = self._scan_leaves_bulk(fwproject.id, tree_filter)
+        else:
+            leaves = self._scan_leaves(fwproject, tree_filter)
+        if tree_filter is not None:
+            # The server filters may match a superset of the leaves (e.g. criteria
+            # that can't be expressed in the filter syntax are left out)
+            leaves = [leaf for leaf in leaves if tree_filter.matches(leaf)]
+        return leaves
+
+    def _scan_leaves(
+        self, fwproject, tree_filter: ty.Optional[TreeFilter] = None
+    ) -> list[TreeLeaf]:
+        """Scans the sessions of a project by walking down the hierarchy, i.e. one
+        request per subject"""
+        subject_kwargs = {}
+        if tree_filter is not None:
+            subject_kwargs = self._filter_kwargs(tree_filter.expression("label"))
+        return sort_leaves(
+            TreeLeaf.from_session(fwsubject, fwsess)
+            for fwsubject in self._iter_pages(
+                self.connection.get_project_subjects, fwproject.id, **subject_kwargs
+            )
+            for fwsess in self._iter_pages(
+                self.connection.get_subject_sessions, fwsubject.id
+            )
+        )
+
+    def _scan_leaves_bulk(
+        self, project_id: str, tree_filter: ty.Optional[TreeFilter] = None
+    ) -> list[TreeLeaf]:
+        """Scans the sessions of a project along with the label of their subject in a
+        single paged data-view query, projected onto just the fields required to add
+        them to the tree. The view is sorted so that the order of the sessions is
+        stable between the requests for its pages, which would otherwise overlap or
+        leave gaps"""
+        filter_kwargs = {}
+        if tree_filter is not None:
+            filter_kwargs = self._filter_kwargs(tree_filter.expression("subject.label"))
+        view = self.connection.View(
+            columns=list(TREE_VIEW_COLUMNS),
+            include_ids=True,
+            include_labels=True,
+            error_column=False,
+            process_files=False,
+            sort=True,
+        )
+        leaves = []
+        skip = 0
+        while True:
+            resp = self.connection.read_view_data(
+                view,
+                project_id,
+                format="json-flat",
+                skip=skip,
+                limit=self.page_size,
+                **filter_kwargs,
+            )
+            try:
+                records = json.load(resp)
+            finally:
+                resp.close()
+            leaves.extend(TreeLeaf.from_view_row(r) for r in records)
+            if len(records) < self.page_size:
+                break
+            skip += self.page_size
+        logger.debug(
+            "Scanned %s sessions of %s in %s page(s)",
+            len(leaves),
+            project_id,
+            skip // self.page_size + 1,
+        )
+        return sort_leaves(leaves)
+
+    def _load_tree_snapshot(
+        self, dataset_id: str, rescan: bool = True
+    ) -> ty.Optional[TreeSnapshot]:
+        """Loads the snapshot of the dataset's tree from the cache and refreshes it with
+        the subjects and sessions modified since it was taken, or fully scans the
+        project if there is no snapshot or it is older than `tree_snapshot_max_age`
+        (returning None instead if `rescan` is False)"""
+        path = self.tree_snapshot_path(dataset_id)
+        snapshot = TreeSnapshot.load(path)
+        now = datetime.now(timezone.utc)
+        if snapshot is None or (now - snapshot.scanned) > timedelta(
+            seconds=self.tree_snapshot_max_age
+        ):
+            if not rescan:
+                return None
+            fwproject = self._lookup_project(dataset_id)
+            snapshot = TreeSnapshot(
+                project_id=fwproject.id,
+                scanned=now,
+                taken=now,
+                leaves=self._scan_project(fwproject),
+            )
+            snapshot.save(path)
+            return snapshot
+        modified_filter = self._modified_filter(snapshot.taken)
+        # Sessions that have been added, moved or modified trigger a rescan of their
+        # subject, as do relabelled subjects
+        subject_ids = set(
+            s.parents.subject
+            for s in self._iter_pages(
+                self.connection.get_project_sessions,
+                snapshot.project_id,
+                filter=modified_filter,
+            )
+        )
+        subject_ids.update(
+            s.id
+            for s in self._iter_pages(
+                self.connection.get_project_subjects,
+                snapshot.project_id,
+                filter=modified_filter,
+            )
+        )
+        if subject_ids:
+            subjects = {}
+            for subject_id in subject_ids:
+                fwsubject = self.connection.get_subject(subject_id)
+                subjects[subject_id] = [
+                    TreeLeaf.from_session(fwsubject, s)
+                    for s in self._iter_pages(
+                        self.connection.get_subject_sessions, subject_id
+                    )
+                ]
+            snapshot = snapshot.updated(taken=now, subjects=subjects)
+            snapshot.save(path)
+            logger.debug(
+                "Refreshed %s subjects in tree snapshot of %s",
+                len(subjects),
+                dataset_id,
+            )
+        return snapshot
+
+    def _get_container_digests(self, project_id: str) -> ContainerDigests:
+        """Returns the cached digests of the containers in the project, loading them
+        from the cache directory if required. Must be called with the lock held"""
+        try:
+            return self._container_digests[project_id]
+        except KeyError:
+            digests = self._container_digests[project_id] = ContainerDigests.load(
+                self.container_digests_path(project_id), project_id
+            )
+            return digests
+
+    def _list_container_digests(
+        self, project_id: str, container_types: ty.Set[str]
+    ) -> ContainerDigests:
+        """Updates the cached digests of the given types of containers in the project
+        with those modified since they were last listed. Must be called with the
+        lock held"""
+        digests = self._get_container_digests(project_id)
+        now = datetime.now(timezone.utc)
+        for container_type in container_types:
+            kwargs = {}
+            if container_type in digests.listed:
+                kwargs["filter"] = self._modified_filter(digests.listed[container_type])
+            if container_type == "acquisitions":
+                containers = list(
+                    self._iter_pages(
+                        self.connection.get_project_acquisitions, project_id, **kwargs
+                    )
+                )
+            elif container_type == "analyses":
+                containers = list(
+                    self._iter_pages(
+                        self.connection.get_project_analyses, project_id, **kwargs
+                    )
+                )
+                # Listings of the analyses of sub-containers can't be filtered, but
+                # unchanged analyses are still matched against the cache
+                for subcontainer in ("subjects", "sessions"):
+                    containers.extend(
+                        self.connection.get_analyses(
+                            "projects", project_id, subcontainer
+                        )
+                    )
+            else:
+                raise ArcanaUsageError(
+                    f"Unrecognised container type '{container_type}' in URI"
+                )
+            for container in containers:
+                digests.update(container)
+            digests.listed[container_type] = now
+            logger.debug(
+                "Listed %s %s modified in %s", len(containers), container_type, project_id
+            )
+        digests.save(self.container_digests_path(project_id))
+        return digests
+
+    def _get_entry_index(self, dataset_id: str, key: ty.Tuple[str, ...]) -> EntryIndex:
+        """Returns the index of the entries of the page of the dataset that holds the
+        row, building it in a single bulk pass over the containers of the page if it
+        isn't loaded (or over the whole project if it fits in a single page)"""
+        with self._entry_indices_lock:
+            paged = self._entry_indices.get(dataset_id)
+            if paged is None:
+                resolver = self._get_resolver(dataset_id)
+                max_pages = None
+                if self.max_resident_rows is not None:
+                    # Enough pages to hold the resident rows, plus the one being built
+                    max_pages = -(-self.max_resident_rows // self.index_page_size) + 1
+                paged = self._entry_indices[
+                    dataset_id
+                ] = PagedEntryIndex.from_container_ids(
+                    resolver.project_id,
+                    resolver.container_ids,
+                    page_size=self.index_page_size,
+                    max_pages=max_pages,
+                )
+            page_number = paged.page_of(key)
+            if page_number is None:
+                return EntryIndex(project_id=paged.project_id)
+            index = paged.get(page_number)
+            if index is not None:
+                return index
+            with self.connection:
+                fwproject = self._lookup_project(dataset_id)
+                if paged.num_pages == 1 and self._tree_filters.get(dataset_id) is None:
+                    index = self._build_entry_index(fwproject)
+                else:
+                    # Only the containers of the page (i.e. of the subjects and
+                    # sessions included in the dataset) are listed
+                    if paged.analyses is None:
+                        paged.analyses = self._list_analysis_entries(fwproject.id)
+                    index = self._build_entry_index(
+                        fwproject, paged.pages[page_number], paged.analyses
+                    )
+            paged.add(page_number, index)
+            logger.debug(
+                "Indexed page %s of %s of the entries of %s",
+                page_number + 1,
+                paged.num_pages,
+                dataset_id,
+            )
+            return index
+
+    def _row_used(self, row: DataRow, num_entries: ty.Optional[int] = None):
+        """Records the use of a populated row, and releases the entries of the least
+        recently used rows beyond `max_resident_rows` so that they are repopulated if
+        they are accessed again. Rows that have had entries added since they were
+        populated (e.g. derivatives being created) aren't released"""
+        if self.max_resident_rows is None:
+            return
+        key = (row.dataset.id, str(row.frequency), row.id)
+        released = []
+        with self._resident_rows_lock:
+            if num_entries is None:
+                try:
+                    ref, num_entries = self._resident_rows[key]
+                except KeyError:
+                    return
+                if ref() is not row:
+                    # The row was recreated (e.g. with the tree) since it was populated
+                    return
+            self._resident_rows[key] = (weakref.ref(row), num_entries)
+            self._resident_rows.move_to_end(key)
+            while len(self._resident_rows) > self.max_resident_rows:
+                _, (ref, populated_entries) = self._resident_rows.popitem(last=False)
+                idle_row = ref()
+                if idle_row is not None:
+                    released.append((idle_row, populated_entries))
+        with self._rows_lock:
+            num_released = sum(
+                release_row_entries(r, expected=n) for r, n in released
+            )
+        if num_released:
+            logger.debug("Released the entries of %s idle rows", num_released)
+
+    def _build_entry_index(
+        self,
+        fwproject,
+        container_ids: ty.Optional[ty.Dict[ty.Tuple[str, ...], str]] = None,
+        analyses: ty.Optional[ty.Dict[str, ty.List[IndexedEntry]]] = None,
+    ) -> EntryIndex:
+        """Lists all the subjects, sessions, acquisitions and analyses in the project
+        (a handful of paged requests regardless of its size) and indexes the entries
+        they contain by the key of their corresponding row. If the IDs of subject and
+        session containers are provided (i.e. of a page of the project or the subset
+        included in the dataset), only those containers and their acquisitions are
+        listed. The derivative entries of the project can also be provided so they
+        aren't listed again (see `_list_analysis_entries`)"""
+        project_id = fwproject.id
+        index = EntryIndex(project_id=project_id)
+        subject_filters = session_filters = None
+        if container_ids is not None:
+            subject_filters = TreeFilter.in_expressions(
+                "_id", (i for k, i in container_ids.items() if len(k) == 1)
+            )
+            session_filters = TreeFilter.in_expressions(
+                "_id", (i for k, i in container_ids.items() if len(k) == 2)
+            )
+        fwsubjects = list(
+            self._iter_filtered(
+                self.connection.get_project_subjects, project_id, subject_filters
+            )
+        )
+        fwsessions = list(
+            self._iter_filtered(
+                self.connection.get_project_sessions, project_id, session_filters
+            )
+        )
+        keys = {project_id: ()}
+        keys.update((s.id, (s.label,)) for s in fwsubjects)
+        keys.update(
+            (s.id, keys[s.parents.subject] + (s.label,))
+            for s in fwsessions
+            if s.parents.subject in keys
+        )
+        index.container_ids.update((k, i) for i, k in keys.items())
+        for container in [fwproject] + fwsubjects + fwsessions:
+            if container.id in keys:
+                key = keys[container.id]
+                info = self._container_info(container)
+                # Cache the provenance records while the info is at hand
+                with self._provenance_lock:
+                    self._provenance_cache[container.id] = decode_provenance(
+                        (info or {}).get(PROVENANCE_INFO_KEY)
+                    )
+                index.add_fields(
+                    key,
+                    info,
+                    uri=self._entry_uri(
+                        project_id, ROW_CONTAINER_TYPES[len(key)], container.id
+                    ),
+                )
+        # Primary file-sets: acquisitions of each session in acquisition order
+        fwacquisitions = sorted(
+            self._iter_filtered(
+                self.connection.get_project_acquisitions,
+                project_id,
+                (
+                    TreeFilter.in_expressions("parents.session", (s.id for s in fwsessions))
+                    if container_ids is not None
+                    else None
+                ),
+            ),
+            key=lambda a: (a.created is None, a.created or 0, a.label),
+        )
+        orders = {}
+        for fwacq in fwacquisitions:
+            try:
+                key = keys[fwacq.parents.session]
+            except KeyError:
+                continue
+            order = orders[key] = orders.get(key, 0) + 1
+            if not index.add_fileset(
+                key,
+                path=fwacq.label,
+                uri=self._entry_uri(project_id, "acquisitions", fwacq.id),
+                files=fwacq.files,
+                order=order,
+            ):
+                logger.warning(
+                    "Ignoring acquisition %s in %s as there is already an "
+                    "acquisition labelled '%s'",
+                    fwacq.id,
+                    "/".join(key),
+                    fwacq.label,
+                )
+        # Derivative file-sets: analyses attached to the project, subjects and
+        # sessions, labelled by the path of the entry they hold (i.e. with "@")
+        if analyses is None:
+            analyses = self._list_analysis_entries(project_id)
+        for parent_id, parent_entries in analyses.items():
+            try:
+                key = keys[parent_id]
+            except KeyError:
+                continue
+            for entry in parent_entries:
+                index.add(key, entry)
+        logger.debug(
+            "Indexed entries of %s subjects, %s sessions and %s acquisitions in %s",
+            len(fwsubjects),
+            len(fwsessions),
+            len(fwacquisitions),
+            fwproject.label,
+        )
+        return index
+
+    def _list_analysis_entries(
+        self, project_id: str
+    ) -> ty.Dict[str, ty.List[IndexedEntry]]:
+        """Lists the analyses attached to the project and its subjects and sessions
+        that hold derivative entries, keyed by the ID of the container they are
+        attached to"""
+        fwanalyses = list(self.connection.get_project_analyses(project_id))
+        for subcontainer in ("subjects", "sessions"):
+            fwanalyses.extend(
+                self.connection.get_analyses("projects", project_id, subcontainer)
+            )
+        analyses = defaultdict(list)
+        for fwanalysis in fwanalyses:
+            if not DataEntry.path_is_derivative(fwanalysis.label):
+                continue
+            analyses[fwanalysis.parent.id].append(
+                fileset_entry(
+                    fwanalysis.label,
+                    self._entry_uri(project_id, "analyses", fwanalysis.id),
+                    files=fwanalysis.files,
+                )
+            )
+        logger.debug("Listed %s analyses in %s", len(fwanalyses), project_id)
+        return dict(analyses)
+
+    def _container_provenance(self, container_id: str) -> ty.Dict[str, ty.Any]:
+        """Returns the provenance records of the entries in a container, loading them
+        from the server the first time they are accessed"""
+        with self._provenance_lock:
+            try:
+                return self._provenance_cache[container_id]
+            except KeyError:
+                pass
         with self.connection:
-            fwproject = self.connection.lookup(f"arcana_tests/{row.dataset.id}")
-            # Check level in hierarchy
-            if row.frequency == Clinical.dataset:
-                fwrow = fwproject
-            elif row.frequency == Clinical.subject:
-                fwrow = fwproject.get(row.frequency_id("subject"))
-            elif row.frequency == Clinical.session:
-                fwrow = fwproject.get(row.frequency_id("session"))
+            info = self.connection.get(container_id).info or {}
+        records = decode_provenance(info.get(PROVENANCE_INFO_KEY))
+        with self._provenance_lock:
+            return self._provenance_cache.setdefault(container_id, records)
+
+    def _container_info(self, container) -> ty.Optional[dict]:
+        """Returns the info of a container from a listing, fetching the container
+        separately if the listing only flagged that it has info"""
+        if container.info is None and getattr(container, "info_exists", False):
+            container = self.connection.get(container.id)
+        return container.info
+
+    @classmethod
+    def _entry_uri(cls, project_id: str, container_type: str, container_id: str):
+        return f"/projects/{project_id}/{container_type}/{container_id}"
+
+    @classmethod
+    def _uri_project_id(cls, uri: str) -> str:
+        return uri.split("/")[2]
+
+    @classmethod
+    def _modified_filter(cls, since: datetime) -> str:
+        """Filter for listings of containers modified after the given time (minus an
+        overlap to allow for clock skew between this host and the server)"""
+        since = since - cls.MODIFIED_FILTER_OVERLAP
+        return "modified>" + since.strftime("%Y-%m-%dT%H:%M:%S")
+
+    @classmethod
+    def _filter_kwargs(cls, expression: ty.Optional[str]) -> ty.Dict[str, str]:
+        return {"filter": expression} if expression else {}
+
+    @classmethod
+    def _parse_uri(cls, uri: str) -> ty.Tuple[str, str]:
+        """Splits an entry URI into the type and ID of the container it points to"""
+        container_type, container_id = uri.split("/")[-2:]
+        return container_type, container_id
+
+    def _fetch_file(
+        self,
+        client,
+        container_type: str,
+        container_id: str,
+        fwfile,
+        dest: Path,
+        progress_dir: Path,
+    ) -> int:
+        """Links a file of a container from the blob store into `dest` if a file with
+        the same digest has been downloaded before, otherwise downloads it and adds it
+        to the blob store, returning the number of bytes downloaded"""
+        digest = fwfile.hash if self.content_addressed_cache else None
+        if parse_digest(digest) is None:
+            return self._download_file(
+                client, container_type, container_id, fwfile.name, dest, progress_dir
+            )
+        blobs = self.blob_store
+        if blobs.link(digest, dest):
+            return 0
+        num_bytes = self._download_file(
+            client,
+            container_type,
+            container_id,
+            fwfile.name,
+            dest,
+            progress_dir,
+            digest=digest,
+        )
+        blobs.add(dest, digest)
+        return num_bytes
+
+    def _download_file(
+        self,
+        client,
+        container_type: str,
+        container_id: str,
+        file_name: str,
+        dest: Path,
+        progress_dir: Path,
+        digest: ty.Optional[str] = None,
+    ) -> int:
+        """Streams a single file from a container into `dest` in chunks, verifying its
+        contents against `digest` if provided"""
+        kwargs = {"_return_http_data_only": True, "_preload_content": False}
+        if container_type == "analyses":
+            method_name = "download_output_from_analysis_with_http_info"
+            resp = client.analyses_api.download_output_from_analysis_with_http_info(
+                container_id, file_name, **kwargs
+            )
+        else:
+            method_name = "download_file_from_container_with_http_info"
+            resp = client.containers_api.download_file_from_container_with_http_info(
+                container_id, file_name, **kwargs
+            )
+        hasher = None
+        if digest is not None:
+            algorithm, hexdigest = parse_digest(digest)
+            hasher = hashlib.new(algorithm)
+        try:
+            num_bytes = stream_to_file(
+                resp.iter_content(chunk_size=self.chunk_size),
+                dest,
+                progress_dir,
+                hasher=hasher,
+            )
+        finally:
+            resp.close()
+        self._metrics.add_bytes("sdk", method_name, num_bytes)
+        if hasher is not None and hasher.hexdigest() != hexdigest:
+            dest.unlink()
+            raise ArcanaError(
+                f"Contents of '{file_name}' downloaded from {container_id} don't match "
+                f"the digest reported by the server ({digest})"
+            )
+        return num_bytes
+
+    def _upload_file(
+        self,
+        client,
+        container_type: str,
+        container_id: str,
+        file_name: str,
+        fspath: Path,
+        size: int,
+        journal: UploadJournal,
+    ):
+        """Uploads a single file to a container, streaming it from disk in chunks,
+        and records it in the journal once the server has accepted it"""
+        with open(fspath, "rb", buffering=self.chunk_size) as f:
+            spec = FileSpec(file_name, contents=f)
+            if container_type == "analyses":
+                method_name = "upload_output_to_analysis"
+                client.upload_output_to_analysis(container_id, spec)
             else:
-                raise NotImplementedError
+                method_name = "upload_file_to_container"
+                client.upload_file_to_container(container_id, spec)
+        self._metrics.add_bytes("sdk", method_name, size)
+        journal.record(file_name, size)
+
+    def _iter_pages(self, method, *args, **kwargs) -> ty.Iterator[ty.Any]:
+        """Iterates through all the results of a listing method of the SDK, requesting
+        them in pages of `page_size` records"""
+        kwargs["limit"] = self.page_size
+        while True:
+            results = method(*args, **kwargs)
+            yield from results
+            if len(results) < self.page_size:
+                break
+            kwargs["after_id"] = results[-1].id
+
+    def _iter_filtered(
+        self, method, container_id: str, filters: ty.Optional[ty.List[str]]
+    ) -> ty.Iterator[ty.Any]:
+        """Pages through a listing for each of the filter expressions, or the whole
+        listing if `filters` is None"""
+        if filters is None:
+            yield from self._iter_pages(method, container_id)
+            return
+        for expression in filters:
+            yield from self._iter_pages(method, container_id, filter=expression)
 
-            return fwrow
+    def get_fwrow(self, row: DataRow):
+        """Returns the Flywheel container (i.e. project, subject or session) that
+        corresponds to the row"""
+        with self.connection:
+            return self.connection.get(self.resolve_container_id(row))
+
+    def resolve_container_id(self, row: DataRow) -> str:
+        """Resolves a row to the ID of the Flywheel container it corresponds to from
+        the resolver index of the dataset, without querying the server unless the
+        index has expired or the container isn't in it (e.g. it was created by
+        another process after the index was built)
+
+        Parameters
+        ----------
+        row : DataRow
+            the row to resolve
+
+        Returns
+        -------
+        str
+            the Flywheel ID of the project, subject or session container
+        """
+        key = EntryIndex.row_key(row)
+        if key is None:
+            raise ArcanaUsageError(
+                f"Rows of frequency '{row.frequency}' don't correspond to Flywheel "
+                "containers"
+            )
+        container_id = self._get_resolver(row.dataset.id).resolve(key)
+        if container_id is None:
+            container_id = self._get_resolver(row.dataset.id, rebuild=True).resolve(
+                key
+            )
+        if container_id is None:
+            raise ArcanaUsageError(
+                f"Did not find a Flywheel container for {'/'.join(key)} in "
+                f"{row.dataset.id}"
+            )
+        return container_id
+
+    def _get_resolver(self, dataset_id: str, rebuild: bool = False) -> ContainerResolver:
+        """Returns the resolver index of the dataset, (re)building it if it hasn't been
+        built in this process, has expired or a rebuild is requested"""
+        with self._resolvers_lock:
+            resolver = self._resolvers.get(dataset_id)
+            if rebuild or resolver is None or resolver.expired(self.resolver_ttl):
+                with self.connection:
+                    resolver = ContainerResolver.from_leaves(
+                        *self._scan_dataset(dataset_id)
+                    )
+                self._resolvers[dataset_id] = resolver
+            return resolver
@@ -0,0 +1,69 @@
+"""
+Extraction of the archives of containers generated by the Flywheel server as they are
+streamed, without writing the archive itself to disk
+"""
+from __future__ import annotations
+import io
+import tarfile
+import typing as ty
+
+
+class ChunkReader(io.RawIOBase):
+    """Read-only file object over the chunks of a streamed response body, so it can be
+    consumed by readers that expect a file (e.g. `tarfile`) without buffering the
+    whole body in memory
+
+    Parameters
+    ----------
+    chunks : Iterable[bytes]
+        the chunks of the response body
+    """
+
+    def __init__(self, chunks: ty.Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._buffer = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._buffer:
+            try:
+                self._buffer = memoryview(next(self._chunks))
+            except StopIteration:
+                return 0
+        num_bytes = min(len(buffer), len(self._buffer))
+        buffer[:num_bytes] = self._buffer[:num_bytes]
+        self._buffer = self._buffer[num_bytes:]
+        return num_bytes
+
+
+def iter_tar_members(
+    chunks: ty.Iterable[bytes], chunk_size: int
+) -> ty.Iterator[ty.Tuple[str, ty.Iterator[bytes]]]:
+    """Iterates over the regular files in a (optionally compressed) tar archive as it
+    is streamed, yielding the name of each member along with an iterator over the
+    chunks of its contents. The contents of a member are only available until the
+    next member is requested; the parts that aren't consumed are skipped
+
+    Parameters
+    ----------
+    chunks : Iterable[bytes]
+        the chunks of the archive
+    chunk_size : int
+        the size of the chunks the contents of the members are read in
+
+    Yields
+    ------
+    name : str
+        the path of the member within the archive
+    contents : Iterator[bytes]
+        the chunks of the contents of the member
+    """
+    reader = io.BufferedReader(ChunkReader(chunks), buffer_size=chunk_size)
+    with tarfile.open(fileobj=reader, mode="r|*") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            fileobj = tar.extractfile(member)
+            yield member.name, iter(lambda: fileobj.read(chunk_size), b"")
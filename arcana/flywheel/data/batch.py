@@ -0,0 +1,217 @@
+"""
+Launching of a gear on every row of a dataset in a batch, with a bounded number of jobs
+in flight that are tracked by a single aggregated listing of the jobs of the batch per
+poll, instead of polling each job separately
+"""
+from __future__ import annotations
+import time
+import json
+import uuid
+import logging
+import typing as ty
+from datetime import datetime, timezone
+import attrs
+from arcana.core.data.row import DataRow
+from .index import EntryIndex
+from .job import SNAPSHOT_KEY, TREE_INPUT
+
+if ty.TYPE_CHECKING:
+    from .api import Flywheel
+
+
+logger = logging.getLogger("arcana")
+
+
+COMPLETE_STATE = "complete"
+# States jobs don't transition out of (apart from being retried, which creates a new
+# job)
+TERMINAL_STATES = frozenset([COMPLETE_STATE, "failed", "cancelled"])
+
+
+@attrs.define
+class BatchProgress:
+    """The progress of a batch of jobs
+
+    Parameters
+    ----------
+    total : int
+        the number of jobs in the batch
+    submitted : int
+        the number of jobs that have been launched
+    complete : int
+        the number of jobs that have completed successfully
+    failed : int
+        the number of jobs that have failed or been cancelled
+    started : float
+        the time the batch started (as returned by `time.monotonic`)
+    """
+
+    total: int
+    submitted: int = 0
+    complete: int = 0
+    failed: int = 0
+    started: float = attrs.field(factory=time.monotonic)
+
+    @property
+    def finished(self) -> int:
+        return self.complete + self.failed
+
+    @property
+    def in_flight(self) -> int:
+        return self.submitted - self.finished
+
+    @property
+    def pending(self) -> int:
+        return self.total - self.submitted
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    @property
+    def throughput(self) -> float:
+        """The number of jobs finished per minute"""
+        elapsed = self.elapsed
+        return self.finished / elapsed * 60 if elapsed else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"{self.finished}/{self.total} finished ({self.complete} complete, "
+            f"{self.failed} failed), {self.in_flight} in flight, {self.pending} "
+            f"pending, {self.throughput:.1f} jobs/min"
+        )
+
+
+@attrs.define(eq=False)
+class BatchLauncher:
+    """Launches a gear on each of the rows of a dataset, keeping at most
+    `max_in_flight` jobs pending or running at any time.
+
+    The jobs of the batch are tagged with the ID of the batch, so the states of all of
+    them are tracked with a single listing of the jobs with the tag that have been
+    modified since the previous poll. The interval between polls is halved (down to
+    `min_poll_interval`) whenever jobs have changed state and doubled (up to
+    `max_poll_interval`) otherwise.
+
+    Parameters
+    ----------
+    store : Flywheel
+        the store the dataset is in
+    gear_id : str
+        the ID of the gear to launch
+    rows : list[DataRow]
+        the rows to launch the gear on
+    config : dict[str, Any], optional
+        the configuration of the gear passed to every job
+    max_in_flight : int
+        the maximum number of jobs that are pending or running at any time
+    min_poll_interval : float
+        the minimum interval between polls of the states of the jobs (seconds)
+    max_poll_interval : float
+        the maximum interval between polls of the states of the jobs (seconds)
+    snapshot : bool
+        hand each job a snapshot of the tree of the dataset and the entries of its row
+        (see ``Flywheel.job_snapshot``), which is taken once for the whole batch, so
+        the jobs don't each need to scan the project. The tree is uploaded once to a
+        file of the project that each job is handed as an input, and only the entries
+        of its row are put in the configuration of each job
+    tag : str
+        the tag the jobs of the batch are launched with, by default a unique ID
+    on_progress : Callable[[BatchProgress], None], optional
+        called with the progress of the batch after each poll
+    """
+
+    store: Flywheel
+    gear_id: str
+    rows: ty.List[DataRow] = attrs.field(converter=list)
+    config: ty.Dict[str, ty.Any] = attrs.field(factory=dict)
+    max_in_flight: int = 100
+    min_poll_interval: float = 10.0
+    max_poll_interval: float = 300.0
+    snapshot: bool = True
+    tag: str = attrs.field(factory=lambda: "arcana-batch-" + uuid.uuid4().hex[:12])
+    on_progress: ty.Optional[ty.Callable[[BatchProgress], None]] = None
+    # The rows the jobs were launched on and the states they were last seen in, keyed
+    # by job ID
+    jobs: ty.Dict[str, DataRow] = attrs.field(factory=dict, init=False)
+    states: ty.Dict[str, str] = attrs.field(factory=dict, init=False)
+
+    def run(self) -> BatchProgress:
+        """Launches the jobs of the batch and waits for all of them to finish
+
+        Returns
+        -------
+        BatchProgress
+            the progress of the batch once all the jobs have finished
+        """
+        progress = BatchProgress(total=len(self.rows))
+        if not self.rows:
+            return progress
+        with self.store.connection:
+            dataset = self.rows[0].dataset
+            snapshot = None
+            inputs = None
+            if self.snapshot:
+                snapshot = self.store.job_snapshot(dataset.id, self.rows)
+                inputs = {
+                    TREE_INPUT: self.store.upload_job_tree(
+                        snapshot, f"{TREE_INPUT}-{self.tag}.json"
+                    )
+                }
+            rows = iter(self.rows)
+            interval = self.min_poll_interval
+            since = datetime.now(timezone.utc)
+            while True:
+                while progress.pending and progress.in_flight < self.max_in_flight:
+                    row = next(rows)
+                    config = dict(self.config)
+                    if snapshot is not None:
+                        config[SNAPSHOT_KEY] = json.dumps(
+                            snapshot.subset([EntryIndex.row_key(row)]).rows_asdict(),
+                            separators=(",", ":"),
+                        )
+                    # The snapshot of the batch (if any) is already in the config
+                    job_id = self.store.launch_job(
+                        self.gear_id,
+                        row,
+                        config=config,
+                        tags=[self.tag],
+                        inputs=inputs,
+                        snapshot=False,
+                    )
+                    self.jobs[job_id] = row
+                    self.states[job_id] = "pending"
+                    progress.submitted += 1
+                if progress.finished == progress.total:
+                    break
+                time.sleep(interval)
+                polled = datetime.now(timezone.utc)
+                changed = self._poll(since, progress)
+                since = polled
+                if changed:
+                    interval = max(interval / 2, self.min_poll_interval)
+                else:
+                    interval = min(interval * 2, self.max_poll_interval)
+                logger.info("Batch %s: %s", self.tag, progress.summary())
+                if self.on_progress is not None:
+                    self.on_progress(progress)
+        return progress
+
+    def _poll(self, since: datetime, progress: BatchProgress) -> int:
+        """Updates the states of the jobs of the batch that have been modified since
+        the previous poll, returning the number that have changed state"""
+        changed = 0
+        for job in self.store.list_jobs(self.tag, since=since):
+            previous = self.states.get(job.id)
+            if previous is None or previous == job.state or previous in TERMINAL_STATES:
+                continue
+            self.states[job.id] = job.state
+            changed += 1
+            if job.state == COMPLETE_STATE:
+                progress.complete += 1
+            elif job.state in TERMINAL_STATES:
+                progress.failed += 1
+                logger.warning(
+                    "Job %s on %s %s", job.id, self.jobs[job.id], job.state
+                )
+        return changed
@@ -0,0 +1,161 @@
+"""
+Content-addressed store of the files downloaded from Flywheel, keyed by the digests
+reported by the server, so that files shared between entries (e.g. reference files
+and re-imported projects) are only downloaded and stored once
+"""
+from __future__ import annotations
+import os
+import sys
+import stat
+import errno
+import shutil
+import logging
+import tempfile
+import typing as ty
+from pathlib import Path
+import attrs
+from .checksums import parse_digest
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+logger = logging.getLogger("arcana")
+
+
+# ioctl request that clones the extents of one file into another (i.e. creates a
+# copy-on-write "reflink") on file-systems that support it (e.g. Btrfs and XFS)
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+
+# Errors raised when a file-system doesn't support reflinks (or hard links) between
+# the given paths
+UNSUPPORTED_LINK_ERRNOS = frozenset(
+    [errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EPERM, errno.EMLINK]
+)
+
+READ_ONLY_MASK = ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH)
+
+
+@attrs.define
+class BlobStore:
+    """A directory holding one copy of each file downloaded into the cache, named by
+    its digest. The files of cached entries are reflinks to the blobs where the
+    file-system supports them, otherwise hard links, so identical files occupy the
+    space of a single copy. Blobs are made read-only so that the (shared) contents
+    of hard-linked files can't be modified in place
+
+    Parameters
+    ----------
+    root : Path
+        the directory the blobs are stored in
+    """
+
+    root: Path = attrs.field(converter=Path)
+
+    def path(self, digest: str) -> ty.Optional[Path]:
+        """The path of the blob with the given digest, or None if the digest isn't in
+        the format reported by Flywheel"""
+        parsed = parse_digest(digest)
+        if parsed is None:
+            return None
+        algorithm, hexdigest = parsed
+        return self.root / algorithm / hexdigest[:2] / hexdigest
+
+    def link(self, digest: str, dest: Path) -> bool:
+        """Creates a file at `dest` with the contents of the blob with the given digest
+
+        Parameters
+        ----------
+        digest : str
+            the digest of the file
+        dest : Path
+            the path to create the file at
+
+        Returns
+        -------
+        bool
+            whether the blob was found in the store
+        """
+        blob = self.path(digest)
+        if blob is None:
+            return False
+        dest.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            clone_file(blob, dest)
+        except FileNotFoundError:
+            if blob.exists():  # i.e. the parent directory of dest is missing
+                raise
+            return False
+        return True
+
+    def add(self, fspath: Path, digest: str) -> bool:
+        """Adds a file whose contents have been verified to match the digest to the
+        store. If another process has already added the same blob, the file is
+        replaced by a link to the existing blob
+
+        Parameters
+        ----------
+        fspath : Path
+            the file to add
+        digest : str
+            the digest of the file
+
+        Returns
+        -------
+        bool
+            whether the file was added to the store (as opposed to already being in
+            it or the digest being unrecognised)
+        """
+        blob = self.path(digest)
+        if blob is None:
+            return False
+        if blob.exists():
+            self._replace_with_link(blob, fspath)
+            return False
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        # The blob is created under a temporary name and then linked into place, so
+        # that other processes never see a partially written blob
+        fd, tmp_path = tempfile.mkstemp(dir=blob.parent, prefix=".", suffix=".tmp")
+        os.close(fd)
+        tmp_path = Path(tmp_path)
+        try:
+            tmp_path.unlink()
+            clone_file(fspath, tmp_path)
+            os.chmod(tmp_path, stat.S_IMODE(tmp_path.stat().st_mode) & READ_ONLY_MASK)
+            try:
+                os.link(tmp_path, blob)
+            except FileExistsError:
+                self._replace_with_link(blob, fspath)
+                return False
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        return True
+
+    def _replace_with_link(self, blob: Path, fspath: Path):
+        tmp_path = fspath.with_name(fspath.name + ".blob")
+        clone_file(blob, tmp_path)
+        os.replace(tmp_path, fspath)
+
+
+def clone_file(src: Path, dest: Path):
+    """Creates `dest` with the contents of `src` as cheaply as the file-system allows,
+    i.e. a reflink, then a hard link and finally a copy"""
+    if fcntl is not None and sys.platform.startswith("linux"):
+        with open(src, "rb") as fsrc, open(dest, "xb") as fdest:
+            try:
+                fcntl.ioctl(fdest.fileno(), FICLONE, fsrc.fileno())
+            except OSError as e:
+                error = e
+            else:
+                return
+        dest.unlink()
+        if error.errno not in UNSUPPORTED_LINK_ERRNOS:
+            raise error
+    try:
+        os.link(src, dest)
+    except OSError as e:
+        if e.errno not in UNSUPPORTED_LINK_ERRNOS:
+            raise
+        shutil.copyfile(src, dest)
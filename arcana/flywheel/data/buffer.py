@@ -0,0 +1,56 @@
+"""
+Write-behind buffer for values stored in the info of Flywheel containers (i.e. fields
+and provenance), so that all the values written to a container within a connection
+are uploaded in a single info update
+"""
+from __future__ import annotations
+import threading
+import typing as ty
+import attrs
+
+
+@attrs.define
+class InfoBuffer:
+    """Values that have been written to the store but not yet uploaded, keyed by the
+    ID of the container they are stored in and then by name (e.g. field name or entry
+    path). Writes are accepted from multiple threads
+
+    Parameters
+    ----------
+    pending : dict[str, dict[str, Any]]
+        the values waiting to be uploaded to each container
+    """
+
+    pending: ty.Dict[str, ty.Dict[str, ty.Any]] = attrs.field(factory=dict)
+    _lock: threading.Lock = attrs.field(factory=threading.Lock, init=False, repr=False)
+
+    def put(self, container_id: str, name: str, value: ty.Any):
+        with self._lock:
+            self.pending.setdefault(container_id, {})[name] = value
+
+    def get(self, container_id: str, name: str) -> ty.Tuple[bool, ty.Any]:
+        """Returns whether there is a pending value for the name and its value"""
+        with self._lock:
+            try:
+                return True, self.pending[container_id][name]
+            except KeyError:
+                return False, None
+
+    def drain(self) -> ty.Dict[str, ty.Dict[str, ty.Any]]:
+        """Removes and returns all the pending values"""
+        with self._lock:
+            pending, self.pending = self.pending, {}
+        return pending
+
+    def restore(self, pending: ty.Dict[str, ty.Dict[str, ty.Any]]):
+        """Puts back values that failed to upload, without overwriting any values
+        written to the same names since they were drained"""
+        with self._lock:
+            for container_id, values in pending.items():
+                self.pending[container_id] = {
+                    **values,
+                    **self.pending.get(container_id, {}),
+                }
+
+    def __len__(self):
+        return len(self.pending)
@@ -0,0 +1,391 @@
+"""
+Management of the space used by the cache directory of the store, which evicts the
+least recently used entries (and blobs) when it grows beyond a byte budget
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import errno
+import shutil
+import socket
+import hashlib
+import logging
+import threading
+import contextlib
+import typing as ty
+from pathlib import Path
+import attrs
+from arcana.core.utils.misc import JSON_ENCODING
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+logger = logging.getLogger("arcana")
+
+
+@attrs.define
+class CachedItem:
+    """An entry or blob in the cache that can be evicted
+
+    Parameters
+    ----------
+    path : Path
+        the path of the entry directory or blob file
+    last_access : float
+        the time the item was last accessed
+    inodes : list[tuple[int, int]]
+        the (device, inode) pairs of the files of the item
+    sidecars : list[Path]
+        files stored alongside the item that are removed with it
+    """
+
+    path: Path
+    last_access: float
+    inodes: ty.List[ty.Tuple[int, int]] = attrs.field(factory=list)
+    sidecars: ty.List[Path] = attrs.field(factory=list)
+
+
+@attrs.define
+class CacheManager:
+    """Keeps the size of the cache directory of a store within a byte budget by
+    evicting the least recently used entries (and blobs) when it is exceeded.
+
+    Accesses are recorded by updating the modification time of entry directories (and
+    blobs), so they are visible to all processes sharing the cache without any
+    additional bookkeeping. Entries can be pinned by a process (e.g. while a pipeline
+    is using them), which protects them from eviction until the pin is released or
+    the process exits, and only one process evicts from the cache at a time.
+
+    Files that are hard-linked between entries and the blob store are only counted
+    (and freed) once.
+
+    Parameters
+    ----------
+    cache_dir : Path
+        the cache directory
+    max_bytes : int, optional
+        the byte budget of the cache, by default unlimited
+    checksum_suffix : str
+        the suffix of the checksum files written alongside each complete entry
+    sidecar_suffixes : tuple[str, ...]
+        the suffixes of other files written alongside entries, which are removed with
+        them
+    blob_dir : str, optional
+        the name of the blob store directory within the cache
+    grace_period : float
+        the time (in seconds) after an item is accessed during which it won't be
+        evicted, which covers the gap between a process finding an entry in the cache
+        and pinning it
+    rescan_interval : float
+        the maximum time (in seconds) between scans of the cache in a process, which
+        picks up items added by other processes
+    remote_pin_ttl : float
+        the time (in seconds) after which pins created by processes on other hosts
+        (whose liveness can't be checked) expire
+    """
+
+    LOCK_FILE = "__cache__.lock"
+    PINS_DIR = "__cache_pins__"
+
+    cache_dir: Path = attrs.field(converter=Path)
+    max_bytes: ty.Optional[int] = None
+    checksum_suffix: str = ".md5.json"
+    sidecar_suffixes: ty.Tuple[str, ...] = ()
+    blob_dir: ty.Optional[str] = None
+    grace_period: float = 60.0
+    rescan_interval: float = 300.0
+    remote_pin_ttl: float = 86400.0
+    _estimated_bytes: ty.Optional[int] = attrs.field(default=None, init=False)
+    _last_scan: float = attrs.field(default=0.0, init=False)
+    _lock: threading.Lock = attrs.field(factory=threading.Lock, init=False, repr=False)
+
+    @property
+    def pins_dir(self) -> Path:
+        return self.cache_dir / self.PINS_DIR
+
+    def touch(self, path: Path):
+        """Records an access to an entry directory (or blob)"""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+
+    def pin(self, path: Path) -> Path:
+        """Pins an entry in the cache for the lifetime of the current process (or
+        until it is unpinned)
+
+        Parameters
+        ----------
+        path : Path
+            the path of the entry directory
+
+        Returns
+        -------
+        Path
+            the pin file, which can be passed to `unpin`
+        """
+        host, pid = socket.gethostname(), os.getpid()
+        pin = self.pins_dir / self._key(path) / f"{host}-{pid}"
+        if not pin.exists():
+            pin.parent.mkdir(parents=True, exist_ok=True)
+            with open(pin, "w", **JSON_ENCODING) as f:
+                json.dump({"path": str(path), "host": host, "pid": pid}, f)
+        return pin
+
+    def unpin(self, pin: Path):
+        pin.unlink(missing_ok=True)
+        with contextlib.suppress(OSError):
+            pin.parent.rmdir()
+
+    @contextlib.contextmanager
+    def pinned(self, paths: ty.Iterable[Path]):
+        """Context manager that pins entries in the cache while it is open"""
+        pins = [self.pin(p) for p in paths]
+        try:
+            yield
+        finally:
+            for pin in pins:
+                self.unpin(pin)
+
+    def is_pinned(self, path: Path) -> bool:
+        """Whether there are any live pins on the entry, removing stale ones"""
+        pin_dir = self.pins_dir / self._key(path)
+        if not pin_dir.exists():
+            return False
+        for pin in pin_dir.iterdir():
+            if self._pin_is_live(pin):
+                return True
+            logger.debug("Removing stale cache pin %s", pin)
+            self.unpin(pin)
+        return False
+
+    def record_added(self, num_bytes: int):
+        """Records bytes added to the cache by this process, and evicts items from the
+        cache if its estimated size is over budget (or it hasn't been scanned recently)"""
+        if self.max_bytes is None:
+            return
+        with self._lock:
+            if self._estimated_bytes is not None:
+                self._estimated_bytes += num_bytes
+            due = (
+                self._estimated_bytes is None
+                or self._estimated_bytes > self.max_bytes
+                or time.monotonic() - self._last_scan > self.rescan_interval
+            )
+        if due:
+            self.evict()
+
+    def evict(self, max_bytes: ty.Optional[int] = None) -> int:
+        """Evicts the least recently used items that aren't pinned from the cache until
+        its size is within the budget. If another process is already evicting from the
+        cache this is skipped
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            the byte budget to evict down to, by default `max_bytes`
+
+        Returns
+        -------
+        int
+            the number of bytes freed
+        """
+        if max_bytes is None:
+            max_bytes = self.max_bytes
+        with self._exclusive() as acquired:
+            if not acquired:
+                logger.debug("Skipping eviction as another process is evicting")
+                return 0
+            items, sizes, links = self._scan()
+            usage = sum(sizes.values())
+            freed = 0
+            now = time.time()
+            if max_bytes is not None and usage > max_bytes:
+                # Blobs that are still linked into entries free no space, so they are
+                # revisited once the entries they are linked into have been evicted
+                linked_blobs = []
+                for item in sorted(items, key=lambda i: i.last_access):
+                    if usage - freed <= max_bytes:
+                        break
+                    if now - item.last_access < self.grace_period or (
+                        item.path.is_dir() and self.is_pinned(item.path)
+                    ):
+                        continue
+                    if not item.path.is_dir() and any(
+                        links[i] > 1 for i in item.inodes
+                    ):
+                        linked_blobs.append(item)
+                        continue
+                    freed += self._evict_item(item, sizes, links)
+                for item in linked_blobs:
+                    if usage - freed <= max_bytes:
+                        break
+                    if all(links[i] == 1 for i in item.inodes):
+                        freed += self._evict_item(item, sizes, links)
+                if usage - freed > max_bytes:
+                    logger.warning(
+                        "Cache at %s is still %s bytes over its budget of %s bytes "
+                        "after evicting all unpinned items",
+                        self.cache_dir,
+                        usage - freed - max_bytes,
+                        max_bytes,
+                    )
+                logger.info(
+                    "Evicted %s bytes from cache at %s (%s bytes remaining)",
+                    freed,
+                    self.cache_dir,
+                    usage - freed,
+                )
+            with self._lock:
+                self._estimated_bytes = usage - freed
+                self._last_scan = time.monotonic()
+        return freed
+
+    def usage(self) -> int:
+        """The number of bytes used by the entries and blobs in the cache"""
+        _, sizes, _ = self._scan()
+        return sum(sizes.values())
+
+    def _scan(
+        self,
+    ) -> ty.Tuple[
+        ty.List[CachedItem],
+        ty.Dict[ty.Tuple[int, int], int],
+        ty.Dict[ty.Tuple[int, int], int],
+    ]:
+        """Lists the evictable items in the cache along with the size and number of
+        links of each of the (unique) files they contain"""
+        items = []
+        sizes = {}
+        links = {}
+
+        def add_file(fspath: str, item: CachedItem):
+            try:
+                # Files linked in place from outside the cache (e.g. the staged
+                # inputs of a gear job) aren't freed by eviction, so aren't counted
+                st = os.lstat(fspath)
+            except FileNotFoundError:
+                return
+            inode = (st.st_dev, st.st_ino)
+            item.inodes.append(inode)
+            sizes[inode] = st.st_size
+            links[inode] = st.st_nlink
+
+        for dirpath, dirnames, filenames in os.walk(self.cache_dir):
+            if Path(dirpath) == self.cache_dir:
+                # Metadata directories aren't evicted, and blobs are scanned below
+                dirnames[:] = [d for d in dirnames if not d.startswith("__")]
+            for filename in filenames:
+                if not filename.endswith(self.checksum_suffix):
+                    continue
+                entry_name = filename[: -len(self.checksum_suffix)]
+                entry_path = Path(dirpath) / entry_name
+                if entry_name not in dirnames:
+                    continue
+                dirnames.remove(entry_name)
+                try:
+                    last_access = entry_path.stat().st_mtime
+                except FileNotFoundError:
+                    continue
+                item = CachedItem(
+                    path=entry_path,
+                    last_access=last_access,
+                    sidecars=[
+                        entry_path.with_name(entry_name + s)
+                        for s in (self.checksum_suffix,) + self.sidecar_suffixes
+                    ],
+                )
+                for root, _, entry_files in os.walk(entry_path):
+                    for entry_file in entry_files:
+                        add_file(os.path.join(root, entry_file), item)
+                items.append(item)
+        if self.blob_dir is not None:
+            for dirpath, _, filenames in os.walk(self.cache_dir / self.blob_dir):
+                for filename in filenames:
+                    if filename.startswith("."):  # blobs being added
+                        continue
+                    blob = Path(dirpath) / filename
+                    try:
+                        last_access = blob.stat().st_mtime
+                    except FileNotFoundError:
+                        continue
+                    item = CachedItem(path=blob, last_access=last_access)
+                    add_file(str(blob), item)
+                    items.append(item)
+        # Links from outside the cache (e.g. hard-linked outputs) keep files alive
+        # after they are evicted, so they aren't counted as freed
+        return items, sizes, links
+
+    def _evict_item(
+        self,
+        item: CachedItem,
+        sizes: ty.Dict[ty.Tuple[int, int], int],
+        links: ty.Dict[ty.Tuple[int, int], int],
+    ) -> int:
+        """Removes the item, returning the number of bytes freed (i.e. of the files
+        that weren't linked elsewhere)"""
+        item_freed = sum(sizes[i] for i in item.inodes if links[i] == 1)
+        self._remove(item)
+        for inode in item.inodes:
+            links[inode] -= 1
+        return item_freed
+
+    def _remove(self, item: CachedItem):
+        logger.debug("Evicting %s from cache", item.path)
+        if item.path.is_dir():
+            # The checksums are removed first, so that other processes treat the entry
+            # as stale instead of reading a partially removed entry
+            for sidecar in item.sidecars:
+                sidecar.unlink(missing_ok=True)
+            shutil.rmtree(item.path, ignore_errors=True)
+        else:
+            item.path.unlink(missing_ok=True)
+
+    @contextlib.contextmanager
+    def _exclusive(self):
+        """Acquires the lock on the cache shared between processes, yielding whether it
+        was acquired"""
+        if fcntl is None:
+            yield True
+            return
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        with open(self.cache_dir / self.LOCK_FILE, "a") as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def _pin_is_live(self, pin: Path) -> bool:
+        try:
+            with open(pin, **JSON_ENCODING) as f:
+                dct = json.load(f)
+            mtime = pin.stat().st_mtime
+        except (OSError, ValueError):
+            return False
+        if dct.get("host") != socket.gethostname():
+            return time.time() - mtime < self.remote_pin_ttl
+        try:
+            os.kill(dct["pid"], 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass  # the process exists but belongs to another user
+        return True
+
+    def _key(self, path: Path) -> str:
+        try:
+            rel_path = Path(path).relative_to(self.cache_dir)
+        except ValueError:
+            rel_path = Path(path)
+        return hashlib.sha1(rel_path.as_posix().encode()).hexdigest()
@@ -0,0 +1,275 @@
+"""
+Calculation of file digests in the same format as they are reported by Flywheel, and
+persistent caches of both calculated and reported digests so that unchanged files
+don't need to be re-hashed and unchanged containers don't need to be re-listed
+"""
+from __future__ import annotations
+import os
+import re
+import mmap
+import json
+import hashlib
+import logging
+import typing as ty
+from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import attrs
+from dateutil.parser import isoparse
+from arcana.core.utils.misc import JSON_ENCODING
+from .transfer import save_json
+
+
+logger = logging.getLogger("arcana")
+
+
+# Flywheel reports the digests of files as "v<version>-<algorithm>-<hexdigest>"
+DIGEST_VERSION = "v0"
+DIGEST_PATTERN = re.compile(r"^v\d+-([a-z0-9_]+)-([0-9a-f]+)$")
+
+# Files at least this large are hashed from memory-mapped reads, which avoids
+# copying their contents into Python buffers
+MMAP_THRESHOLD = 16 * 1024 * 1024
+
+# Below this total size the cost of spawning worker processes outweighs the benefit
+PARALLEL_THRESHOLD = 64 * 1024 * 1024
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def format_digest(algorithm: str, hexdigest: str) -> str:
+    """Formats a digest the way Flywheel reports them, e.g. "v0-sha384-7f3a..." """
+    return f"{DIGEST_VERSION}-{algorithm}-{hexdigest}"
+
+
+def parse_digest(digest: ty.Optional[str]) -> ty.Optional[ty.Tuple[str, str]]:
+    """Splits a digest reported by Flywheel into its algorithm and hex digest,
+    returning None if it isn't in the expected format or the algorithm isn't
+    available to hashlib"""
+    match = DIGEST_PATTERN.match(digest or "")
+    if match is None or match.group(1) not in hashlib.algorithms_available:
+        return None
+    return match.group(1), match.group(2)
+
+
+def hash_file(fspath: ty.Union[str, Path], algorithm: str) -> str:
+    """Calculates the digest of a single file in the format reported by Flywheel
+
+    Parameters
+    ----------
+    fspath : str or Path
+        path of the file to hash
+    algorithm : str
+        name of the hashlib algorithm to use (e.g. "sha384")
+
+    Returns
+    -------
+    str
+        the formatted digest
+    """
+    crypto = hashlib.new(algorithm)
+    with open(fspath, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for start in range(0, size, HASH_BLOCK_SIZE):
+                        crypto.update(view[start : start + HASH_BLOCK_SIZE])
+                finally:
+                    view.release()
+        else:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+                crypto.update(block)
+    return format_digest(algorithm, crypto.hexdigest())
+
+
+@attrs.define
+class DigestCache:
+    """Digests of the files of a cached file-set, saved in a sidecar file and keyed
+    by the relative path, size and modification time of each file so that only new
+    or modified files need to be re-hashed
+
+    Parameters
+    ----------
+    path : Path, optional
+        the path of the sidecar file, None if the digests shouldn't be persisted
+    algorithm : str
+        the hash algorithm the digests were calculated with
+    digests : dict[str, tuple[int, int, str]]
+        the size, modification time (in ns) and digest of each file keyed by its
+        relative path
+    """
+
+    SUFFIX = ".digests.json"
+
+    path: ty.Optional[Path]
+    algorithm: str
+    digests: ty.Dict[str, ty.Tuple[int, int, str]] = attrs.field(factory=dict)
+
+    @classmethod
+    def load(cls, path: ty.Optional[Path], algorithm: str) -> DigestCache:
+        dct = {}
+        if path is not None:
+            try:
+                with open(path, **JSON_ENCODING) as f:
+                    dct = json.load(f)
+            except FileNotFoundError:
+                pass
+            except ValueError:
+                logger.warning("Ignoring corrupted digest cache at %s", path)
+        if dct.get("algorithm") != algorithm:
+            dct = {}
+        return cls(
+            path=path,
+            algorithm=algorithm,
+            digests={k: tuple(v) for k, v in dct.get("digests", {}).items()},
+        )
+
+    def lookup(self, name: str, stat: os.stat_result) -> ty.Optional[str]:
+        try:
+            size, mtime, digest = self.digests[name]
+        except KeyError:
+            return None
+        if size != stat.st_size or mtime != stat.st_mtime_ns:
+            return None
+        return digest
+
+    def save(self):
+        if self.path is not None:
+            save_json({"algorithm": self.algorithm, "digests": self.digests}, self.path)
+
+
+def calculate_digests(
+    files: ty.Dict[str, Path],
+    algorithm: str,
+    sidecar: ty.Optional[Path] = None,
+    max_workers: ty.Optional[int] = None,
+) -> ty.Dict[str, str]:
+    """Calculates the digests of a set of files, hashing them in parallel and reusing
+    any digests cached in the sidecar for files that haven't changed since
+
+    Parameters
+    ----------
+    files : dict[str, Path]
+        the paths of the files to hash keyed by the names they are reported under
+    algorithm : str
+        name of the hashlib algorithm to use
+    sidecar : Path, optional
+        path of the file to cache the digests in between calls
+    max_workers : int, optional
+        the maximum number of processes used to hash files, by default the number
+        of CPUs
+
+    Returns
+    -------
+    dict[str, str]
+        the digests keyed by file name
+    """
+    cache = DigestCache.load(sidecar, algorithm)
+    stats = {n: p.stat() for n, p in files.items()}
+    digests = {}
+    to_hash = []
+    for name, stat in stats.items():
+        digest = cache.lookup(name, stat)
+        if digest is None:
+            to_hash.append(name)
+        else:
+            digests[name] = digest
+    if to_hash:
+        total_size = sum(stats[n].st_size for n in to_hash)
+        if len(to_hash) > 1 and total_size >= PARALLEL_THRESHOLD and max_workers != 1:
+            with ProcessPoolExecutor(max_workers=max_workers) as pool:
+                hashed = pool.map(
+                    hash_file, [files[n] for n in to_hash], [algorithm] * len(to_hash)
+                )
+                digests.update(zip(to_hash, hashed))
+        else:
+            digests.update((n, hash_file(files[n], algorithm)) for n in to_hash)
+        cache.digests = {
+            n: (stats[n].st_size, stats[n].st_mtime_ns, digests[n]) for n in files
+        }
+        cache.save()
+    return digests
+
+
+@attrs.define
+class ContainerDigests:
+    """The digests reported by the server for the files in each container of a
+    project, saved in the cache directory of the store along with the `modified`
+    timestamps of the containers. Containers that haven't been modified since they
+    were last listed don't need to be listed again to validate the cache
+
+    Parameters
+    ----------
+    project_id : str
+        the Flywheel ID of the project
+    listed : dict[str, datetime]
+        the time (in UTC) each type of container (i.e. "acquisitions" or "analyses")
+        was last listed
+    containers : dict[str, tuple[str, dict[str, str]]]
+        the modified timestamp and the digests of the files of each container keyed
+        by container ID
+    """
+
+    VERSION = 1
+
+    project_id: str
+    listed: ty.Dict[str, datetime] = attrs.field(factory=dict)
+    containers: ty.Dict[str, ty.Tuple[str, ty.Dict[str, str]]] = attrs.field(
+        factory=dict
+    )
+
+    @classmethod
+    def load(cls, path: Path, project_id: str) -> ContainerDigests:
+        try:
+            with open(path, **JSON_ENCODING) as f:
+                dct = json.load(f)
+        except FileNotFoundError:
+            dct = {}
+        except ValueError:
+            logger.warning("Ignoring corrupted container digests at %s", path)
+            dct = {}
+        if dct.get("version") != cls.VERSION or dct.get("project_id") != project_id:
+            return cls(project_id=project_id)
+        return cls(
+            project_id=project_id,
+            listed={k: isoparse(v) for k, v in dct["listed"].items()},
+            containers={k: tuple(v) for k, v in dct["containers"].items()},
+        )
+
+    def save(self, path: Path):
+        save_json(
+            {
+                "version": self.VERSION,
+                "project_id": self.project_id,
+                "listed": {k: v.isoformat() for k, v in self.listed.items()},
+                "containers": self.containers,
+            },
+            path,
+        )
+
+    def lookup(
+        self, container_id: str, modified: ty.Optional[datetime] = None
+    ) -> ty.Optional[ty.Dict[str, str]]:
+        """Returns the cached digests of a container, or None if it isn't in the cache
+        or has been modified since (if its current `modified` timestamp is given)"""
+        try:
+            cached_modified, digests = self.containers[container_id]
+        except KeyError:
+            return None
+        if modified is not None and cached_modified != modified.isoformat():
+            return None
+        return digests
+
+    def update(self, container) -> ty.Dict[str, str]:
+        """Updates the cache from a container returned by the SDK, returning the
+        digests of its files"""
+        digests = None
+        if container.modified is not None:
+            digests = self.lookup(container.id, container.modified)
+        if digests is None:
+            digests = {f.name: f.hash for f in (container.files or [])}
+            modified = container.modified.isoformat() if container.modified else None
+            self.containers[container.id] = (modified, digests)
+        return digests
@@ -0,0 +1,323 @@
+"""
+In-memory index of the data entries of a Flywheel project, populated in a single bulk
+pass over the project and looked up by ``Flywheel.populate_row``
+"""
+from __future__ import annotations
+import re
+import typing as ty
+import functools
+import importlib.metadata
+from collections import defaultdict, OrderedDict
+import attrs
+from fileformats.core import FileSet, Field
+from arcana.core.data.row import DataRow
+from arcana.common import Clinical
+
+
+# Key of a row in the index, i.e. () for the project, (subject,) for subjects and
+# (subject, session) for sessions
+RowKey = ty.Tuple[str, ...]
+
+# Type of the Flywheel container that corresponds to a row, by the length of its key
+ROW_CONTAINER_TYPES = ("projects", "subjects", "sessions")
+
+
+@attrs.define
+class IndexedEntry:
+    """An entry found in the bulk scan of a project, holding the arguments that are
+    passed to ``DataRow.add_entry`` when the row is populated
+
+    Parameters
+    ----------
+    path : str
+        the path of the entry within the row
+    datatype : type
+        the datatype of the entry
+    uri : str, optional
+        the URI of the entry. The URIs of fields are those of the container that
+        holds them in its info
+    order : int, optional
+        the order of the entry within the row (i.e. of acquisitions within a session)
+    checksums : dict[str, str], optional
+        the checksums of the files in the entry as reported by the server
+    value : Any, optional
+        the value of field entries
+    """
+
+    path: str
+    datatype: type
+    uri: ty.Optional[str] = None
+    order: ty.Optional[int] = None
+    checksums: ty.Optional[ty.Dict[str, str]] = None
+    value: ty.Any = None
+
+
+def fileset_entry(
+    path: str,
+    uri: str,
+    files: ty.Optional[list] = None,
+    order: ty.Optional[int] = None,
+) -> IndexedEntry:
+    """Creates a file-set entry from the file listing of a Flywheel container"""
+    return IndexedEntry(
+        path=path,
+        datatype=FileSet,
+        uri=uri,
+        order=order,
+        checksums={f.name: f.hash for f in files} if files else None,
+    )
+
+
+@attrs.define
+class EntryIndex:
+    """The entries of every row of a project along with the IDs of their containers
+
+    Parameters
+    ----------
+    project_id : str
+        the Flywheel ID of the project
+    container_ids : dict[RowKey, str]
+        the Flywheel IDs of the project, subject and session containers keyed by
+        the key of their corresponding row
+    entries : dict[RowKey, dict[str, IndexedEntry]]
+        the entries found in each row, keyed by the row key and the entry path
+    """
+
+    project_id: str
+    container_ids: ty.Dict[RowKey, str] = attrs.field(factory=dict)
+    entries: ty.Dict[RowKey, ty.Dict[str, IndexedEntry]] = attrs.field(
+        factory=lambda: defaultdict(dict)
+    )
+
+    @classmethod
+    def row_key(cls, row: DataRow) -> ty.Optional[RowKey]:
+        """Returns the key of the given row in the index, or None if the row doesn't
+        correspond to a Flywheel container (e.g. timepoint or group rows)"""
+        if row.frequency == Clinical.dataset:
+            return ()
+        if row.frequency == Clinical.subject:
+            return (row.frequency_id("subject"),)
+        if row.frequency == Clinical.session:
+            return (row.frequency_id("subject"), row.frequency_id("session"))
+        return None
+
+    def add(self, key: RowKey, entry: IndexedEntry) -> bool:
+        """Adds an entry to the index, returning False if there is already an entry
+        with the same path in the row"""
+        row_entries = self.entries[key]
+        if entry.path in row_entries:
+            return False
+        row_entries[entry.path] = entry
+        return True
+
+    def row_entries(self, key: RowKey) -> ty.List[IndexedEntry]:
+        return list(self.entries.get(key, {}).values())
+
+    def add_fileset(
+        self,
+        key: RowKey,
+        path: str,
+        uri: str,
+        files: ty.Optional[list] = None,
+        order: ty.Optional[int] = None,
+    ) -> bool:
+        """Adds a file-set entry from the file listing of a Flywheel container"""
+        return self.add(key, fileset_entry(path, uri, files=files, order=order))
+
+    def add_fields(
+        self, key: RowKey, info: ty.Optional[ty.Dict[str, ty.Any]], uri: str
+    ):
+        """Adds field entries for the scalar and list values in the info of a
+        Flywheel container. Nested dictionaries (e.g. DICOM headers) and reserved
+        keys starting with a double underscore are not treated as fields"""
+        for name, value in (info or {}).items():
+            if name.startswith("__") or isinstance(value, dict):
+                continue
+            self.add(key, IndexedEntry(path=name, datatype=Field, uri=uri, value=value))
+
+    def field_value(self, key: RowKey, path: str) -> ty.Tuple[bool, ty.Any]:
+        """Returns whether a value for the field was found in the index and its
+        value"""
+        # Looked up with `get` so that rows missing from the index aren't added to it
+        entry = self.entries.get(key, {}).get(path)
+        if entry is None:
+            return False, None
+        return entry.datatype is Field, entry.value
+
+    def set_field_value(self, key: RowKey, path: str, value: ty.Any, uri: str):
+        """Records a value written to a field, so that the index stays consistent with
+        the values the store has been given"""
+        entry = self.entries[key].get(path)
+        if entry is None:
+            self.add(key, IndexedEntry(path=path, datatype=Field, uri=uri, value=value))
+        else:
+            entry.value = value
+
+
+@attrs.define
+class PagedEntryIndex:
+    """The entry index of a project split into pages of consecutive sessions (in the
+    order they are added to the data tree), each of which is built when one of its
+    rows is first populated. Only the most recently used pages are kept, so the
+    memory held by the index scales with the rows in use rather than the size of the
+    project
+
+    Parameters
+    ----------
+    project_id : str
+        the Flywheel ID of the project
+    pages : list[dict[RowKey, str]]
+        the IDs of the subject and session containers in each page keyed by their row
+        key. Subjects whose sessions span pages are in each of them
+    max_pages : int, optional
+        the maximum number of pages that are kept, by default all of them
+    analyses : dict[str, list[IndexedEntry]], optional
+        the derivative entries of the project keyed by the ID of the container they
+        are attached to, which are listed once for the whole project as analyses
+        can't be listed by page
+    """
+
+    project_id: str
+    pages: ty.List[ty.Dict[RowKey, str]] = attrs.field(factory=lambda: [{}])
+    max_pages: ty.Optional[int] = None
+    analyses: ty.Optional[ty.Dict[str, ty.List[IndexedEntry]]] = None
+    _page_numbers: ty.Dict[RowKey, int] = attrs.field(
+        factory=lambda: {(): 0}, init=False, repr=False
+    )
+    _indices: ty.Dict[int, EntryIndex] = attrs.field(
+        factory=OrderedDict, init=False, repr=False
+    )
+
+    def __attrs_post_init__(self):
+        for page_number, container_ids in enumerate(self.pages):
+            for key in container_ids:
+                self._page_numbers.setdefault(key, page_number)
+
+    @classmethod
+    def from_container_ids(
+        cls,
+        project_id: str,
+        container_ids: ty.Dict[RowKey, str],
+        page_size: int,
+        max_pages: ty.Optional[int] = None,
+    ) -> PagedEntryIndex:
+        """Splits the subjects and sessions of a project into pages
+
+        Parameters
+        ----------
+        project_id : str
+            the Flywheel ID of the project
+        container_ids : dict[RowKey, str]
+            the IDs of the subject and session containers of the project (e.g. of a
+            `ContainerResolver`) in the order their rows are added to the tree
+        page_size : int
+            the number of sessions in each page
+        max_pages : int, optional
+            the maximum number of pages that are kept, by default all of them
+        """
+        pages = [{}]
+        num_sessions = 0
+        for key, container_id in container_ids.items():
+            if len(key) != 2:
+                continue
+            if num_sessions == page_size:
+                pages.append({})
+                num_sessions = 0
+            subject_id = container_ids.get(key[:1])
+            if subject_id is not None:
+                pages[-1][key[:1]] = subject_id
+            pages[-1][key] = container_id
+            num_sessions += 1
+        return cls(project_id=project_id, pages=pages, max_pages=max_pages)
+
+    @property
+    def num_pages(self) -> int:
+        return len(self.pages)
+
+    def page_of(self, key: RowKey) -> ty.Optional[int]:
+        """The number of the page that holds the entries of a row, or None if the row
+        isn't in the project"""
+        return self._page_numbers.get(key)
+
+    def get(self, page_number: int) -> ty.Optional[EntryIndex]:
+        """Returns the index of a page if it is loaded"""
+        index = self._indices.get(page_number)
+        if index is not None:
+            self._indices.move_to_end(page_number)
+        return index
+
+    def add(self, page_number: int, index: EntryIndex):
+        """Adds the index of a page, unloading the least recently used pages beyond
+        `max_pages`"""
+        self._indices[page_number] = index
+        self._indices.move_to_end(page_number)
+        while self.max_pages is not None and len(self._indices) > self.max_pages:
+            self._indices.popitem(last=False)
+
+    def loaded(self, key: RowKey) -> ty.Optional[EntryIndex]:
+        """The index of the page that holds the row if it is loaded"""
+        page_number = self.page_of(key)
+        return self._indices.get(page_number) if page_number is not None else None
+
+    def field_value(self, key: RowKey, path: str) -> ty.Tuple[bool, ty.Any]:
+        index = self.loaded(key)
+        if index is None:
+            return False, None
+        return index.field_value(key, path)
+
+    def set_field_value(self, key: RowKey, path: str, value: ty.Any, uri: str):
+        index = self.loaded(key)
+        if index is not None:
+            index.set_field_value(key, path, value, uri)
+
+
+####################################################################
+# Compatibility shim for releasing the entries of arcana data rows #
+####################################################################
+
+# Arcana doesn't provide a public way to release the entries a row has been populated
+# with. They are held in the private `_entries_dict` attribute of `DataRow`, which
+# is populated lazily by the store when it is None, along with the cells built on
+# them in `_cells`. Resetting them relies on this layout, so it is only done for the
+# (major, minor) versions of arcana it has been checked against
+ROW_RELEASE_ARCANA_VERSIONS = frozenset([(0, 9), (0, 10)])
+
+
+@functools.lru_cache()
+def arcana_version() -> ty.Optional[ty.Tuple[int, int]]:
+    """The (major, minor) version of the installed arcana package, or None if it
+    can't be determined"""
+    try:
+        match = re.match(r"(\d+)\.(\d+)", importlib.metadata.version("arcana"))
+    except importlib.metadata.PackageNotFoundError:
+        return None
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def release_row_entries(row: DataRow, expected: ty.Optional[int] = None) -> bool:
+    """Releases the entries of a populated row (and the cells built on them), so
+    that they are repopulated by the store when they are next accessed. Rows are
+    only released with the versions of arcana in `ROW_RELEASE_ARCANA_VERSIONS`, as
+    it resets private attributes of the row
+
+    Parameters
+    ----------
+    row : DataRow
+        the row to release the entries of
+    expected : int, optional
+        the number of entries the row was populated with. Rows that have had entries
+        added since (e.g. derivatives being created) aren't released
+
+    Returns
+    -------
+    bool
+        whether the entries of the row were released
+    """
+    if arcana_version() not in ROW_RELEASE_ARCANA_VERSIONS:
+        return False
+    entries = row._entries_dict
+    if entries is None or (expected is not None and len(entries) != expected):
+        return False
+    row._entries_dict = None
+    row._cells = {}
+    return True
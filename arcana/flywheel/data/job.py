@@ -0,0 +1,158 @@
+"""
+Snapshots of the tree of a dataset and the entries of the rows a job is launched on,
+which are handed to the job so that it doesn't need to scan the project again
+"""
+from __future__ import annotations
+import json
+import logging
+import typing as ty
+from pathlib import Path
+from datetime import datetime
+import attrs
+from dateutil.parser import isoparse
+from fileformats.core import FileSet, Field
+from arcana.core.utils.misc import JSON_ENCODING
+from .tree import TreeLeaf, TreeSnapshot
+from .index import IndexedEntry, RowKey
+
+
+logger = logging.getLogger("arcana")
+
+
+# Name of the configuration value or input file the launcher hands the snapshot to the
+# job in
+SNAPSHOT_KEY = "arcana_snapshot"
+
+# Name of the input file the tree of a snapshot is handed to the jobs of a batch in,
+# so it is uploaded once for the whole batch instead of in the configuration of each
+# job (see `JobSnapshot.tree_asdict`)
+TREE_INPUT = "arcana_tree"
+
+# Names of the attributes of the leaves, which are serialised as columns
+LEAF_COLUMNS = (
+    "subject_label",
+    "session_label",
+    "subject_id",
+    "session_id",
+    "timestamp",
+    "age",
+)
+
+
+@attrs.define
+class JobSnapshot:
+    """The tree of a dataset and the entries of the rows a job is launched on, taken
+    by the launcher and handed to the job (e.g. in its configuration). The leaves of
+    the tree are serialised in columns and only the entries of the rows the job is
+    launched on are included, to keep the snapshot compact
+
+    Parameters
+    ----------
+    dataset_id : str
+        the ID of the dataset
+    tree : TreeSnapshot
+        the snapshot of the tree of the dataset
+    taken : datetime
+        the time (in UTC) the entries of the rows began to be listed, which they are
+        checked to be up to date since
+    rows : dict[RowKey, list[IndexedEntry]]
+        the entries of the rows the job is launched on
+    """
+
+    # Bump whenever the serialised format of the snapshot changes so that jobs
+    # launched by a different version of the store fall back to scanning the project
+    VERSION = 1
+
+    dataset_id: str
+    tree: TreeSnapshot
+    taken: datetime
+    rows: ty.Dict[RowKey, ty.List[IndexedEntry]] = attrs.field(factory=dict)
+
+    @classmethod
+    def fromdict(cls, dct: ty.Dict[str, ty.Any]) -> ty.Optional[JobSnapshot]:
+        """Loads a snapshot serialised by `asdict`, returning None if it was
+        serialised by a different version of the store"""
+        if dct.get("version") != cls.VERSION:
+            logger.info(
+                "Ignoring job snapshot in format version %s (expected %s)",
+                dct.get("version"),
+                cls.VERSION,
+            )
+            return None
+        leaves = dct["leaves"]
+        return cls(
+            dataset_id=dct["dataset_id"],
+            tree=TreeSnapshot(
+                project_id=dct["project_id"],
+                scanned=isoparse(dct["scanned"]),
+                taken=isoparse(dct["tree_taken"]),
+                leaves=[
+                    TreeLeaf.fromdict(dict(zip(LEAF_COLUMNS, values)))
+                    for values in zip(*(leaves[c] for c in LEAF_COLUMNS))
+                ],
+            ),
+            taken=isoparse(dct["taken"]),
+            rows={
+                tuple(key): [_entry_fromdict(e) for e in entries]
+                for key, entries in dct["rows"]
+            },
+        )
+
+    def asdict(self) -> ty.Dict[str, ty.Any]:
+        return {**self.tree_asdict(), **self.rows_asdict()}
+
+    def tree_asdict(self) -> ty.Dict[str, ty.Any]:
+        """Serialises the tree of the snapshot only, which is shared by all the jobs
+        of a batch. `fromdict` loads the union of this and `rows_asdict`"""
+        leaves = [leaf.asdict() for leaf in self.tree.leaves]
+        return {
+            "version": self.VERSION,
+            "project_id": self.tree.project_id,
+            "scanned": self.tree.scanned.isoformat(),
+            "tree_taken": self.tree.taken.isoformat(),
+            "leaves": {c: [leaf[c] for leaf in leaves] for c in LEAF_COLUMNS},
+        }
+
+    def rows_asdict(self) -> ty.Dict[str, ty.Any]:
+        """Serialises the entries of the rows of the snapshot only, which are specific
+        to each job of a batch"""
+        return {
+            "version": self.VERSION,
+            "dataset_id": self.dataset_id,
+            "taken": self.taken.isoformat(),
+            "rows": [
+                [list(key), [_entry_asdict(e) for e in entries]]
+                for key, entries in self.rows.items()
+            ],
+        }
+
+    @classmethod
+    def load(cls, path: Path) -> ty.Optional[JobSnapshot]:
+        with open(path, **JSON_ENCODING) as f:
+            return cls.fromdict(json.load(f))
+
+    def save(self, path: Path):
+        with open(path, "w", **JSON_ENCODING) as f:
+            json.dump(self.asdict(), f, separators=(",", ":"))
+
+    def subset(self, keys: ty.Iterable[RowKey]) -> JobSnapshot:
+        """Returns a snapshot with only the entries of the given rows, e.g. to hand to
+        each of a batch of jobs launched from a single snapshot"""
+        return attrs.evolve(
+            self, rows={k: self.rows[k] for k in keys if k in self.rows}
+        )
+
+
+def _entry_asdict(entry: IndexedEntry) -> ty.Dict[str, ty.Any]:
+    dct = {"path": entry.path, "uri": entry.uri}
+    if entry.datatype is Field:
+        dct["value"] = entry.value
+    if entry.order is not None:
+        dct["order"] = entry.order
+    if entry.checksums is not None:
+        dct["checksums"] = entry.checksums
+    return dct
+
+
+def _entry_fromdict(dct: ty.Dict[str, ty.Any]) -> IndexedEntry:
+    return IndexedEntry(datatype=Field if "value" in dct else FileSet, **dct)
@@ -0,0 +1,321 @@
+"""
+Instrumentation of the operations performed by the store, i.e. the calls made to its
+public methods and the requests they make through the SDK
+"""
+from __future__ import annotations
+import os
+import json
+import time
+import atexit
+import bisect
+import logging
+import functools
+import weakref
+import threading
+import typing as ty
+from pathlib import Path
+import attrs
+from arcana.core.utils.misc import JSON_ENCODING
+
+
+logger = logging.getLogger("arcana")
+
+
+# Upper bounds (in seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    float("inf"),
+)
+
+PROMETHEUS_PREFIX = "arcana_flywheel"
+
+
+@attrs.define
+class OperationMetrics:
+    """Metrics recorded for a single type of operation
+
+    Parameters
+    ----------
+    count : int
+        the number of times the operation was performed
+    errors : int
+        the number of times the operation raised an error
+    bytes : int
+        the number of bytes transferred by the operation
+    latency_sum : float
+        the total time (in seconds) spent performing the operation
+    latency_buckets : list[int]
+        the number of operations that completed within each of `LATENCY_BUCKETS`
+        (non-cumulative)
+    """
+
+    count: int = 0
+    errors: int = 0
+    bytes: int = 0
+    latency_sum: float = 0.0
+    latency_buckets: ty.List[int] = attrs.field(
+        factory=lambda: [0] * len(LATENCY_BUCKETS)
+    )
+
+    def observe(self, latency: float, error: bool = False):
+        self.count += 1
+        self.errors += int(error)
+        self.latency_sum += latency
+        self.latency_buckets[bisect.bisect_left(LATENCY_BUCKETS, latency)] += 1
+
+    def merge(self, other: OperationMetrics):
+        self.count += other.count
+        self.errors += other.errors
+        self.bytes += other.bytes
+        self.latency_sum += other.latency_sum
+        self.latency_buckets = [
+            a + b for a, b in zip(self.latency_buckets, other.latency_buckets)
+        ]
+
+
+@attrs.define(eq=False)
+class Metrics:
+    """Thread-safe registry of the metrics recorded by a store, keyed by the kind of
+    operation ("store" for calls to methods of the store and "sdk" for requests made
+    through the SDK) and its name
+
+    Parameters
+    ----------
+    dump_path : Path, optional
+        path to dump the metrics to when the process exits (see `dump`). The ID of the
+        process is inserted before the extension of the path so that the processes
+        sharing it (e.g. workers) don't overwrite each other's metrics, and the metrics
+        of all the registries in the process with the same path are merged (including
+        those of registries that were garbage-collected before it exits)
+    """
+
+    dump_path: ty.Optional[Path] = attrs.field(
+        default=None, converter=lambda p: Path(p) if p is not None else None
+    )
+    operations: ty.Dict[ty.Tuple[str, str], OperationMetrics] = attrs.field(
+        factory=dict, init=False
+    )
+    _lock: threading.Lock = attrs.field(factory=threading.Lock, init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        if self.dump_path is not None:
+            _dump_at_exit(self)
+
+    def record(self, kind: str, name: str, latency: float, error: bool = False):
+        """Records the completion of an operation"""
+        with self._lock:
+            self._get(kind, name).observe(latency, error)
+
+    def add_bytes(self, kind: str, name: str, num_bytes: int):
+        """Records the number of bytes transferred by an operation"""
+        with self._lock:
+            self._get(kind, name).bytes += num_bytes
+
+    def timer(self, kind: str, name: str) -> ty.ContextManager:
+        """Context manager that records the time taken by the operation it wraps and
+        whether it raised an error"""
+        return _Timer(self, kind, name)
+
+    def reset(self):
+        with self._lock:
+            self.operations.clear()
+
+    def merge(self, other: Metrics):
+        """Adds the metrics recorded by another registry to this one"""
+        with other._lock:
+            operations = [
+                (key, attrs.evolve(m, latency_buckets=list(m.latency_buckets)))
+                for key, m in other.operations.items()
+            ]
+        with self._lock:
+            for (kind, name), metrics in operations:
+                self._get(kind, name).merge(metrics)
+
+    def snapshot(self) -> ty.Dict[str, ty.Dict[str, ty.Dict[str, ty.Any]]]:
+        """Returns a copy of the recorded metrics, nested by kind and then name of the
+        operation"""
+        dct = {}
+        with self._lock:
+            for (kind, name), metrics in sorted(self.operations.items()):
+                dct.setdefault(kind, {})[name] = attrs.asdict(metrics)
+        return dct
+
+    def to_json(self) -> str:
+        return json.dumps(
+            {
+                "latency_buckets": [str(b) for b in LATENCY_BUCKETS],
+                "operations": self.snapshot(),
+            },
+            indent=2,
+        )
+
+    def to_prometheus(self) -> str:
+        """Formats the metrics in the Prometheus text exposition format"""
+        prefix = PROMETHEUS_PREFIX
+        lines = [
+            f"# TYPE {prefix}_operations_total counter",
+            f"# TYPE {prefix}_errors_total counter",
+            f"# TYPE {prefix}_bytes_total counter",
+            f"# TYPE {prefix}_duration_seconds histogram",
+        ]
+        for kind, operations in self.snapshot().items():
+            for name, metrics in operations.items():
+                labels = f'kind="{kind}",operation="{name}"'
+                lines.append(f"{prefix}_operations_total{{{labels}}} {metrics['count']}")
+                lines.append(f"{prefix}_errors_total{{{labels}}} {metrics['errors']}")
+                lines.append(f"{prefix}_bytes_total{{{labels}}} {metrics['bytes']}")
+                cumulative = 0
+                for bound, num in zip(LATENCY_BUCKETS, metrics["latency_buckets"]):
+                    cumulative += num
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(
+                        f'{prefix}_duration_seconds_bucket{{{labels},le="{le}"}} '
+                        f"{cumulative}"
+                    )
+                lines.append(
+                    f"{prefix}_duration_seconds_sum{{{labels}}} "
+                    f"{metrics['latency_sum']}"
+                )
+                lines.append(
+                    f"{prefix}_duration_seconds_count{{{labels}}} {metrics['count']}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def dump(self, path: ty.Union[str, Path], format: ty.Optional[str] = None):
+        """Writes the metrics to a file
+
+        Parameters
+        ----------
+        path : str or Path
+            the path to write the metrics to
+        format : str, optional
+            either "json" or "prometheus". By default the format is inferred from the
+            extension of the path (".prom" and ".txt" for Prometheus, otherwise JSON)
+        """
+        path = Path(path)
+        if format is None:
+            format = "prometheus" if path.suffix in (".prom", ".txt") else "json"
+        if format == "prometheus":
+            text = self.to_prometheus()
+        elif format == "json":
+            text = self.to_json()
+        else:
+            raise ValueError(f"Unrecognised metrics format '{format}'")
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", **JSON_ENCODING) as f:
+            f.write(text)
+        logger.info("Dumped Flywheel store metrics to %s", path)
+
+    def _get(self, kind: str, name: str) -> OperationMetrics:
+        try:
+            return self.operations[(kind, name)]
+        except KeyError:
+            metrics = self.operations[(kind, name)] = OperationMetrics()
+            return metrics
+
+
+@attrs.define
+class _Timer:
+    metrics: Metrics
+    kind: str
+    name: str
+    start: float = 0.0
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.record(
+            self.kind, self.name, time.monotonic() - self.start, exc_type is not None
+        )
+
+
+def instrumented(method: ty.Callable) -> ty.Callable:
+    """Decorates a method of the store so that its calls are recorded in the metrics
+    of the store"""
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.metrics.timer("store", method.__name__):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+# Registries that are dumped when the process exits, which are registered by a single
+# exit hook per process. They are held weakly, and the metrics of those that are
+# garbage-collected before the process exits are merged into `_retired` (by dump
+# path), so processes that create many stores don't accumulate their registries
+_exit_registries: ty.MutableSet[Metrics] = weakref.WeakSet()
+_retired: ty.Dict[Path, Metrics] = {}
+_exit_hook_registered = False
+_exit_lock = threading.Lock()
+
+
+def _dump_at_exit(metrics: Metrics):
+    global _exit_hook_registered
+    with _exit_lock:
+        if not _exit_hook_registered:
+            atexit.register(_dump_registries)
+            _exit_hook_registered = True
+        _exit_registries.add(metrics)
+    # The operations are passed to the finalizer rather than the registry, so it
+    # doesn't keep the registry alive
+    finalizer = weakref.finalize(
+        metrics, _retire_registry, metrics.dump_path, metrics.operations
+    )
+    # Registries that are still alive at exit are dumped by `_dump_registries`
+    finalizer.atexit = False
+
+
+def _retire_registry(
+    dump_path: Path, operations: ty.Dict[ty.Tuple[str, str], OperationMetrics]
+):
+    with _exit_lock:
+        retired = _retired.setdefault(dump_path, Metrics())
+        for (kind, name), metrics in operations.items():
+            retired._get(kind, name).merge(metrics)
+
+
+def _dump_registries():
+    with _exit_lock:
+        registries = [(m.dump_path, m) for m in _exit_registries]
+        registries.extend(_retired.items())
+    merged = {}
+    for path, metrics in registries:
+        merged.setdefault(path, Metrics()).merge(metrics)
+    for path, metrics in merged.items():
+        metrics.dump(process_dump_path(path))
+
+
+def _forget_registries():
+    """Forgets the registries inherited by a forked child process, whose metrics are
+    dumped by the parent, so they aren't counted twice. The exit hook is inherited
+    along with them"""
+    global _exit_registries, _retired, _exit_lock
+    _exit_registries = weakref.WeakSet()
+    _retired = {}
+    # The lock may have been held by another thread of the parent when it forked
+    _exit_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_forget_registries)
+
+
+def process_dump_path(path: Path) -> Path:
+    """Inserts the ID of the current process before the extension of the path"""
+    return path.with_name(f"{path.stem}.{os.getpid()}{path.suffix}")
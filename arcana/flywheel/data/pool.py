@@ -0,0 +1,160 @@
+"""
+Pool of authenticated Flywheel clients shared by the threads of a process, so that
+connecting to the store doesn't repeat the authentication and TLS handshakes
+"""
+from __future__ import annotations
+import os
+import logging
+import threading
+import typing as ty
+import attrs
+import requests
+from arcana.core.data.store.base import ConnectionManager
+
+
+logger = logging.getLogger("arcana")
+
+
+@attrs.define
+class ClientPool:
+    """A bounded pool of Flywheel clients that are borrowed by `Flywheel.connect` and
+    returned by `Flywheel.disconnect`. Idle clients keep their HTTP connections open,
+    so subsequent connections reuse them.
+
+    Parameters
+    ----------
+    factory : Callable[[], flywheel.Client]
+        creates (and authenticates) a new client
+    max_clients : int
+        the maximum number of clients that can be borrowed at once. Further attempts
+        to borrow a client block until one is returned
+    http_pool_size : int
+        the number of keep-alive HTTP connections each client holds open to the
+        server, which should be at least the number of threads that share a
+        borrowed client (i.e. for concurrent transfers)
+    max_retries : urllib3.util.Retry, optional
+        the retry policy of the HTTP adapters of the clients, by default the one
+        configured by the SDK
+    """
+
+    factory: ty.Callable[[], ty.Any]
+    max_clients: int = 10
+    http_pool_size: int = 10
+    max_retries: ty.Any = None
+    _idle: ty.List[ty.Any] = attrs.field(factory=list, init=False, repr=False)
+    _num_clients: int = attrs.field(default=0, init=False, repr=False)
+    _pid: int = attrs.field(factory=os.getpid, init=False, repr=False)
+    _condition: threading.Condition = attrs.field(
+        factory=threading.Condition, init=False, repr=False
+    )
+
+    def acquire(self, timeout: ty.Optional[float] = None):
+        """Borrows an idle client from the pool, creating a new one if there are none
+        and the pool isn't full
+
+        Parameters
+        ----------
+        timeout : float, optional
+            the maximum time to wait for a client to be returned if the pool is full
+
+        Returns
+        -------
+        flywheel.Client
+            the borrowed client
+        """
+        with self._condition:
+            self._reset_after_fork()
+            if not self._condition.wait_for(
+                lambda: self._idle or self._num_clients < self.max_clients,
+                timeout=timeout,
+            ):
+                raise TimeoutError(
+                    f"Timed out waiting for one of the {self.max_clients} Flywheel "
+                    "clients in the pool to be returned"
+                )
+            if self._idle:
+                return self._idle.pop()
+            self._num_clients += 1
+        # Create the client outside of the lock as authenticating it is slow
+        try:
+            client = self.factory()
+        except BaseException:
+            with self._condition:
+                self._num_clients -= 1
+                self._condition.notify()
+            raise
+        self._resize_http_pool(client)
+        logger.debug("Created Flywheel client %s in pool", self._num_clients)
+        return client
+
+    def release(self, client):
+        """Returns a borrowed client to the pool"""
+        with self._condition:
+            if os.getpid() != self._pid:
+                # Borrowed before the process was forked, so drop it
+                return
+            self._idle.append(client)
+            self._condition.notify()
+
+    def close(self):
+        """Closes the HTTP connections of the idle clients and removes them from the
+        pool"""
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._num_clients -= len(idle)
+            self._condition.notify_all()
+        for client in idle:
+            client.api_client.rest_client.session.close()
+            client.shutdown()
+
+    def _reset_after_fork(self):
+        """Clients (and their sockets) inherited from a parent process can't be
+        shared with it, so child processes start with an empty pool"""
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._idle = []
+            self._num_clients = 0
+
+    def _resize_http_pool(self, client):
+        """Remounts the HTTP adapters of the client so that the number of
+        connections kept alive matches the number of threads that share it"""
+        session: requests.Session = client.api_client.rest_client.session
+        for prefix in ("http://", "https://"):
+            max_retries = self.max_retries
+            if max_retries is None:
+                max_retries = session.get_adapter(prefix).max_retries
+            session.mount(
+                prefix,
+                requests.adapters.HTTPAdapter(
+                    max_retries=max_retries,
+                    pool_connections=1,
+                    pool_maxsize=self.http_pool_size,
+                ),
+            )
+
+
+class ThreadLocalConnectionManager(ConnectionManager):
+    """Connection manager that tracks the depth of the nested connection contexts and
+    the connected session separately in each thread, so that threads working in the
+    background (e.g. prefetching) borrow their own clients from the pool instead of
+    sharing (and disconnecting) the session of another thread"""
+
+    def __init__(self, *args, **kwargs):
+        object.__setattr__(self, "_local", threading.local())
+        super().__init__(*args, **kwargs)
+
+    @property
+    def depth(self) -> int:
+        return getattr(self._local, "depth", 0)
+
+    @depth.setter
+    def depth(self, depth: int):
+        self._local.depth = depth
+
+    @property
+    def session(self):
+        return getattr(self._local, "session", None)
+
+    @session.setter
+    def session(self, session):
+        self._local.session = session
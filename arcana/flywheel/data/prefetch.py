@@ -0,0 +1,255 @@
+"""
+Background prefetching of the file-sets of the rows ahead of the one being processed,
+so that downloading the inputs of the next rows overlaps with the processing of the
+current one
+"""
+from __future__ import annotations
+import os
+import logging
+import threading
+import typing as ty
+import attrs
+from fileformats.core import FileSet
+from arcana.core.data.row import DataRow
+from arcana.core.data.entry import DataEntry
+from arcana.core.exceptions import ArcanaDataMatchError
+
+if ty.TYPE_CHECKING:
+    from .api import Flywheel
+
+
+logger = logging.getLogger("arcana")
+
+
+@attrs.define
+class PrefetchItem:
+    """A file-set to prefetch
+
+    Parameters
+    ----------
+    entry : DataEntry
+        the entry the file-set is stored in
+    datatype : type
+        the datatype of the column the entry matched
+    """
+
+    entry: DataEntry
+    datatype: type
+
+
+@attrs.define(eq=False)
+class Prefetcher:
+    """Downloads the file-sets matched by the source columns of the rows ahead of the
+    one being processed into the cache of the store in a background thread.
+
+    The entries matched by each row are resolved in the thread processing the rows as
+    the row being processed advances, only as far as the prefetch depth, so rows
+    aren't populated (i.e. their pages of the entry index aren't loaded) long before
+    they are needed and the background thread only transfers files. The row being
+    processed is advanced by iterating the prefetcher, by calling `advance` or
+    implicitly when a file-set of a later row is retrieved from the store. Rows that
+    have already been reached aren't prefetched, as they are fetched by the process
+    that needs them (which waits for a prefetch of the same entry that is in progress
+    to complete, instead of downloading it twice).
+
+    Parameters
+    ----------
+    store : Flywheel
+        the store to prefetch the file-sets from
+    rows : list[DataRow]
+        the rows in the order they are processed
+    columns : list[str]
+        the names of the (source) columns to prefetch the file-sets of
+    depth : int
+        the number of rows ahead of the row being processed to prefetch
+    max_bytes : int, optional
+        the maximum number of bytes of prefetched file-sets that haven't been
+        reached yet, on top of the row being prefetched, by default unlimited
+        (within `depth`)
+    """
+
+    store: Flywheel
+    rows: ty.List[DataRow] = attrs.field(converter=list)
+    columns: ty.List[str] = attrs.field(converter=list)
+    depth: int = 2
+    max_bytes: ty.Optional[int] = None
+    # The file-sets to prefetch of each of the rows resolved so far
+    _items: ty.List[ty.List[PrefetchItem]] = attrs.field(factory=list, init=False)
+    # Positions of the rows keyed by their frequency and ID
+    _row_indices: ty.Dict[ty.Tuple[str, str], int] = attrs.field(
+        factory=dict, init=False
+    )
+    _resolve_lock: threading.Lock = attrs.field(
+        factory=threading.Lock, init=False, repr=False
+    )
+    _current: int = attrs.field(default=-1, init=False)
+    _pending_bytes: ty.Dict[int, int] = attrs.field(factory=dict, init=False)
+    _in_progress: ty.Dict[str, threading.Event] = attrs.field(factory=dict, init=False)
+    _condition: threading.Condition = attrs.field(
+        factory=threading.Condition, init=False, repr=False
+    )
+    _thread: ty.Optional[threading.Thread] = attrs.field(
+        default=None, init=False, repr=False
+    )
+    _closed: bool = attrs.field(default=False, init=False)
+
+    def start(self) -> Prefetcher:
+        """Resolves the entries of the rows within the prefetch depth of the first row
+        and starts prefetching them"""
+        self._row_indices = {
+            (str(row.frequency), row.id): i for i, row in enumerate(self.rows)
+        }
+        self._resolve(self.depth)
+        self.store.register_prefetcher(self)
+        self._thread = threading.Thread(
+            target=self._run, name="arcana-flywheel-prefetch", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def advance(self, index: int):
+        """Marks the row at the given index as the one being processed, releasing the
+        budget held by the file-sets prefetched for the rows before it
+
+        Parameters
+        ----------
+        index : int
+            the index of the row in `rows`
+        """
+        with self._condition:
+            if index <= self._current:
+                return
+            self._current = index
+            for i in [i for i in self._pending_bytes if i <= index]:
+                del self._pending_bytes[i]
+        self._resolve(index + self.depth)
+        with self._condition:
+            self._condition.notify_all()
+
+    def accessed(self, entry: DataEntry):
+        """Called by the store before a file-set is retrieved, so that the prefetcher
+        follows the row that is being processed. If the file-set is being prefetched,
+        it waits for the download to complete"""
+        if threading.current_thread() is self._thread:
+            return
+        index = self._row_indices.get((str(entry.row.frequency), entry.row.id))
+        if index is None:
+            return
+        self.advance(index)
+        with self._condition:
+            in_progress = self._in_progress.get(entry.uri)
+        if in_progress is not None:
+            logger.debug("Waiting for prefetch of %s to complete", entry.uri)
+            in_progress.wait()
+
+    def close(self):
+        """Stops prefetching, waiting for the file-set being downloaded to complete"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.store.unregister_prefetcher(self)
+
+    def __iter__(self) -> ty.Iterator[DataRow]:
+        for i, row in enumerate(self.rows):
+            self.advance(i)
+            yield row
+
+    def __enter__(self) -> Prefetcher:
+        if self._thread is None:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _run(self):
+        index = 0
+        while True:
+            with self._condition:
+                while not self._closed and not self._ready(index):
+                    self._condition.wait()
+                if self._closed:
+                    return
+                # Rows that have been reached are fetched by the process itself
+                index = max(index, self._current + 1)
+                if index >= len(self.rows):
+                    return
+            num_bytes = self._prefetch_row(index)
+            with self._condition:
+                if index > self._current:
+                    self._pending_bytes[index] = num_bytes
+            index += 1
+
+    def _ready(self, index: int) -> bool:
+        """Whether the row at the index (or the row after the current one if it has
+        already been reached) can be prefetched within the depth and byte budget"""
+        index = max(index, self._current + 1)
+        if index >= len(self.rows):
+            return True
+        if index > self._current + self.depth or index >= len(self._items):
+            return False
+        return self.max_bytes is None or sum(self._pending_bytes.values()) < self.max_bytes
+
+    def _resolve(self, index: int):
+        """Resolves the entries matched by the rows up to (and including) the index,
+        which is done in the thread processing the rows so that the background thread
+        doesn't access the rows and cells of the dataset"""
+        with self._resolve_lock:
+            while len(self._items) <= min(index, len(self.rows) - 1):
+                row = self.rows[len(self._items)]
+                items = []
+                for column_name in self.columns:
+                    column = row.dataset[column_name]
+                    if column.row_frequency != row.frequency:
+                        continue
+                    try:
+                        entry = row.cell(column_name, allow_empty=True).entry
+                    except ArcanaDataMatchError as e:
+                        # The error is raised when the row is processed
+                        logger.debug(
+                            "Not prefetching %s of %s: %s", column_name, row, e
+                        )
+                        continue
+                    if entry is None or not issubclass(entry.datatype, FileSet):
+                        continue
+                    items.append(PrefetchItem(entry=entry, datatype=column.datatype))
+                with self._condition:
+                    self._items.append(items)
+
+    def _prefetch_row(self, index: int) -> int:
+        with self._condition:
+            items = self._items[index]
+            # The row is claimed under the lock, so a process that reaches it
+            # concurrently either sees it being prefetched or isn't raced by it
+            if index <= self._current:
+                return 0
+            events = {i.entry.uri: threading.Event() for i in items}
+            self._in_progress.update(events)
+        num_bytes = 0
+        for item in items:
+            try:
+                with self.store.metrics.timer("store", "prefetch"):
+                    self.store.get_fileset(item.entry, item.datatype)
+            except Exception as e:
+                # The error is raised when the file-set is retrieved by the process
+                logger.warning("Could not prefetch %s: %s", item.entry.uri, e)
+                continue
+            finally:
+                with self._condition:
+                    del self._in_progress[item.entry.uri]
+                events[item.entry.uri].set()
+            cache_path = self.store.cache_path(item.entry.uri)
+            for root, _, filenames in os.walk(cache_path):
+                num_bytes += sum(
+                    os.path.getsize(os.path.join(root, f)) for f in filenames
+                )
+        logger.debug(
+            "Prefetched %s bytes for row %s (%s of %s)",
+            num_bytes,
+            self.rows[index],
+            index + 1,
+            len(self.rows),
+        )
+        return num_bytes
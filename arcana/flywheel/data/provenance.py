@@ -0,0 +1,61 @@
+"""
+Compact encoding of the provenance records of the entries in a Flywheel container,
+which are stored together in a single compressed blob in the info of the container
+"""
+from __future__ import annotations
+import json
+import zlib
+import base64
+import logging
+import typing as ty
+
+
+logger = logging.getLogger("arcana")
+
+
+# Reserved info key the provenance blob of a container is stored under. Keys starting
+# with a double underscore aren't treated as fields
+PROVENANCE_INFO_KEY = "__arcana_provenance__"
+
+
+def encode_provenance(provenance: ty.Dict[str, ty.Dict[str, ty.Any]]) -> str:
+    """Encodes the provenance records of the entries in a container into a compressed
+    string. The outputs of a pipeline node share the same record, so identical
+    records are only stored once
+
+    Parameters
+    ----------
+    provenance : dict[str, dict[str, Any]]
+        the provenance record of each entry keyed by entry path
+
+    Returns
+    -------
+    str
+        the compressed blob
+    """
+    records = []
+    record_indices = {}
+    entries = {}
+    for path, record in sorted(provenance.items()):
+        serialised = json.dumps(record, sort_keys=True)
+        try:
+            index = record_indices[serialised]
+        except KeyError:
+            index = record_indices[serialised] = len(records)
+            records.append(record)
+        entries[path] = index
+    blob = json.dumps({"records": records, "entries": entries}).encode()
+    return base64.b64encode(zlib.compress(blob)).decode()
+
+
+def decode_provenance(blob: ty.Optional[str]) -> ty.Dict[str, ty.Dict[str, ty.Any]]:
+    """Decodes a blob created by `encode_provenance`, returning an empty dictionary if
+    the container doesn't have one (or it can't be read)"""
+    if not blob:
+        return {}
+    try:
+        dct = json.loads(zlib.decompress(base64.b64decode(blob)))
+    except (ValueError, zlib.error):
+        logger.warning("Ignoring unreadable provenance blob")
+        return {}
+    return {path: dct["records"][i] for path, i in dct["entries"].items()}
@@ -0,0 +1,67 @@
+"""
+Index mapping the labels of the subjects and sessions of a Flywheel project to their
+container IDs, so that rows can be resolved to containers without querying the server
+"""
+from __future__ import annotations
+import time
+import typing as ty
+import attrs
+from .index import RowKey
+from .tree import TreeLeaf, LeafTable
+
+
+@attrs.define
+class ContainerResolver:
+    """Resolves the rows of a dataset to the IDs of the Flywheel containers they
+    correspond to
+
+    Parameters
+    ----------
+    project_id : str
+        the Flywheel ID of the project
+    container_ids : dict[RowKey, str]
+        the IDs of the subject and session containers keyed by the key of their row
+        (see ``EntryIndex.row_key``)
+    built : float
+        the (monotonic) time the resolver was built, used to expire it
+    """
+
+    project_id: str
+    container_ids: ty.Dict[RowKey, str] = attrs.field(factory=dict)
+    built: float = attrs.field(factory=time.monotonic)
+
+    @classmethod
+    def from_leaves(
+        cls, project_id: str, leaves: ty.Iterable[TreeLeaf]
+    ) -> ContainerResolver:
+        """Builds the resolver from the leaves scanned from the project, which already
+        hold the IDs of their subjects and sessions"""
+        resolver = cls(project_id=project_id)
+        for leaf in leaves:
+            resolver.add((leaf.subject_label,), leaf.subject_id)
+            resolver.add((leaf.subject_label, leaf.session_label), leaf.session_id)
+        return resolver
+
+    @classmethod
+    def from_table(cls, project_id: str, table: LeafTable) -> ContainerResolver:
+        """Builds the resolver from the table of the leaves of the project, sharing
+        their interned labels in its keys"""
+        resolver = cls(project_id=project_id)
+        for key, container_id in table.container_ids():
+            resolver.add(key, container_id)
+        return resolver
+
+    def add(self, key: RowKey, container_id: ty.Optional[str]):
+        """Adds a container to the index, e.g. after it has been created"""
+        if container_id is not None:
+            self.container_ids[key] = container_id
+
+    def resolve(self, key: RowKey) -> ty.Optional[str]:
+        """Returns the ID of the container corresponding to the row key, or None if it
+        isn't in the index"""
+        if key == ():
+            return self.project_id
+        return self.container_ids.get(key)
+
+    def expired(self, ttl: float) -> bool:
+        return time.monotonic() - self.built > ttl
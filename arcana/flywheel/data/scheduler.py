@@ -0,0 +1,241 @@
+"""
+Scheduler that all requests the store makes to the Flywheel server are routed through,
+adapting the number of requests in flight to what the server can sustain
+"""
+from __future__ import annotations
+import time
+import random
+import logging
+import functools
+import threading
+import typing as ty
+import attrs
+import requests
+from .metrics import Metrics
+
+
+logger = logging.getLogger("arcana")
+
+
+# HTTP statuses that signal the server is overloaded, as opposed to errors caused by
+# the request itself
+OVERLOAD_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+# SDK methods that can be safely repeated if they fail part way through
+IDEMPOTENT_PREFIXES = ("get", "lookup", "read_", "download_", "resolve")
+IDEMPOTENT_METHODS = frozenset(["modify_container_info"])
+
+# SDK methods that transfer the contents of files within the call, so their response
+# time depends on the size of the file rather than the load on the server
+TRANSFER_PREFIXES = ("upload_", "download_")
+
+
+def is_idempotent(method_name: str) -> bool:
+    return (
+        method_name.startswith(IDEMPOTENT_PREFIXES)
+        or method_name in IDEMPOTENT_METHODS
+    )
+
+
+def is_transfer(method_name: str) -> bool:
+    return method_name.startswith(TRANSFER_PREFIXES)
+
+
+def is_overload(error: BaseException) -> bool:
+    """Whether an exception raised by the SDK signals that the server is overloaded
+    (or unreachable), and therefore that the request can be retried"""
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    return getattr(error, "status", None) in OVERLOAD_STATUSES
+
+
+@attrs.define
+class RequestScheduler:
+    """Limits the number of requests in flight to the server, using an additive-
+    increase/multiplicative-decrease (AIMD) algorithm to find the concurrency the
+    server can sustain. The limit grows by roughly one request for each "window" of
+    successful requests, and is cut whenever the server signals that it is overloaded
+    (i.e. 429 and 5xx responses) or responses slow beyond `latency_target`. The
+    response times of file transfers aren't compared to the target, as they are
+    dominated by the size of the file. Requests to idempotent endpoints that fail
+    with an overload are retried after a jittered exponential backoff
+
+    Parameters
+    ----------
+    max_limit : int
+        the maximum number of requests that are allowed in flight at once
+    min_limit : int
+        the number of requests that are always allowed in flight
+    initial_limit : int
+        the number of requests allowed in flight before any feedback is received
+    latency_target : float
+        the response time (in seconds) above which the server is treated as overloaded
+    decrease_factor : float
+        the factor the limit is multiplied by when the server is overloaded
+    max_retries : int
+        the maximum number of times a request to an idempotent endpoint is retried
+    retry_delay : float
+        the delay (in seconds) before the first retry, which doubles with each
+        subsequent retry (with full jitter)
+    max_retry_delay : float
+        the maximum delay (in seconds) between retries
+    metrics : Metrics, optional
+        the metrics to record the latency and outcome of each request in
+    """
+
+    max_limit: int = 32
+    min_limit: int = 1
+    initial_limit: int = 4
+    latency_target: float = 10.0
+    decrease_factor: float = 0.5
+    max_retries: int = 5
+    retry_delay: float = 0.5
+    max_retry_delay: float = 30.0
+    metrics: ty.Optional[Metrics] = attrs.field(default=None, repr=False)
+    _limit: float = attrs.field(init=False, repr=False)
+    _in_flight: int = attrs.field(default=0, init=False, repr=False)
+    _last_decrease: float = attrs.field(default=0.0, init=False, repr=False)
+    _condition: threading.Condition = attrs.field(
+        factory=threading.Condition, init=False, repr=False
+    )
+
+    def __attrs_post_init__(self):
+        self._limit = float(min(max(self.initial_limit, self.min_limit), self.max_limit))
+
+    @property
+    def limit(self) -> int:
+        """The current number of requests allowed in flight"""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def call(
+        self,
+        method: ty.Callable,
+        *args,
+        idempotent: bool = False,
+        transfer: bool = False,
+        **kwargs,
+    ):
+        """Calls a method of the SDK once there is capacity for another request in
+        flight, retrying it if it is idempotent and the server is overloaded
+
+        Parameters
+        ----------
+        method : Callable
+            the SDK method to call
+        *args, **kwargs
+            the arguments to pass to the method
+        idempotent : bool
+            whether the method can be safely retried
+        transfer : bool
+            whether the method transfers the contents of a file, in which case its
+            response time isn't treated as a sign of overload
+
+        Returns
+        -------
+        Any
+            the result of the method
+        """
+        attempt = 0
+        while True:
+            self._acquire()
+            start = time.monotonic()
+            try:
+                result = method(*args, **kwargs)
+            except Exception as e:
+                overloaded = is_overload(e)
+                self._release(overloaded, start)
+                self._record(method, start, error=True)
+                if not (overloaded and idempotent and attempt < self.max_retries):
+                    raise
+                attempt += 1
+                delay = self._retry_delay(e, attempt)
+                logger.debug(
+                    "Retrying %s in %.2fs (attempt %s) after %s",
+                    getattr(method, "__name__", method),
+                    delay,
+                    attempt,
+                    e,
+                )
+                time.sleep(delay)
+            else:
+                self._release(
+                    not transfer and time.monotonic() - start > self.latency_target,
+                    start,
+                )
+                self._record(method, start)
+                return result
+
+    def _acquire(self):
+        with self._condition:
+            self._condition.wait_for(lambda: self._in_flight < int(self._limit))
+            self._in_flight += 1
+
+    def _release(self, overloaded: bool, started: float):
+        with self._condition:
+            self._in_flight -= 1
+            if overloaded:
+                # Requests that were already in flight when the limit was cut report
+                # the same overload, so only cut it once per round trip
+                if started > self._last_decrease:
+                    self._limit = max(
+                        self.min_limit, self._limit * self.decrease_factor
+                    )
+                    self._last_decrease = time.monotonic()
+                    logger.debug("Decreased request limit to %s", self.limit)
+            else:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._condition.notify_all()
+
+    def _record(self, method: ty.Callable, started: float, error: bool = False):
+        if self.metrics is not None:
+            self.metrics.record(
+                "sdk",
+                getattr(method, "__name__", str(method)),
+                time.monotonic() - started,
+                error,
+            )
+
+    def _retry_delay(self, error: BaseException, attempt: int) -> float:
+        """Full-jitter exponential backoff, or the delay requested by the server"""
+        headers = getattr(error, "headers", None) or {}
+        try:
+            return min(float(headers["Retry-After"]), self.max_retry_delay)
+        except (KeyError, TypeError, ValueError):
+            pass
+        return random.uniform(
+            0, min(self.max_retry_delay, self.retry_delay * 2 ** (attempt - 1))
+        )
+
+
+class ScheduledClient:
+    """Proxy of a Flywheel client that routes every call to its methods (and to the
+    methods of its ``*_api`` objects) through a request scheduler
+
+    Parameters
+    ----------
+    client : flywheel.Client
+        the client to proxy
+    scheduler : RequestScheduler
+        the scheduler to route calls through
+    """
+
+    def __init__(self, client, scheduler: RequestScheduler):
+        self.client = client
+        self.scheduler = scheduler
+
+    def __getattr__(self, name):
+        attr = getattr(self.client, name)
+        if name.endswith("_api"):
+            return ScheduledClient(attr, self.scheduler)
+        if callable(attr) and not isinstance(attr, type):
+            return functools.partial(
+                self.scheduler.call,
+                attr,
+                idempotent=is_idempotent(name),
+                transfer=is_transfer(name),
+            )
+        return attr
@@ -0,0 +1,40 @@
+from fileformats.generic import FileSet
+from arcana.common import Clinical
+from arcana.flywheel.testing import MockFlywheel
+
+
+def test_archive_download_fills_row(tmp_path):
+    site = MockFlywheel()
+    project_id = site.add_synthetic_project(
+        "archive",
+        num_subjects=1,
+        num_sessions=1,
+        num_acquisitions=3,
+        files_per_acquisition=20,
+        file_size=512,
+    )
+    acquisition_ids = site.project_containers[(project_id, "acquisition")]
+    # A file whose contents don't match the digest reported by the server
+    corrupt = site.containers[acquisition_ids[2]].files[0]
+    assert corrupt.hash
+    corrupt.contents = b"corrupt"
+    store = site.store(tmp_path, archive_downloads=True)
+    dataset = store.define_dataset(
+        "archive", space=Clinical, hierarchy=["subject", "session"]
+    )
+    dataset.add_source("scan", FileSet, path="scan00")
+    with dataset.tree:
+        row = next(iter(dataset.rows("session")))
+        fileset = row["scan"]
+        assert len(fileset.fspaths) == 20
+        entries = {e.path: e for e in row.entries}
+        # All the acquisitions of the row were filled by a single archive, apart from
+        # the one with the corrupt file, which is left to be downloaded file by file
+        assert site.calls["download_ticket"] == 1
+        assert "download_file" not in site.calls
+        assert store._is_cached(entries["scan01"])
+        assert not store._is_cached(entries["scan02"])
+        files = sorted(site.containers[acquisition_ids[0]].files, key=lambda f: f.name)
+        assert [p.read_bytes() for p in sorted(fileset.fspaths)] == [
+            f.read() for f in files
+        ]
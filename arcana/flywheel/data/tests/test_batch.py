@@ -0,0 +1,80 @@
+import json
+from arcana.common import Clinical
+from arcana.flywheel.data.batch import TERMINAL_STATES
+from arcana.flywheel.data.job import SNAPSHOT_KEY, TREE_INPUT
+from arcana.flywheel.deploy.gear import GearJob
+from arcana.flywheel.testing import MockFlywheel
+
+
+def test_batch_launch(tmp_path):
+    site = MockFlywheel()
+    project_id = site.add_synthetic_project(
+        "batch",
+        num_subjects=5,
+        num_sessions=4,
+        num_acquisitions=1,
+        files_per_acquisition=1,
+        file_size=64,
+    )
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    store = site.store(cache_dir)
+    dataset = store.define_dataset(
+        "batch", space=Clinical, hierarchy=["subject", "session"]
+    )
+    in_flight = []
+
+    def run_jobs(progress):
+        in_flight.append(
+            sum(j.state not in TERMINAL_STATES for j in site.jobs.values())
+        )
+        # The "workers" of the site finish a few jobs between each poll
+        site.run_jobs(1, state="failed" if len(in_flight) == 2 else "complete")
+        site.run_jobs(2)
+
+    progress = store.launch_batch(
+        "gear",
+        dataset.rows("session"),
+        config={"threshold": 0.5},
+        max_in_flight=4,
+        min_poll_interval=0.01,
+        max_poll_interval=0.04,
+        on_progress=run_jobs,
+    )
+    assert (progress.complete, progress.failed, progress.in_flight) == (19, 1, 0)
+    assert len(site.jobs) == 20
+    assert max(in_flight) == 4
+    # The states of all the jobs in flight are tracked by a single listing per poll
+    assert site.calls["get_all_jobs"] == len(in_flight)
+    assert sorted(j.destination.id for j in site.jobs.values()) == sorted(
+        site.project_containers[(project_id, "session")]
+    )
+    job = next(iter(site.jobs.values()))
+    assert job.config["threshold"] == 0.5
+    # The tree is uploaded to the project once for the whole batch and handed to each
+    # job as an input, so only the entries of its row are in the configuration of each
+    snapshot = json.loads(job.config[SNAPSHOT_KEY])
+    assert len(snapshot["rows"]) == 1
+    assert "leaves" not in snapshot
+    assert site.calls["upload_file_to_container"] == 1
+    tree_ref = job.inputs[TREE_INPUT]
+    assert tree_ref.id == project_id
+    assert all(j.inputs[TREE_INPUT] == tree_ref for j in site.jobs.values())
+    # The job reassembles the snapshot from its configuration and the staged tree
+    (tree_file,) = site.containers[project_id].files
+    assert tree_file.name == tree_ref.name
+    tree_path = tmp_path / tree_file.name
+    tree_path.write_bytes(tree_file.contents)
+    gear_job = GearJob(
+        base_dir=tmp_path,
+        config={
+            "config": job.config,
+            "inputs": {
+                TREE_INPUT: {"base": "file", "location": {"path": str(tree_path)}}
+            },
+        },
+    )
+    job_snapshot = gear_job.snapshot()
+    assert len(job_snapshot.tree.leaves) == 20
+    assert len(job_snapshot.rows) == 1
+    assert gear_job.staged_files() == []
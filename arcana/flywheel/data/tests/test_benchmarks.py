@@ -0,0 +1,185 @@
+"""Benchmarks of the store against a mock Flywheel site, which run at a "smoke" scale
+by default. Pass ``--benchmark-scale full`` (and optionally ``--benchmark-latency`` and
+``--benchmark-json``) to pytest to track the performance of the store at scale"""
+import json
+import time
+import logging
+import typing as ty
+from types import SimpleNamespace
+from pathlib import Path
+import attrs
+import pytest
+from fileformats.generic import FileSet
+from arcana.common import Clinical
+from arcana.flywheel.testing import MockFlywheel
+
+
+logger = logging.getLogger("arcana")
+
+
+# (subjects, sessions per subject, acquisitions per session) of the tree project, and
+# (files, bytes per file) of the entry used to measure transfers
+TREE_SCALES = {"smoke": (20, 5, 20), "full": (10000, 5, 20)}
+TRANSFER_SCALES = {"smoke": (8, 1024**2), "full": (32, 16 * 1024**2)}
+
+
+@pytest.fixture(scope="module")
+def benchmark_results(request):
+    results = {}
+    yield results
+    for name, result in results.items():
+        logger.info("Benchmark %s: %s", name, result)
+    json_path = request.config.getoption("--benchmark-json")
+    if json_path:
+        json_path = Path(json_path)
+        saved = json.loads(json_path.read_text()) if json_path.exists() else {}
+        saved.update(results)
+        json_path.write_text(json.dumps(saved, indent=2))
+
+
+@pytest.fixture(scope="module")
+def benchmark_scale(request):
+    return request.config.getoption("--benchmark-scale")
+
+
+@pytest.fixture(scope="module")
+def benchmark_site(request, benchmark_scale):
+    num_subjects, num_sessions, num_acquisitions = TREE_SCALES[benchmark_scale]
+    num_files, file_size = TRANSFER_SCALES[benchmark_scale]
+    site = MockFlywheel(latency=request.config.getoption("--benchmark-latency"))
+    site.add_synthetic_project(
+        "tree",
+        num_subjects=num_subjects,
+        num_sessions=num_sessions,
+        num_acquisitions=num_acquisitions,
+    )
+    site.add_synthetic_project(
+        "transfer",
+        num_subjects=1,
+        num_sessions=1,
+        num_acquisitions=1,
+        files_per_acquisition=num_files,
+        file_size=file_size,
+    )
+    return site
+
+
+@attrs.define
+class BenchmarkTree:
+    """Records the leaves added to it by the store, standing in for the data tree of
+    a dataset, whose construction would otherwise dominate the benchmarks at scale"""
+
+    dataset_id: str
+    leaves: ty.List[ty.Tuple[str, ...]] = attrs.field(factory=list)
+
+    def add_leaf(self, path, metadata=None):
+        self.leaves.append(tuple(path))
+
+
+@attrs.define
+class BenchmarkRow:
+    """Counts the entries added to it by the store, standing in for a session row"""
+
+    dataset: ty.Any
+    ids: ty.Dict[str, str]
+    frequency: Clinical = Clinical.session
+    num_entries: int = 0
+
+    def frequency_id(self, frequency: str) -> str:
+        return self.ids[frequency]
+
+    def add_entry(self, **kwargs):
+        self.num_entries += 1
+
+
+def test_populate_tree_benchmark(
+    benchmark_site, benchmark_scale, benchmark_results, tmp_path
+):
+    num_subjects, num_sessions, _ = TREE_SCALES[benchmark_scale]
+    store = benchmark_site.store(tmp_path)
+    timings = []
+    for _ in range(2):  # initial scan followed by a refresh of the tree snapshot
+        tree = BenchmarkTree(dataset_id="tree")
+        start = time.monotonic()
+        store.populate_tree(tree)
+        timings.append(time.monotonic() - start)
+        assert len(tree.leaves) == num_subjects * num_sessions
+    benchmark_results["populate_tree"] = {
+        "leaves": len(tree.leaves),
+        "scan_seconds": timings[0],
+        "refresh_seconds": timings[1],
+        "requests": store.metrics.snapshot()["sdk"],
+    }
+
+
+def test_populate_row_benchmark(
+    benchmark_site, benchmark_scale, benchmark_results, tmp_path
+):
+    num_subjects, num_sessions, num_acquisitions = TREE_SCALES[benchmark_scale]
+    store = benchmark_site.store(tmp_path)
+    tree = BenchmarkTree(dataset_id="tree")
+    store.populate_tree(tree)
+    dataset = SimpleNamespace(id="tree")
+    rows = [
+        BenchmarkRow(dataset=dataset, ids={"subject": subj, "session": sess})
+        for subj, sess in tree.leaves
+    ]
+    store.metrics.reset()
+    start = time.monotonic()
+    for row in rows:
+        store.populate_row(row)
+    elapsed = time.monotonic() - start
+    assert sum(r.num_entries for r in rows) == (
+        num_subjects * num_sessions * num_acquisitions
+    )
+    requests = store.metrics.snapshot()["sdk"]
+    # The entries of all rows are indexed in a handful of paged listings
+    assert sum(r["count"] for r in requests.values()) < len(rows)
+    benchmark_results["populate_row"] = {
+        "rows": len(rows),
+        "seconds": elapsed,
+        "rows_per_second": len(rows) / elapsed,
+        "requests": requests,
+    }
+
+
+def test_transfer_benchmark(
+    benchmark_site, benchmark_scale, benchmark_results, tmp_path
+):
+    num_files, file_size = TRANSFER_SCALES[benchmark_scale]
+    num_bytes = num_files * file_size
+    store = benchmark_site.store(tmp_path)
+    dataset = store.define_dataset(
+        "transfer", space=Clinical, hierarchy=["subject", "session"]
+    )
+    with dataset.tree:
+        row = next(iter(dataset.rows("session")))
+        entry = next(iter(row.entries))
+        download_dir = tmp_path / "download"
+        download_dir.mkdir()
+        start = time.monotonic()
+        files_dir = store.download_files(entry, download_dir)
+        download_seconds = time.monotonic() - start
+        assert len(list(files_dir.iterdir())) == num_files
+
+        start = time.monotonic()
+        remote_checksums = store.get_checksums_batch([entry.uri])[entry.uri]
+        local_checksums = store.calculate_checksums(FileSet(files_dir.iterdir()))
+        checksum_seconds = time.monotonic() - start
+        assert local_checksums == remote_checksums
+
+        with store.connection:
+            upload_entry = store.create_fileset_entry("uploaded@", FileSet, row)
+        start = time.monotonic()
+        store.upload_files(files_dir, upload_entry)
+        upload_seconds = time.monotonic() - start
+    analysis_id = upload_entry.uri.split("/")[-1]
+    uploaded = benchmark_site.containers[analysis_id].files
+    assert sum(f.size for f in uploaded) == num_bytes
+    benchmark_results["transfer"] = {
+        "files": num_files,
+        "bytes": num_bytes,
+        "download_mb_per_second": num_bytes / download_seconds / 1e6,
+        "upload_mb_per_second": num_bytes / upload_seconds / 1e6,
+        "checksum_seconds": checksum_seconds,
+    }
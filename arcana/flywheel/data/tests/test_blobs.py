@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+import pytest
+from arcana.core.exceptions import ArcanaError
+from arcana.flywheel.testing import MockFlywheel, MockFile
+
+
+def add_project(site, label, contents):
+    project_id = site.add_synthetic_project(
+        label, num_subjects=1, num_sessions=1, num_acquisitions=1
+    )
+    (acquisition_id,) = site.project_containers[(project_id, "acquisition")]
+    site.containers[acquisition_id].files = [
+        MockFile(name=name, size=len(data), contents=data)
+        for name, data in contents.items()
+    ]
+    return SimpleNamespace(uri=f"/projects/{project_id}/acquisitions/{acquisition_id}")
+
+
+def test_downloads_deduplicated_across_projects(tmp_path):
+    site = MockFlywheel()
+    contents = {"ref.nii": b"reference" * 1000, "sub/mask.nii": b"mask" * 1000}
+    entries = [add_project(site, label, contents) for label in ("orig", "reimported")]
+    store = site.store(tmp_path)
+    downloaded = []
+    for i, entry in enumerate(entries):
+        download_dir = tmp_path / f"download{i}"
+        download_dir.mkdir()
+        downloaded.append(store.download_files(entry, download_dir))
+    assert site.calls["download_file"] == len(contents)
+    for files_dir in downloaded:
+        for name, data in contents.items():
+            assert (files_dir / name).read_bytes() == data
+    blobs = [p for p in (tmp_path / store.BLOB_STORE_DIR).rglob("*") if p.is_file()]
+    assert len(blobs) == len(contents)
+
+
+def test_corrupt_download_rejected(tmp_path):
+    site = MockFlywheel()
+    entry = add_project(site, "corrupt", {"file.txt": b"original"})
+    acquisition_id = entry.uri.split("/")[-1]
+    mock_file = site.containers[acquisition_id].files[0]
+    assert mock_file.hash  # digest reported by the server before the file is modified
+    mock_file.contents = b"modified"
+    store = site.store(tmp_path)
+    download_dir = tmp_path / "download"
+    download_dir.mkdir()
+    with pytest.raises(ArcanaError, match="don't match the digest"):
+        store.download_files(entry, download_dir)
+    assert not [p for p in (tmp_path / store.BLOB_STORE_DIR).rglob("*") if p.is_file()]
@@ -0,0 +1,60 @@
+from types import SimpleNamespace
+import pytest
+import requests
+from arcana.common import Clinical
+from arcana.flywheel.data.api import Flywheel
+from arcana.flywheel.data.pool import ClientPool
+
+
+class FakeClient:
+    def __init__(self, fail_on=None):
+        self.api_client = SimpleNamespace(
+            rest_client=SimpleNamespace(session=requests.Session())
+        )
+        self.updates = []
+        self.fail_on = fail_on
+
+    def modify_container_info(self, container_id, body):
+        if container_id == self.fail_on:
+            raise RuntimeError("Server error")
+        self.updates.append((container_id, body))
+
+
+def field_entry(session_id, path):
+    row = SimpleNamespace(
+        dataset=SimpleNamespace(id="dataset"),
+        frequency=Clinical.session,
+        frequency_id=lambda f: {"subject": "SUBJ01", "session": session_id}[f],
+    )
+    return SimpleNamespace(uri=f"/projects/p/sessions/{session_id}", path=path, row=row)
+
+
+def test_field_writes_coalesced_per_container(tmp_path):
+    client = FakeClient()
+    store = Flywheel(server="dummy", cache_dir=tmp_path)
+    store._client_pool = ClientPool(factory=lambda: client)
+    with store.connection:
+        for session_id in ("s1", "s2"):
+            for i in range(3):
+                store.upload_value(i, field_entry(session_id, f"metric{i}"))
+        # Unflushed values can be read back
+        assert store.download_value(field_entry("s2", "metric1")) == 1
+        assert not client.updates
+    assert client.updates == [
+        ("s1", {"set": {"metric0": 0, "metric1": 1, "metric2": 2}}),
+        ("s2", {"set": {"metric0": 0, "metric1": 1, "metric2": 2}}),
+    ]
+
+
+def test_failed_flush_is_retried(tmp_path):
+    client = FakeClient(fail_on="s2")
+    store = Flywheel(server="dummy", cache_dir=tmp_path)
+    store._client_pool = ClientPool(factory=lambda: client)
+    with pytest.raises(RuntimeError):
+        with store.connection:
+            store.upload_value("a", field_entry("s1", "qc"))
+            store.upload_value("b", field_entry("s2", "qc"))
+    assert client.updates == [("s1", {"set": {"qc": "a"}})]
+    client.fail_on = None
+    store.flush_writes()
+    assert client.updates[-1] == ("s2", {"set": {"qc": "b"}})
@@ -0,0 +1,89 @@
+import os
+import json
+import time
+import fcntl
+import subprocess
+import sys
+from fileformats.generic import FileSet
+from arcana.common import Clinical
+from arcana.flywheel.data.cache import CacheManager
+from arcana.flywheel.testing import MockFlywheel
+
+
+def add_entry(cache_dir, name, size, accessed, blob_dir=None):
+    entry = cache_dir / "acquisitions" / name
+    entry.mkdir(parents=True)
+    (entry / "file.dat").write_bytes(os.urandom(size))
+    if blob_dir is not None:
+        blob_dir.mkdir(parents=True, exist_ok=True)
+        os.link(entry / "file.dat", blob_dir / name)
+        os.utime(blob_dir / name, (accessed, accessed))
+    (cache_dir / "acquisitions" / (name + ".md5.json")).write_text("{}")
+    os.utime(entry, (accessed, accessed))
+    return entry
+
+
+def test_lru_eviction(tmp_path):
+    now = time.time()
+    blob_dir = tmp_path / "__blobs__" / "sha384" / "00"
+    entries = [
+        add_entry(tmp_path, f"entry{i}", 1000, now - 1000 + i, blob_dir=blob_dir)
+        for i in range(5)
+    ]
+    manager = CacheManager(tmp_path, max_bytes=2500, blob_dir="__blobs__")
+    assert manager.usage() == 5000  # hard-linked blobs aren't counted twice
+    # Recently accessed entries are moved to the back of the queue
+    manager.touch(entries[0])
+    manager.pin(entries[1])
+    assert manager.evict() == 3000
+    assert [e.exists() for e in entries] == [True, True, False, False, False]
+    assert not (tmp_path / "acquisitions" / "entry2.md5.json").exists()
+    assert sorted(p.name for p in blob_dir.iterdir()) == ["entry0", "entry1"]
+    assert manager.usage() == 2000
+
+
+def test_stale_pins_and_concurrent_eviction(tmp_path):
+    entry = add_entry(tmp_path, "entry", 1000, time.time() - 1000)
+    manager = CacheManager(tmp_path, max_bytes=0)
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    pin = manager.pin(entry)
+    pin.write_text(json.dumps({**json.loads(pin.read_text()), "pid": dead.pid}))
+    # Another process holding the lock is already evicting
+    with open(tmp_path / CacheManager.LOCK_FILE, "a") as f:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        assert manager.evict() == 0
+    assert manager.evict() == 1000
+    assert not entry.exists()
+    assert not pin.exists()
+
+
+def test_pins_released_after_use(tmp_path):
+    site = MockFlywheel()
+    site.add_synthetic_project(
+        "pins",
+        num_subjects=1,
+        num_sessions=8,
+        num_acquisitions=1,
+        files_per_acquisition=1,
+        file_size=1000,
+    )
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    store = site.store(cache_dir, cache_max_bytes=2500)
+    store.cache_manager.grace_period = 0.0
+    dataset = store.define_dataset(
+        "pins", space=Clinical, hierarchy=["subject", "session"]
+    )
+    dataset.add_source("scan", FileSet, path="scan00")
+    with store.connection:
+        filesets = [row["scan"] for row in dataset.rows("session")]
+        # The entries in use are protected from eviction even though they exceed the
+        # budget of the cache
+        assert all(p.exists() for f in filesets for p in f.fspaths)
+        assert len(store._cache_pins) == 8
+        assert store.cache_manager.evict() == 0
+    # Once the process has finished using them they can be evicted again
+    assert not store._cache_pins
+    assert store.cache_manager.evict() > 0
+    assert store.cache_manager.usage() <= 2500
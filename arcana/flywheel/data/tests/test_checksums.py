@@ -0,0 +1,55 @@
+import hashlib
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from arcana.flywheel.data import checksums
+from arcana.flywheel.data.checksums import (
+    calculate_digests,
+    DigestCache,
+    ContainerDigests,
+)
+
+
+def test_calculate_digests_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(checksums, "MMAP_THRESHOLD", 4)
+    monkeypatch.setattr(checksums, "PARALLEL_THRESHOLD", 0)
+    files = {}
+    for i, contents in enumerate([b"abc", b"defghijk"]):
+        files[f"dir/file{i}.txt"] = fspath = tmp_path / f"file{i}.txt"
+        fspath.write_bytes(contents)
+    sidecar = tmp_path / ("cached" + DigestCache.SUFFIX)
+    digests = calculate_digests(files, "sha384", sidecar=sidecar, max_workers=2)
+    assert digests == {
+        "dir/file0.txt": "v0-sha384-" + hashlib.sha384(b"abc").hexdigest(),
+        "dir/file1.txt": "v0-sha384-" + hashlib.sha384(b"defghijk").hexdigest(),
+    }
+    hashed = []
+    monkeypatch.setattr(
+        checksums, "hash_file", lambda p, a: hashed.append(p) or "modified"
+    )
+    files["dir/file1.txt"].write_bytes(b"xyz")
+    rehashed = calculate_digests(files, "sha384", sidecar=sidecar, max_workers=1)
+    assert hashed == [files["dir/file1.txt"]]
+    assert rehashed["dir/file0.txt"] == digests["dir/file0.txt"]
+
+
+def test_container_digests_keyed_by_modified(tmp_path):
+    def container(modified, digest):
+        return SimpleNamespace(
+            id="acq1",
+            modified=datetime.fromisoformat(modified),
+            files=[SimpleNamespace(name="image.nii.gz", hash=digest)],
+        )
+
+    path = tmp_path / "project.json"
+    digests = ContainerDigests(project_id="p")
+    digests.update(container("2022-01-01T00:00:00+00:00", "v0-sha384-1"))
+    digests.listed["acquisitions"] = datetime(2022, 1, 2, tzinfo=timezone.utc)
+    digests.save(path)
+    reloaded = ContainerDigests.load(path, "p")
+    assert reloaded == digests
+    assert reloaded.lookup("acq1") == {"image.nii.gz": "v0-sha384-1"}
+    assert reloaded.lookup("acq1", datetime(2022, 1, 3, tzinfo=timezone.utc)) is None
+    assert reloaded.update(container("2022-01-03T00:00:00+00:00", "v0-sha384-2")) == {
+        "image.nii.gz": "v0-sha384-2"
+    }
+    assert not ContainerDigests.load(path, "another").containers
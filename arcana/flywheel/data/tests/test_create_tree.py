@@ -0,0 +1,78 @@
+import threading
+from types import SimpleNamespace
+import requests
+import flywheel
+from arcana.common import Clinical
+from arcana.flywheel.data.api import Flywheel
+from arcana.flywheel.data.pool import ClientPool
+
+
+class FakeClient:
+    def __init__(self):
+        self.api_client = SimpleNamespace(
+            rest_client=SimpleNamespace(session=requests.Session())
+        )
+        self.projects = {}
+        self.subjects = []
+        self.sessions = []
+        self.num_added = 0
+        self.lock = threading.Lock()
+
+    def lookup(self, path):
+        try:
+            return SimpleNamespace(id=self.projects[path])
+        except KeyError:
+            raise flywheel.ApiException(status=404, reason="Not found")
+
+    def add_project(self, body):
+        self.projects[f"{body['group']}/{body['label']}"] = "proj"
+        return "proj"
+
+    def add_subject(self, body):
+        with self.lock:
+            self.num_added += 1
+            subject = SimpleNamespace(id=f"subj{len(self.subjects)}", **body)
+            self.subjects.append(subject)
+            return subject.id
+
+    def add_session(self, body):
+        with self.lock:
+            self.num_added += 1
+            self.sessions.append(
+                SimpleNamespace(
+                    id=f"sess{len(self.sessions)}",
+                    label=body["label"],
+                    parents=SimpleNamespace(subject=body["subject"]["_id"]),
+                )
+            )
+
+    def get_project_subjects(self, project_id, limit, after_id=None):
+        return self._page(self.subjects, limit, after_id)
+
+    def get_project_sessions(self, project_id, limit, after_id=None):
+        return self._page(self.sessions, limit, after_id)
+
+    def _page(self, containers, limit, after_id):
+        start = 0
+        if after_id is not None:
+            start = [c.id for c in containers].index(after_id) + 1
+        return containers[start : start + limit]
+
+
+def test_create_data_tree_idempotent(tmp_path):
+    client = FakeClient()
+    store = Flywheel(server="dummy", cache_dir=tmp_path, page_size=7)
+    store._client_pool = ClientPool(factory=lambda: client)
+    leaves = [(f"SUBJ{i:02}", f"SESS{j:02}") for i in range(10) for j in range(3)]
+    store.create_data_tree(
+        "dataset", leaves[:12], space=Clinical, hierarchy=["subject", "session"]
+    )
+    assert client.num_added == 4 + 12
+    store.create_data_tree(
+        "dataset", leaves, space=Clinical, hierarchy=["subject", "session"]
+    )
+    assert client.num_added == 10 + 30
+    store.create_data_tree(
+        "dataset", leaves, space=Clinical, hierarchy=["subject", "session"]
+    )
+    assert client.num_added == 10 + 30
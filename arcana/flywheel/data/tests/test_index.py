@@ -0,0 +1,61 @@
+from fileformats.core import Field
+from arcana.common import Clinical
+from arcana.flywheel.data import index as index_module
+from arcana.flywheel.data.index import EntryIndex, IndexedEntry, release_row_entries
+from arcana.flywheel.testing import MockFlywheel
+
+
+def test_paged_index_and_idle_rows_released(tmp_path):
+    site = MockFlywheel()
+    site.add_synthetic_project(
+        "paged", num_subjects=2, num_sessions=3, num_acquisitions=2
+    )
+    store = site.store(tmp_path, index_page_size=2, max_resident_rows=2)
+    dataset = store.define_dataset(
+        "paged", space=Clinical, hierarchy=["subject", "session"]
+    )
+    with dataset.tree:
+        rows = list(dataset.rows("session"))
+        for row in rows:
+            assert sorted(e.path for e in row.entries) == ["scan00", "scan01"]
+        # The entries of each page of sessions were listed when it was first needed
+        assert site.calls["get_project_acquisitions"] == 3
+        # Only the most recently used rows hold on to their entries
+        assert [r._entries_dict is not None for r in rows] == [False] * 4 + [True] * 2
+        # Released rows are repopulated (from a reloaded page) when accessed again
+        assert len(list(rows[0].entries)) == 2
+        assert site.calls["get_project_acquisitions"] == 4
+
+
+def test_field_value_lookup_doesnt_add_rows():
+    index = EntryIndex(project_id="project")
+    index.add(("SUBJ01",), IndexedEntry(path="age", datatype=Field, value=30))
+    assert index.field_value(("SUBJ01",), "age") == (True, 30)
+    assert index.field_value(("SUBJ01",), "weight") == (False, None)
+    assert index.field_value(("SUBJ02",), "age") == (False, None)
+    assert list(index.entries) == [("SUBJ01",)]
+
+
+def test_release_row_entries_guarded_by_arcana_version(tmp_path, monkeypatch):
+    site = MockFlywheel()
+    site.add_synthetic_project(
+        "release", num_subjects=1, num_sessions=2, num_acquisitions=2
+    )
+    store = site.store(tmp_path)
+    dataset = store.define_dataset(
+        "release", space=Clinical, hierarchy=["subject", "session"]
+    )
+    first, second = dataset.rows("session")
+    # The shim resets the private attributes of rows with the version of arcana
+    # installed for the tests
+    assert index_module.arcana_version() in index_module.ROW_RELEASE_ARCANA_VERSIONS
+    assert len(list(first.entries)) == 2
+    assert not release_row_entries(first, expected=3)
+    assert release_row_entries(first, expected=2)
+    assert first._entries_dict is None
+    assert len(list(first.entries)) == 2
+    # Rows aren't released with versions of arcana it hasn't been checked against
+    monkeypatch.setattr(index_module, "ROW_RELEASE_ARCANA_VERSIONS", frozenset())
+    assert len(list(second.entries)) == 2
+    assert not release_row_entries(second)
+    assert second._entries_dict is not None
@@ -0,0 +1,79 @@
+import json
+import pickle
+from fileformats.generic import FileSet
+from arcana.common import Clinical
+from arcana.flywheel.data.job import JobSnapshot, SNAPSHOT_KEY
+from arcana.flywheel.deploy.gear import GearJob
+from arcana.flywheel.testing import MockFlywheel
+
+
+def test_job_snapshot_handoff(tmp_path):
+    site = MockFlywheel()
+    project_id = site.add_synthetic_project(
+        "job",
+        num_subjects=3,
+        num_sessions=2,
+        num_acquisitions=2,
+        files_per_acquisition=1,
+        file_size=64,
+    )
+    launcher_cache, job_cache = tmp_path / "launcher", tmp_path / "job"
+    launcher_cache.mkdir()
+    job_cache.mkdir()
+    launcher = site.store(launcher_cache)
+    dataset = launcher.define_dataset(
+        "job", space=Clinical, hierarchy=["subject", "session"]
+    )
+    rows = list(dataset.rows("session"))[:2]
+    snapshot = launcher.job_snapshot(dataset.id, rows)
+    # An acquisition of the second row is modified after the snapshot is taken
+    acquisition_id = site.project_containers[(project_id, "acquisition")][2]
+    site.containers[acquisition_id].touch()
+    site.calls.clear()
+    job = site.store(job_cache)
+    stale = job.install_job_snapshot(
+        JobSnapshot.fromdict(json.loads(json.dumps(snapshot.asdict())))
+    )
+    assert stale == {("SUBJ00000", "SUBJ00000_MR01")}
+    # The installed snapshot is carried over to the copies of the store passed to
+    # workers
+    job = site.connect(pickle.loads(pickle.dumps(job)))
+    dataset = job.define_dataset("job", space=Clinical, hierarchy=["subject", "session"])
+    dataset.add_source("scan", FileSet, path="scan00")
+    first, second = list(dataset.rows("session"))[:2]
+    assert sorted(e.path for e in first.entries) == ["scan00", "scan01"]
+    # The tree and the up-to-date row are populated from the snapshot, after only
+    # checking for containers modified since it was taken
+    assert "read_view_data" not in site.calls
+    assert site.calls["get_project_acquisitions"] == 1
+    assert sorted(e.path for e in second.entries) == ["scan00", "scan01"]
+    assert site.calls["get_project_acquisitions"] == 2
+    # The rows of the snapshot aren't consumed by populating them
+    dataset = job.define_dataset("job", space=Clinical, hierarchy=["subject", "session"])
+    first = next(iter(dataset.rows("session")))
+    assert sorted(e.path for e in first.entries) == ["scan00", "scan01"]
+    assert site.calls["get_project_acquisitions"] == 2
+
+
+def test_launched_job_handed_snapshot(tmp_path):
+    site = MockFlywheel()
+    site.add_synthetic_project(
+        "launch", num_subjects=2, num_sessions=2, num_acquisitions=2
+    )
+    store = site.store(tmp_path)
+    dataset = store.define_dataset(
+        "launch", space=Clinical, hierarchy=["subject", "session"]
+    )
+    row = next(iter(dataset.rows("session")))
+    store.launch_job("gear", row, config={"threshold": 0.5})
+    (job,) = site.jobs.values()
+    assert job.config["threshold"] == 0.5
+    # The job reads the snapshot the launcher serialized into its configuration
+    snapshot = GearJob(base_dir=tmp_path, config={"config": job.config}).snapshot()
+    assert len(snapshot.tree.leaves) == 4
+    (key,) = snapshot.rows
+    assert key == (row.frequency_id("subject"), row.frequency_id("session"))
+    assert sorted(e.path for e in snapshot.rows[key]) == ["scan00", "scan01"]
+    # Snapshots can be left out of the configuration
+    store.launch_job("gear", row, snapshot=False)
+    assert sum(SNAPSHOT_KEY in j.config for j in site.jobs.values()) == 1
@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import subprocess
+import pytest
+import flywheel
+from arcana.flywheel.data.metrics import Metrics
+from arcana.flywheel.data.scheduler import RequestScheduler, ScheduledClient
+
+
+class Server:
+    def get_thing(self, arg):
+        return arg
+
+    def add_thing(self, arg):
+        raise flywheel.ApiException(status=400, reason="Bad request")
+
+
+def test_sdk_calls_recorded():
+    metrics = Metrics()
+    client = ScheduledClient(Server(), RequestScheduler(metrics=metrics))
+    for _ in range(3):
+        client.get_thing("x")
+    with pytest.raises(flywheel.ApiException):
+        client.add_thing("x")
+    snapshot = metrics.snapshot()["sdk"]
+    assert snapshot["get_thing"]["count"] == 3
+    assert snapshot["get_thing"]["errors"] == 0
+    assert sum(snapshot["get_thing"]["latency_buckets"]) == 3
+    assert snapshot["add_thing"]["errors"] == 1
+
+
+def test_dump(tmp_path):
+    metrics = Metrics()
+    with metrics.timer("store", "download_files"):
+        pass
+    metrics.add_bytes("store", "download_files", 1024)
+    metrics.dump(tmp_path / "metrics.json")
+    dumped = json.loads((tmp_path / "metrics.json").read_text())
+    assert dumped["operations"]["store"]["download_files"]["bytes"] == 1024
+    metrics.dump(tmp_path / "metrics.prom")
+    text = (tmp_path / "metrics.prom").read_text()
+    labels = 'kind="store",operation="download_files"'
+    assert f"arcana_flywheel_bytes_total{{{labels}}} 1024" in text
+    assert f'arcana_flywheel_duration_seconds_bucket{{{labels},le="+Inf"}} 1' in text
+    metrics.reset()
+    assert metrics.snapshot() == {}
+
+
+def test_dump_at_exit(tmp_path):
+    path = tmp_path / "metrics.json"
+    script = f"""
+from arcana.flywheel.data import metrics
+kept = metrics.Metrics(dump_path={str(path)!r})
+kept.record("store", "get", 0.01)
+for _ in range(100):
+    metrics.Metrics(dump_path={str(path)!r}).record("store", "get", 0.01)
+# Registries that have been garbage-collected aren't held on to
+assert len(metrics._exit_registries) == 1
+"""
+    workers = [subprocess.Popen([sys.executable, "-c", script]) for _ in range(2)]
+    assert all(w.wait() == 0 for w in workers)
+    # Each process dumps its metrics to its own file, in which the metrics of all its
+    # stores are merged
+    for worker in workers:
+        dumped = json.loads((tmp_path / f"metrics.{worker.pid}.json").read_text())
+        assert dumped["operations"]["store"]["get"]["count"] == 101
+    assert not path.exists()
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_forked_child_doesnt_dump_parent_metrics(tmp_path):
+    path = tmp_path / "metrics.json"
+    script = f"""
+import os
+import sys
+from arcana.flywheel.data.metrics import Metrics
+parent = Metrics(dump_path={str(path)!r})
+parent.record("store", "get", 0.01)
+pid = os.fork()
+if pid == 0:
+    Metrics(dump_path={str(path)!r}).record("store", "put", 0.01)
+    sys.exit(0)
+_, status = os.waitpid(pid, 0)
+print(pid)
+sys.exit(os.waitstatus_to_exitcode(status))
+"""
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+    child_pid = int(result.stdout)
+    dumped = {
+        f.name: json.loads(f.read_text())["operations"]["store"]
+        for f in tmp_path.iterdir()
+    }
+    # The child only dumps the metrics recorded after it was forked
+    assert list(dumped.pop(f"metrics.{child_pid}.json")) == ["put"]
+    (parent,) = dumped.values()
+    assert list(parent) == ["get"]
@@ -0,0 +1,58 @@
+import inspect
+import pytest
+import flywheel
+from flywheel.flywheel import Flywheel as FlywheelApi
+from arcana.flywheel.testing import (
+    MockClient,
+    MockAnalysesApi,
+    MockContainersApi,
+    MockFilesApi,
+    MockJobsApi,
+)
+
+
+# The mock stands in for the SDK client rather than the REST API, so the methods it
+# implements are checked against those of the SDK it replaces
+MOCKED_APIS = [
+    (MockClient, [flywheel.Client, FlywheelApi]),
+    (MockAnalysesApi, [flywheel.AnalysesApi]),
+    (MockContainersApi, [flywheel.ContainersApi]),
+    (MockFilesApi, [flywheel.FilesApi]),
+    (MockJobsApi, [flywheel.JobsApi]),
+]
+
+
+def positional_params(method) -> list:
+    return [
+        p
+        for p in list(inspect.signature(method).parameters.values())[1:]
+        if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD)
+    ]
+
+
+@pytest.mark.parametrize(
+    "mock_cls,sdk_classes", MOCKED_APIS, ids=[m.__name__ for m, _ in MOCKED_APIS]
+)
+def test_mock_matches_sdk(mock_cls, sdk_classes):
+    for name, mock_method in inspect.getmembers(mock_cls, inspect.isfunction):
+        if name.startswith("_"):
+            continue
+        sdk_method = next(
+            (getattr(c, name) for c in sdk_classes if hasattr(c, name)), None
+        )
+        assert sdk_method is not None, f"{name} isn't a method of the Flywheel SDK"
+        sdk_params = positional_params(sdk_method)
+        mock_params = positional_params(mock_method)
+        # The arguments the SDK requires are passed positionally by the store
+        required = [p for p in sdk_params if p.default is p.empty]
+        assert len(mock_params) >= len(required), name
+        assert all(p.default is not p.empty for p in mock_params[len(required):]), name
+        # Optional arguments of the mock must be accepted as keywords by the SDK
+        sdk_accepts_kwargs = any(
+            p.kind == p.VAR_KEYWORD
+            for p in inspect.signature(sdk_method).parameters.values()
+        )
+        for param in mock_params[len(required):]:
+            assert sdk_accepts_kwargs or param.name in (
+                p.name for p in sdk_params
+            ), f"{name} doesn't accept '{param.name}'"
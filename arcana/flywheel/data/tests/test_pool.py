@@ -0,0 +1,45 @@
+import pickle
+from types import SimpleNamespace
+import pytest
+import requests
+from arcana.flywheel.data.api import Flywheel
+from arcana.flywheel.data.pool import ClientPool
+
+
+def fake_client():
+    session = requests.Session()
+    return SimpleNamespace(
+        api_client=SimpleNamespace(rest_client=SimpleNamespace(session=session)),
+        shutdown=lambda: None,
+    )
+
+
+def test_client_pool_reuses_clients():
+    created = []
+    pool = ClientPool(
+        factory=lambda: created.append(fake_client()) or created[-1],
+        max_clients=2,
+        http_pool_size=16,
+    )
+    client = pool.acquire()
+    assert client.api_client.rest_client.session.get_adapter(
+        "https://"
+    )._pool_maxsize == 16
+    pool.release(client)
+    assert pool.acquire() is client
+    other = pool.acquire()
+    assert other is not client
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.01)
+    pool.release(other)
+    assert pool.acquire(timeout=0.01) is other
+    assert len(created) == 2
+
+
+def test_store_pickles_without_internal_state(tmp_path):
+    store = Flywheel(server="dummy", cache_dir=tmp_path, max_connections=3)
+    unpickled = pickle.loads(pickle.dumps(store))
+    assert unpickled == store
+    assert unpickled._client_pool is not store._client_pool
+    assert unpickled._client_pool.max_clients == 3
+    assert unpickled.connection.store is unpickled
@@ -0,0 +1,68 @@
+import time
+from fileformats.generic import FileSet
+from arcana.common import Clinical
+from arcana.flywheel.testing import MockFlywheel
+
+
+def test_prefetch_overlaps_downloads(tmp_path):
+    site = MockFlywheel(latency=0.01)
+    site.add_synthetic_project(
+        "prefetch",
+        num_subjects=1,
+        num_sessions=6,
+        num_acquisitions=1,
+        files_per_acquisition=2,
+        file_size=1024,
+    )
+    store = site.store(tmp_path)
+    dataset = store.define_dataset(
+        "prefetch", space=Clinical, hierarchy=["subject", "session"]
+    )
+    dataset.add_source("scan", FileSet, path="scan00")
+    with dataset.tree:
+        rows = list(dataset.rows("session"))
+        with store.prefetch(rows, depth=2) as prefetcher:
+            for i, row in enumerate(prefetcher):
+                time.sleep(0.3)  # the "processing" of the row
+                if i == 0:
+                    # Only the rows within the prefetch depth of the current row have
+                    # been downloaded (the first row may be fetched by either thread)
+                    assert 4 <= site.calls["download_file"] <= 6
+                downloads = site.calls["download_file"]
+                fileset = row["scan"]
+                assert sorted(p.name for p in fileset.fspaths) == [
+                    "scan00_0.dat",
+                    "scan00_1.dat",
+                ]
+                if i > 0:
+                    # The file-sets of the row were prefetched
+                    assert site.calls["download_file"] == downloads
+    assert site.calls["download_file"] == 12
+    assert store.metrics.snapshot()["store"]["prefetch"]["count"] >= 5
+
+
+def test_prefetch_resolves_rows_as_it_advances(tmp_path):
+    site = MockFlywheel()
+    site.add_synthetic_project(
+        "lazy",
+        num_subjects=1,
+        num_sessions=6,
+        num_acquisitions=1,
+        files_per_acquisition=1,
+        file_size=64,
+    )
+    store = site.store(tmp_path, index_page_size=2)
+    dataset = store.define_dataset(
+        "lazy", space=Clinical, hierarchy=["subject", "session"]
+    )
+    dataset.add_source("scan", FileSet, path="scan00")
+    with dataset.tree:
+        rows = list(dataset.rows("session"))
+        with store.prefetch(rows, depth=1) as prefetcher:
+            # Only the page of the index holding the rows within the prefetch depth
+            # of the first row has been loaded
+            assert site.calls["get_project_acquisitions"] == 1
+            for row in prefetcher:
+                assert row["scan"].fspaths
+        assert site.calls["get_project_acquisitions"] == 3
+    assert site.calls["download_file"] == 6
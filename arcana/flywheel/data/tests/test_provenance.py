@@ -0,0 +1,63 @@
+import json
+from types import SimpleNamespace
+import requests
+from arcana.common import Clinical
+from arcana.flywheel.data.api import Flywheel
+from arcana.flywheel.data.pool import ClientPool
+from arcana.flywheel.data.resolver import ContainerResolver
+from arcana.flywheel.data.provenance import (
+    PROVENANCE_INFO_KEY,
+    encode_provenance,
+    decode_provenance,
+)
+
+
+class FakeClient:
+    def __init__(self):
+        self.api_client = SimpleNamespace(
+            rest_client=SimpleNamespace(session=requests.Session())
+        )
+        self.info = {"s1": {}}
+        self.calls = []
+
+    def get(self, container_id):
+        self.calls.append("get")
+        return SimpleNamespace(info=self.info[container_id])
+
+    def modify_container_info(self, container_id, body):
+        self.calls.append("modify")
+        self.info[container_id].update(body["set"])
+
+
+def test_provenance_blob_roundtrip():
+    node = {"pipeline": "qc", "inputs": {"t1w": "v0-sha384-abc"}}
+    provenance = {f"out{i}@qc": node for i in range(100)}
+    provenance["other@another"] = {"pipeline": "another"}
+    blob = encode_provenance(provenance)
+    assert decode_provenance(blob) == provenance
+    assert len(blob) < len(json.dumps(provenance)) / 10
+    assert decode_provenance(None) == {}
+
+
+def test_provenance_batched_per_container(tmp_path):
+    client = FakeClient()
+    store = Flywheel(server="dummy", cache_dir=tmp_path)
+    store._client_pool = ClientPool(factory=lambda: client)
+    store._resolvers["dataset"] = ContainerResolver(
+        project_id="p", container_ids={("SUBJ01", "s1"): "s1"}
+    )
+    row = SimpleNamespace(
+        dataset=SimpleNamespace(id="dataset"),
+        frequency=Clinical.session,
+        frequency_id=lambda f: {"subject": "SUBJ01", "session": "s1"}[f],
+    )
+    entries = [SimpleNamespace(path=f"out{i}@qc", row=row) for i in range(50)]
+    with store.connection:
+        for entry in entries:
+            store.put_provenance({"pipeline": "qc"}, entry)
+        assert store.get_provenance(entries[0]) == {"pipeline": "qc"}
+    assert client.calls == ["get", "modify"]
+    assert len(decode_provenance(client.info["s1"][PROVENANCE_INFO_KEY])) == 50
+    # Served from the cache populated by the flush
+    assert store.get_provenance(entries[-1]) == {"pipeline": "qc"}
+    assert client.calls == ["get", "modify"]
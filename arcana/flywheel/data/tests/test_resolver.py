@@ -0,0 +1,19 @@
+from arcana.flywheel.data.resolver import ContainerResolver
+from arcana.flywheel.data.tree import TreeLeaf
+
+
+def test_resolver_from_leaves():
+    resolver = ContainerResolver.from_leaves(
+        "proj",
+        [
+            TreeLeaf("SUBJ01", "s01", subject_id="subj1", session_id="sess1"),
+            TreeLeaf("SUBJ01", "s02", subject_id="subj1", session_id="sess2"),
+            TreeLeaf("SUBJ02", "s01", subject_id="subj2", session_id="sess3"),
+        ],
+    )
+    assert resolver.resolve(()) == "proj"
+    assert resolver.resolve(("SUBJ01",)) == "subj1"
+    assert resolver.resolve(("SUBJ02", "s01")) == "sess3"
+    assert resolver.resolve(("SUBJ03",)) is None
+    assert not resolver.expired(ttl=60)
+    assert resolver.expired(ttl=-1)
@@ -0,0 +1,59 @@
+import time
+import pytest
+import flywheel
+from arcana.flywheel.data.scheduler import RequestScheduler, ScheduledClient
+
+
+class FlakyServer:
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def get_thing(self, arg):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise flywheel.ApiException(status=429, reason="Too many requests")
+        return arg
+
+    def add_thing(self, arg):
+        return self.get_thing(arg)
+
+    def upload_thing(self, arg):
+        time.sleep(0.02)
+        return self.get_thing(arg)
+
+
+def test_overload_retried_and_limit_decreased():
+    scheduler = RequestScheduler(initial_limit=8, retry_delay=0.001)
+    server = FlakyServer(failures=2)
+    client = ScheduledClient(server, scheduler)
+    assert client.get_thing("x") == "x"
+    assert server.calls == 3
+    assert scheduler.limit < 8
+    assert scheduler.in_flight == 0
+
+
+def test_non_idempotent_not_retried():
+    scheduler = RequestScheduler(retry_delay=0.001)
+    server = FlakyServer(failures=1)
+    with pytest.raises(flywheel.ApiException):
+        ScheduledClient(server, scheduler).add_thing("x")
+    assert server.calls == 1
+
+
+def test_limit_increases_with_successes():
+    scheduler = RequestScheduler(initial_limit=2, max_limit=4)
+    client = ScheduledClient(FlakyServer(failures=0), scheduler)
+    for _ in range(100):
+        client.get_thing("x")
+    assert scheduler.limit == 4
+
+
+def test_slow_transfers_not_treated_as_overload():
+    scheduler = RequestScheduler(initial_limit=8, latency_target=0.01)
+    client = ScheduledClient(FlakyServer(failures=0), scheduler)
+    client.upload_thing("x")
+    assert scheduler.limit == 8
+    # Other requests that respond as slowly do cut the limit
+    scheduler.call(client.client.upload_thing, "x")
+    assert scheduler.limit == 4
@@ -37,6 +37,11 @@ DATASET_BLUEPRINTS = {
         space=Clinical,
         hierarchy=["subject", "session"],
         dim_lengths=[2, 2, 2],
+        id_patterns={
+            "group": r"subject::(group\d+)member\d+",
+            "member": r"subject::group\d+(member\d+)",
+            "timepoint": r"session::(timepoint\d+).*",
+        },
         entries=[
             FileSetEntryBlueprint(
                 path="file1", datatype=PlainText, filenames=["file.txt"]
@@ -52,13 +57,13 @@ DATASET_BLUEPRINTS = {
             FileSetEntryBlueprint(path="dir1", datatype=Directory, filenames=["dir1"]),
             FieldEntryBlueprint(
                 path="textfield",
-                row_frequency="abcd",
+                row_frequency="session",
                 datatype=TextField,
                 value="sample-text",
             ),  # Derivatives to insert
             FieldEntryBlueprint(
                 path="booleanfield",
-                row_frequency="c",
+                row_frequency="subject",
                 datatype=Boolean,
                 value="no",
                 expected_value=False,
@@ -67,38 +72,38 @@ DATASET_BLUEPRINTS = {
         derivatives=[
             FileSetEntryBlueprint(
                 path="deriv1",
-                row_frequency="abcd",
+                row_frequency="session",
                 datatype=PlainText,
                 filenames=["file1.txt"],
             ),  # Derivatives to insert
             FileSetEntryBlueprint(
                 path="deriv2",
-                row_frequency="c",
+                row_frequency="subject",
                 datatype=Directory,
                 filenames=["dir"],
             ),
             FileSetEntryBlueprint(
                 path="deriv3",
-                row_frequency="bd",
+                row_frequency="dataset",
                 datatype=PlainText,
                 filenames=["file1.txt"],
             ),
             FieldEntryBlueprint(
                 path="integerfield",
-                row_frequency="c",
+                row_frequency="subject",
                 datatype=Integer,
                 value=99,
             ),
             FieldEntryBlueprint(
                 path="decimalfield",
-                row_frequency="bd",
+                row_frequency="dataset",
                 datatype=Decimal,
                 value="33.3333",
                 expected_value=decimal.Decimal("33.3333"),
             ),
             FieldEntryBlueprint(
                 path="arrayfield",
-                row_frequency="bd",
+                row_frequency="dataset",
                 datatype=Array[Integer],
                 value=[1, 2, 3, 4, 5],
             ),
@@ -131,16 +136,14 @@ def test_populate_tree(dataset: Dataset):
         ), f"{freq} doesn't match {len(dataset.rows(freq))} vs {num_rows}"
 
 
-@pytest.mark.xfail(reason="Hasn't been implemented yet", raises=NotImplementedError)
 def test_populate_row(dataset: Dataset):
     blueprint = dataset.__annotations__["blueprint"]
-    for row in dataset.rows("abcd"):
+    for row in dataset.rows(dataset.leaf_freq):
         expected_paths = sorted(e.path for e in blueprint.entries)
         entry_paths = sorted(e.path for e in row.entries)
         assert entry_paths == expected_paths
 
 
-@pytest.mark.xfail(reason="Hasn't been implemented yet", raises=NotImplementedError)
 def test_get(dataset: Dataset):
     blueprint = dataset.__annotations__["blueprint"]
     for entry_bp in blueprint.entries:
@@ -157,7 +160,6 @@ def test_get(dataset: Dataset):
                 assert item.value == entry_bp.expected_value
 
 
-@pytest.mark.xfail(reason="Hasn't been implemented yet", raises=NotImplementedError)
 def test_post(dataset: Dataset):
     blueprint = dataset.__annotations__["blueprint"]
 
@@ -194,7 +196,6 @@ def test_post(dataset: Dataset):
     check_inserted()  # Check that objects can be recreated from store
 
 
-@pytest.mark.xfail(reason="Hasn't been implemented yet", raises=NotImplementedError)
 def test_dataset_definition_roundtrip(dataset: Dataset):
     definition = asdict(dataset, omit=["store", "name"])
     definition["store-version"] = "1.0.0"
@@ -212,7 +213,6 @@ def test_dataset_definition_roundtrip(dataset: Dataset):
 
 
 # We use __file__ here as we just need any old file and can guarantee it exists
-@pytest.mark.xfail(reason="Hasn't been implemented yet", raises=NotImplementedError)
 @pytest.mark.parametrize("datatype,value", [(File, __file__), (TextField, "value")])
 def test_provenance_roundtrip(datatype: type, value: str, simple_dataset: Dataset):
     provenance = {"a": 1, "b": [1, 2, 3], "c": {"x": True, "y": "foo", "z": "bar"}}
@@ -0,0 +1,43 @@
+import os
+import pytest
+from arcana.flywheel.data.transfer import (
+    local_path,
+    stream_to_file,
+    iter_local_files,
+    UploadJournal,
+)
+
+
+def test_stream_to_file_touches_progress_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr("arcana.flywheel.data.transfer.PROGRESS_TOUCH_INTERVAL", -1)
+    download_dir = tmp_path / "download"
+    download_dir.mkdir()
+    os.utime(download_dir, (0, 0))
+    dest = local_path(download_dir / "files", "sub/dir/file.txt")
+    num_bytes = stream_to_file([b"abc", b"def"], dest, progress_dir=download_dir)
+    assert num_bytes == 6
+    assert dest.read_bytes() == b"abcdef"
+    assert download_dir.stat().st_mtime > 0
+
+
+def test_local_path_outside_base_dir(tmp_path):
+    with pytest.raises(ValueError):
+        local_path(tmp_path, "../escaped.txt")
+
+
+def test_upload_journal_resume(tmp_path):
+    cache_path = tmp_path / "derivative"
+    (cache_path / "sub").mkdir(parents=True)
+    (cache_path / "a.txt").write_text("a")
+    (cache_path / "sub" / "b.txt").write_text("bb")
+    assert [n for n, _ in iter_local_files(cache_path)] == ["a.txt", "sub/b.txt"]
+    journal = UploadJournal.load(cache_path, "/projects/p/analyses/1")
+    journal.record("a.txt", 1)
+    journal.record("sub/b.txt", 2)
+    reloaded = UploadJournal.load(cache_path, "/projects/p/analyses/1")
+    assert reloaded.is_uploaded("a.txt", 1, {"a.txt": 1})
+    # Not listed by the server (e.g. the upload was interrupted before it was saved)
+    assert not reloaded.is_uploaded("sub/b.txt", 2, {"a.txt": 1})
+    assert not UploadJournal.load(cache_path, "/projects/p/analyses/2").uploaded
+    reloaded.clear()
+    assert not UploadJournal.load(cache_path, "/projects/p/analyses/1").uploaded
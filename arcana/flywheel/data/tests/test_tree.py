@@ -0,0 +1,236 @@
+import json
+import uuid
+import tracemalloc
+from datetime import date, datetime, timezone
+from types import SimpleNamespace
+import attrs
+from arcana.common import Clinical
+from arcana.flywheel.data.tree import (
+    TreeLeaf,
+    TreeSnapshot,
+    TreeFilter,
+    LeafTable,
+    sort_leaves,
+)
+from arcana.flywheel.testing import MockFlywheel
+
+
+SESSIONS = [
+    ("SUBJ02", "s02", "2021-03-04T10:00:00+00:00", 31536000 * 30),
+    ("SUBJ01", "s02", "2021-01-02T10:00:00+00:00", None),
+    ("SUBJ01", "s01", "2020-01-02T10:00:00+00:00", 31536000 * 40),
+    ("SUBJ01", "s03", None, None),
+]
+
+
+def test_bulk_and_hierarchy_leaves_match():
+    view_rows = [
+        {
+            "subject.label": subj,
+            "session.label": sess,
+            "session.timestamp": timestamp,
+            "session.age": age,
+        }
+        for subj, sess, timestamp, age in SESSIONS
+    ]
+    sdk_leaves = [
+        TreeLeaf.from_session(
+            SimpleNamespace(label=subj, id=None),
+            SimpleNamespace(
+                label=sess,
+                id=None,
+                timestamp=(
+                    datetime.fromisoformat(timestamp).astimezone(timezone.utc)
+                    if timestamp
+                    else None
+                ),
+                age=age,
+            ),
+        )
+        for subj, sess, timestamp, age in SESSIONS
+    ]
+    bulk = sort_leaves(TreeLeaf.from_view_row(r) for r in view_rows)
+    walked = sort_leaves(sdk_leaves)
+    assert [leaf.tree_path for leaf in bulk] == [
+        ["SUBJ01", "s01"],
+        ["SUBJ01", "s02"],
+        ["SUBJ01", "s03"],
+        ["SUBJ02", "s02"],
+    ]
+    assert [(lf.tree_path, lf.metadata) for lf in bulk] == [
+        (lf.tree_path, lf.metadata) for lf in walked
+    ]
+    assert bulk[0].metadata == {"session": {"date": "20200102", "age": 40.0}}
+    assert bulk[2].metadata == {"session": {"date": None, "age": -1}}
+
+
+def test_leaf_table_select():
+    leaves = sort_leaves(
+        TreeLeaf(
+            subject_label=subj,
+            session_label=sess,
+            timestamp=datetime.fromisoformat(timestamp) if timestamp else None,
+            age=age,
+        )
+        for subj, sess, timestamp, age in SESSIONS
+    )
+    table = LeafTable.from_leaves(leaves)
+    assert len(table) == 4
+    # Labels repeated across leaves are shared
+    assert table.subject_labels[0] is table.subject_labels[2]
+    assert [table.metadata(i) for i in range(4)] == [lf.metadata for lf in leaves]
+    assert table.tree_paths(table.select(min_age=35)) == [["SUBJ01", "s01"]]
+    assert table.tree_paths(table.select(max_age=35)) == [["SUBJ02", "s02"]]
+    assert table.tree_paths(table.select(start=date(2021, 1, 1))) == [
+        ["SUBJ01", "s02"],
+        ["SUBJ02", "s02"],
+    ]
+    assert table.select(min_age=20, end=date(2021, 1, 2)) == [0]
+    assert table.select() == [0, 1, 2, 3]
+
+
+def test_leaf_table_consume_releases_leaves():
+    def leaf_table_growth(build):
+        # Labels unique to each build, so none are already interned
+        prefix = uuid.uuid4().hex
+        tracemalloc.start()
+        try:
+            leaves = [
+                TreeLeaf(
+                    subject_label=f"{prefix}-SUBJ{i // 4:05}",
+                    session_label=f"{prefix}-SESS{i:05}",
+                    timestamp=datetime(2020, 1, 1, tzinfo=timezone.utc),
+                    age=31536000 * 30,
+                )
+                for i in range(10000)
+            ]
+            base, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            table = build(leaves)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert len(table) == 10000
+        return peak - base, leaves
+
+    consume_growth, leaves = leaf_table_growth(LeafTable.consume)
+    assert leaves == []
+    from_leaves_growth, _ = leaf_table_growth(LeafTable.from_leaves)
+    # The leaves are released as the table is built, so it adds little to the peak
+    # memory, whereas building it from a list that is still held doubles up on both
+    assert consume_growth * 10 < from_leaves_growth
+
+
+def test_snapshot_roundtrip_and_refresh(tmp_path):
+    leaves = sort_leaves(
+        TreeLeaf(
+            subject_label=subj,
+            session_label=sess,
+            subject_id="id-" + subj,
+            session_id=f"id-{subj}-{sess}",
+            timestamp=datetime.fromisoformat(timestamp) if timestamp else None,
+            age=age,
+        )
+        for subj, sess, timestamp, age in SESSIONS
+    )
+    taken = datetime(2022, 1, 1, tzinfo=timezone.utc)
+    path = tmp_path / "snapshots" / "project.json"
+    TreeSnapshot(project_id="p", scanned=taken, taken=taken, leaves=leaves).save(path)
+    snapshot = TreeSnapshot.load(path)
+    assert snapshot.leaves == leaves
+    # Relabel a session of SUBJ02 and move a session from SUBJ01 to it
+    moved = attrs.evolve(leaves[1], subject_label="SUBJ02", subject_id="id-SUBJ02")
+    relabelled = attrs.evolve(leaves[3], session_label="s04")
+    refreshed = snapshot.updated(
+        taken=datetime(2022, 1, 2, tzinfo=timezone.utc),
+        subjects={"id-SUBJ02": [moved, relabelled]},
+    )
+    assert [lf.tree_path for lf in refreshed.leaves] == [
+        ["SUBJ01", "s01"],
+        ["SUBJ01", "s03"],
+        ["SUBJ02", "s02"],
+        ["SUBJ02", "s04"],
+    ]
+    assert refreshed.scanned == taken
+
+
+def test_snapshot_version_mismatch(tmp_path):
+    path = tmp_path / "project.json"
+    path.write_text(json.dumps({"version": TreeSnapshot.VERSION + 1}))
+    assert TreeSnapshot.load(path) is None
+
+
+def test_filtered_tree_scan(tmp_path):
+    site = MockFlywheel()
+    site.add_synthetic_project(
+        "filtered", num_subjects=50, num_sessions=2, num_acquisitions=2
+    )
+    store = site.store(tmp_path, tree_snapshots=False, page_size=10)
+    include = {"subject": ["SUBJ00003", "SUBJ00042"], "session": r".*_MR01"}
+    dataset = store.define_dataset(
+        "filtered",
+        space=Clinical,
+        hierarchy=["subject", "session"],
+        include=include,
+    )
+    # Only the criteria on the subjects are pushed down to the server
+    assert TreeFilter.from_dataset(dataset).expression("subject.label") == (
+        "subject.label=|[SUBJ00003,SUBJ00042]"
+    )
+    with dataset.tree:
+        rows = list(dataset.rows("session"))
+        assert sorted(r.id for r in rows) == ["SUBJ00003_MR01", "SUBJ00042_MR01"]
+        entries = [e.path for r in rows for e in r.entries]
+        assert sorted(entries) == ["scan00", "scan00", "scan01", "scan01"]
+    # Only the included subtree was listed by the server, in a single page each
+    assert site.calls["read_view_data"] == 1
+    assert site.calls["get_project_acquisitions"] == 1
+
+
+def test_filtered_scan_keeps_implicit_ids(tmp_path):
+    site = MockFlywheel()
+    site.add_synthetic_project(
+        "implicit", num_subjects=3, num_sessions=3, num_acquisitions=1
+    )
+    store = site.store(tmp_path, tree_snapshots=False)
+
+    def timepoints(**kwargs):
+        # The timepoint is left implicit by the hierarchy, so it is numbered by
+        # counting the sessions of each subject
+        dataset = store.define_dataset(
+            "implicit", space=Clinical, hierarchy=["subject", "session"], **kwargs
+        )
+        return {
+            r.id: r.frequency_id("timepoint") for r in dataset.rows("session")
+        }
+
+    full = timepoints()
+    filtered = timepoints(include={"subject": ["SUBJ00001"], "session": r".*_MR02"})
+    assert list(filtered) == ["SUBJ00001_MR02"]
+    assert filtered["SUBJ00001_MR02"] == full["SUBJ00001_MR02"]
+    # Subject criteria aren't pushed down if the subjects are numbered across the
+    # project, i.e. the group is inferred from their labels but not the member
+    dataset = store.define_dataset(
+        "implicit",
+        space=Clinical,
+        hierarchy=["subject", "session"],
+        id_patterns={"group": r"subject::(SUBJ)\d+"},
+        include={"subject": ["SUBJ00001"]},
+    )
+    assert TreeFilter.from_dataset(dataset) is None
+
+
+def test_bulk_scan_pages(tmp_path):
+    site = MockFlywheel()
+    site.add_synthetic_project(
+        "paged", num_subjects=25, num_sessions=2, num_acquisitions=1
+    )
+    store = site.store(tmp_path, tree_snapshots=False, page_size=10)
+    dataset = store.define_dataset(
+        "paged", space=Clinical, hierarchy=["subject", "session"]
+    )
+    with dataset.tree:
+        rows = [r.id for r in dataset.rows("session")]
+    # Each session is listed exactly once across the pages of the view
+    assert len(rows) == len(set(rows)) == 50
+    assert site.calls["read_view_data"] == 6
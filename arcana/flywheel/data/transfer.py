@@ -0,0 +1,165 @@
+"""
+Helpers for streaming files to and from a Flywheel server
+"""
+from __future__ import annotations
+import os
+import time
+import json
+import logging
+import tempfile
+import threading
+import typing as ty
+from pathlib import Path
+import attrs
+from arcana.core.utils.misc import JSON_ENCODING
+
+
+logger = logging.getLogger("arcana")
+
+
+# Minimum interval (in seconds) between touches of the directory being downloaded
+# into, which is how progress is signalled to sibling processes waiting on it
+PROGRESS_TOUCH_INTERVAL = 1.0
+
+
+def local_path(base_dir: Path, file_name: str) -> Path:
+    """Maps the name of a file within a Flywheel container to a path under `base_dir`.
+    Names of files within directory file-sets are relative POSIX paths"""
+    path = base_dir.joinpath(*file_name.split("/"))
+    if base_dir.resolve() not in path.resolve().parents:
+        raise ValueError(f"File name '{file_name}' points outside of {base_dir}")
+    return path
+
+
+def stream_to_file(
+    chunks: ty.Iterable[bytes],
+    dest: Path,
+    progress_dir: ty.Optional[Path] = None,
+    hasher: ty.Optional[ty.Any] = None,
+) -> int:
+    """Streams chunks of a download into a file as they arrive
+
+    Parameters
+    ----------
+    chunks : Iterable[bytes]
+        the chunks of the file's contents
+    dest : Path
+        the path to write the file to (parent directories are created as required)
+    progress_dir : Path, optional
+        a directory whose modification time is updated as chunks are written, so
+        that processes monitoring it for stalled downloads see the activity even
+        though writing to an existing file doesn't update directory timestamps
+    hasher : hashlib hash object, optional
+        a hash object that is updated with the chunks as they are written, so the
+        digest of the file is calculated without reading it back
+
+    Returns
+    -------
+    int
+        the number of bytes written
+    """
+    dest.parent.mkdir(parents=True, exist_ok=True)
+    num_bytes = 0
+    last_touched = time.monotonic()
+    with open(dest, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+            num_bytes += len(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+            if progress_dir is not None:
+                now = time.monotonic()
+                if now - last_touched > PROGRESS_TOUCH_INTERVAL:
+                    os.utime(progress_dir)
+                    last_touched = now
+    return num_bytes
+
+
+def save_json(obj: ty.Any, path: Path):
+    """Saves an object to a JSON file in the cache. The file is written to a temporary
+    file first and then moved into place, so other processes sharing the cache never
+    see a partially written file"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", **JSON_ENCODING) as f:
+            json.dump(obj, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def iter_local_files(path: Path) -> ty.Iterator[ty.Tuple[str, Path]]:
+    """Iterates over the files to be uploaded from a cached file-set, yielding the
+    name each will be given in the Flywheel container (relative POSIX paths for the
+    members of directories) along with its local path"""
+    if path.is_file():
+        yield path.name, path
+        return
+    for dpath, _, fnames in sorted(os.walk(path)):
+        for fname in sorted(fnames):
+            fspath = Path(dpath) / fname
+            yield fspath.relative_to(path).as_posix(), fspath
+
+
+@attrs.define
+class UploadJournal:
+    """Records the files of a file-set that have been successfully uploaded, in a
+    sidecar next to the cached file-set, so that an interrupted upload only needs to
+    send the files that didn't make it to the server when it is retried.
+
+    Files are keyed by name and size rather than modification time, as the cache is
+    recreated from the source file-set before each attempt. A file is only skipped if
+    the server also lists it with the same size, and the checksums of the file-set
+    are compared with those reported by the server once the upload completes.
+
+    Parameters
+    ----------
+    path : Path
+        the path of the journal file
+    uri : str
+        the URI of the entry being uploaded to. Journals recorded against a different
+        entry (e.g. one that has since been recreated) are discarded
+    uploaded : dict[str, int]
+        the sizes of the files that have been uploaded, keyed by name
+    """
+
+    SUFFIX = ".upload.json"
+
+    path: Path
+    uri: str
+    uploaded: ty.Dict[str, int] = attrs.field(factory=dict)
+    _lock: threading.Lock = attrs.field(factory=threading.Lock, init=False, repr=False)
+
+    @classmethod
+    def load(cls, cache_path: Path, uri: str) -> UploadJournal:
+        """Loads the journal of a previous attempt to upload the file-set cached at
+        `cache_path` to `uri`, or starts a new one if there isn't one"""
+        path = Path(str(cache_path) + cls.SUFFIX)
+        try:
+            with open(path, **JSON_ENCODING) as f:
+                dct = json.load(f)
+        except FileNotFoundError:
+            dct = {}
+        except ValueError:
+            logger.warning("Ignoring corrupted upload journal at %s", path)
+            dct = {}
+        if dct.get("uri") != uri:
+            dct = {}
+        return cls(path=path, uri=uri, uploaded=dct.get("uploaded", {}))
+
+    def is_uploaded(self, name: str, size: int, remote_sizes: ty.Dict[str, int]):
+        return self.uploaded.get(name) == size and remote_sizes.get(name) == size
+
+    def record(self, name: str, size: int):
+        """Records that a file has been uploaded. Called from the upload threads, so
+        the journal is rewritten under a lock (and atomically, in case the process is
+        killed part way through)"""
+        with self._lock:
+            self.uploaded[name] = size
+            save_json({"uri": self.uri, "uploaded": self.uploaded}, self.path)
+
+    def clear(self):
+        """Removes the journal once the upload has completed"""
+        self.path.unlink(missing_ok=True)
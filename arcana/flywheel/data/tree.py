@@ -0,0 +1,490 @@
+"""
+Helpers for scanning the "leaves" (i.e. sessions) of Flywheel projects into Arcana
+data trees and caching the results between processes
+"""
+from __future__ import annotations
+import re
+import sys
+import math
+import array
+import typing as ty
+import json
+import logging
+from pathlib import Path
+from datetime import datetime, date
+import attrs
+from dateutil.parser import isoparse
+from arcana.core.utils.misc import JSON_ENCODING
+from .transfer import save_json
+
+
+logger = logging.getLogger("arcana")
+
+
+SECONDS_PER_YEAR = 31536000
+
+# Columns projected by the data view used to scan a project in a single query. The
+# IDs and labels of the subject and session are added by the view itself
+TREE_VIEW_COLUMNS = ("session.timestamp", "session.age")
+
+# Characters that can't be used in the values of the filter expressions of the
+# Flywheel API, as they delimit the conditions and lists of the expression. Criteria
+# that contain them are only applied to the scanned leaves
+FILTER_RESERVED_CHARS = frozenset(",[]")
+
+# The maximum number of values in a single "in" filter condition, which keeps the
+# URLs of filtered requests within the limits of the server
+MAX_FILTER_VALUES = 100
+
+# Criterion on the labels of subjects or sessions, either a list of labels or a
+# regular expression they must match (see ``Dataset.include``)
+LabelCriterion = ty.Union[ty.List[str], str]
+
+
+@attrs.define(frozen=True)
+class TreeLeaf:
+    """A session found while scanning a Flywheel project, holding just the fields
+    required to add it to a data tree
+
+    Parameters
+    ----------
+    subject_label : str
+        label of the subject the session belongs to
+    session_label : str
+        label of the session
+    subject_id : str, optional
+        the Flywheel container ID of the subject
+    session_id : str, optional
+        the Flywheel container ID of the session
+    timestamp : datetime, optional
+        the timestamp of the session (i.e. acquisition date)
+    age : int, optional
+        the age of the subject at the time of the session in seconds
+    """
+
+    subject_label: str
+    session_label: str
+    subject_id: ty.Optional[str] = None
+    session_id: ty.Optional[str] = None
+    timestamp: ty.Optional[datetime] = None
+    age: ty.Optional[int] = None
+
+    @classmethod
+    def from_session(cls, fwsubject, fwsession) -> TreeLeaf:
+        """Creates a leaf from subject and session containers returned by the SDK"""
+        return cls(
+            subject_label=fwsubject.label,
+            session_label=fwsession.label,
+            subject_id=fwsubject.id,
+            session_id=fwsession.id,
+            timestamp=fwsession.timestamp,
+            age=fwsession.age,
+        )
+
+    @classmethod
+    def from_view_row(cls, row: ty.Dict[str, ty.Any]) -> TreeLeaf:
+        """Creates a leaf from a row of the "json-flat" output of the tree data view"""
+        timestamp = row.get("session.timestamp")
+        return cls(
+            subject_label=row["subject.label"],
+            session_label=row["session.label"],
+            subject_id=row.get("subject.id"),
+            session_id=row.get("session.id"),
+            timestamp=isoparse(timestamp) if timestamp else None,
+            age=row.get("session.age"),
+        )
+
+    @classmethod
+    def fromdict(cls, dct: ty.Dict[str, ty.Any]) -> TreeLeaf:
+        timestamp = dct.get("timestamp")
+        return cls(**{**dct, "timestamp": isoparse(timestamp) if timestamp else None})
+
+    def asdict(self) -> ty.Dict[str, ty.Any]:
+        dct = attrs.asdict(self)
+        if self.timestamp is not None:
+            dct["timestamp"] = self.timestamp.isoformat()
+        return dct
+
+    @property
+    def tree_path(self) -> ty.List[str]:
+        return [self.subject_label, self.session_label]
+
+    @property
+    def metadata(self) -> ty.Dict[str, ty.Dict[str, ty.Any]]:
+        """Metadata passed to ``DataTree.add_leaf`` to infer IDs from"""
+        return {
+            "session": {
+                "date": self.timestamp.strftime("%Y%m%d") if self.timestamp else None,
+                "age": self.age / SECONDS_PER_YEAR if self.age is not None else -1,
+            }
+        }
+
+    @property
+    def sort_key(self) -> tuple:
+        """Subjects are ordered by label and their sessions by timestamp (sessions
+        without timestamps last), with the session label breaking any ties so that
+        the order doesn't depend on the order the server happens to return them in"""
+        return (
+            self.subject_label,
+            self.timestamp is None,
+            self.timestamp if self.timestamp is not None else 0,
+            self.session_label,
+        )
+
+
+@attrs.define
+class LeafTable:
+    """The leaves of a project held in columns, which is kept for the life of the
+    data tree in place of a list of leaves (or their metadata dicts). Labels and IDs
+    are interned, so the strings repeated across leaves (e.g. subject labels) and
+    the keys of the rows built from them are shared, and the session dates and ages
+    are held in arrays of numbers that leaves can be selected by in a single pass.
+    Build it with `consume` to release the leaves as they are added
+
+    Parameters
+    ----------
+    subject_labels : list[str]
+        the labels of the subjects of the leaves
+    session_labels : list[str]
+        the labels of the sessions
+    subject_ids : list[str or None]
+        the Flywheel container IDs of the subjects
+    session_ids : list[str or None]
+        the Flywheel container IDs of the sessions
+    dates : array[int]
+        the dates of the sessions as YYYYMMDD integers (in the time-zone of their
+        timestamps), 0 if unknown
+    ages : array[float]
+        the age of the subject at the time of each session in years, NaN if unknown
+    """
+
+    subject_labels: ty.List[str] = attrs.field(factory=list)
+    session_labels: ty.List[str] = attrs.field(factory=list)
+    subject_ids: ty.List[ty.Optional[str]] = attrs.field(factory=list)
+    session_ids: ty.List[ty.Optional[str]] = attrs.field(factory=list)
+    dates: array.array = attrs.field(factory=lambda: array.array("l"))
+    ages: array.array = attrs.field(factory=lambda: array.array("d"))
+
+    @classmethod
+    def from_leaves(cls, leaves: ty.Iterable[TreeLeaf]) -> LeafTable:
+        table = cls()
+        for leaf in leaves:
+            table.append(leaf)
+        return table
+
+    @classmethod
+    def consume(cls, leaves: ty.List[TreeLeaf]) -> LeafTable:
+        """Builds the table from a list of leaves, which are removed from the list as
+        they are added so that each is released as soon as it is in the table, instead
+        of the list and the table both being held in full while it is built. The list
+        is left empty"""
+        table = cls()
+        leaves.reverse()
+        while leaves:
+            table.append(leaves.pop())
+        return table
+
+    def append(self, leaf: TreeLeaf):
+        self.subject_labels.append(sys.intern(leaf.subject_label))
+        self.session_labels.append(sys.intern(leaf.session_label))
+        self.subject_ids.append(_intern(leaf.subject_id))
+        self.session_ids.append(_intern(leaf.session_id))
+        self.dates.append(
+            int(leaf.timestamp.strftime("%Y%m%d")) if leaf.timestamp else 0
+        )
+        self.ages.append(
+            leaf.age / SECONDS_PER_YEAR if leaf.age is not None else math.nan
+        )
+
+    def __len__(self) -> int:
+        return len(self.session_labels)
+
+    def tree_path(self, index: int) -> ty.List[str]:
+        return [self.subject_labels[index], self.session_labels[index]]
+
+    def metadata(self, index: int) -> ty.Dict[str, ty.Dict[str, ty.Any]]:
+        """Metadata of a leaf passed to ``DataTree.add_leaf`` (see
+        `TreeLeaf.metadata`), which is only created while the leaf is added"""
+        leaf_date = self.dates[index]
+        age = self.ages[index]
+        return {
+            "session": {
+                "date": str(leaf_date) if leaf_date else None,
+                "age": -1 if math.isnan(age) else age,
+            }
+        }
+
+    def container_ids(self) -> ty.Iterator[ty.Tuple[ty.Tuple[str, ...], ty.Optional[str]]]:
+        """The IDs of the subject and session containers of the leaves keyed by the
+        key of their row (see ``EntryIndex.row_key``)"""
+        for subject, session, subject_id, session_id in zip(
+            self.subject_labels, self.session_labels, self.subject_ids, self.session_ids
+        ):
+            yield (subject,), subject_id
+            yield (subject, session), session_id
+
+    def select(
+        self,
+        min_age: ty.Optional[float] = None,
+        max_age: ty.Optional[float] = None,
+        start: ty.Optional[date] = None,
+        end: ty.Optional[date] = None,
+    ) -> ty.List[int]:
+        """Selects the leaves whose metadata is within the given ranges (inclusive).
+        Leaves with unknown ages or dates are excluded by the respective criteria
+
+        Parameters
+        ----------
+        min_age : float, optional
+            the minimum age (in years) of the subject at the time of the session
+        max_age : float, optional
+            the maximum age (in years) of the subject at the time of the session
+        start : date, optional
+            the first date of the window the session must fall in
+        end : date, optional
+            the last date of the window the session must fall in
+
+        Returns
+        -------
+        list[int]
+            the indices of the selected leaves
+        """
+        by_age = min_age is not None or max_age is not None
+        lower_age = -math.inf if min_age is None else min_age
+        upper_age = math.inf if max_age is None else max_age
+        by_date = start is not None or end is not None
+        lower_date = 1 if start is None else int(start.strftime("%Y%m%d"))
+        upper_date = sys.maxsize if end is None else int(end.strftime("%Y%m%d"))
+        if not (by_age or by_date):
+            return list(range(len(self)))
+        selected = []
+        for i, (age, day) in enumerate(zip(self.ages, self.dates)):
+            # NaN (unknown) ages fail both comparisons
+            if by_age and not lower_age <= age <= upper_age:
+                continue
+            if by_date and not lower_date <= day <= upper_date:
+                continue
+            selected.append(i)
+        return selected
+
+    def tree_paths(
+        self, indices: ty.Optional[ty.Iterable[int]] = None
+    ) -> ty.List[ty.List[str]]:
+        """The tree paths (i.e. subject and session labels) of the given leaves, by
+        default all of them"""
+        if indices is None:
+            indices = range(len(self))
+        return [self.tree_path(i) for i in indices]
+
+
+def _intern(value: ty.Optional[str]) -> ty.Optional[str]:
+    return sys.intern(value) if value is not None else None
+
+
+def sort_leaves(leaves: ty.Iterable[TreeLeaf]) -> ty.List[TreeLeaf]:
+    """Sorts leaves into the order they should be added to the data tree, which is
+    used to assign default IDs to axes not explicitly in the hierarchy so needs to be
+    consistent between reads"""
+    return sorted(leaves, key=lambda leaf: leaf.sort_key)
+
+
+@attrs.define
+class TreeSnapshot:
+    """A snapshot of the leaves of a Flywheel project saved in the cache directory of
+    the store, so that subsequent opens of the dataset only need to query the server
+    for the subjects and sessions that have been modified since it was taken
+
+    Parameters
+    ----------
+    project_id : str
+        the Flywheel ID of the project the snapshot was taken of
+    scanned : datetime
+        the time (in UTC) the last full scan of the project began
+    taken : datetime
+        the time (in UTC) the last scan or refresh of the snapshot began
+    leaves : list[TreeLeaf]
+        the leaves of the project in the order they are added to the tree
+    """
+
+    # Bump whenever the serialised format of the snapshot changes so that stale
+    # snapshots are rescanned instead of misread
+    VERSION = 1
+
+    project_id: str
+    scanned: datetime
+    taken: datetime
+    leaves: ty.List[TreeLeaf] = attrs.field(factory=list)
+
+    @classmethod
+    def load(cls, path: Path) -> ty.Optional[TreeSnapshot]:
+        """Loads a snapshot saved at the given path, returning None if it doesn't
+        exist or was saved by a different version of the store"""
+        try:
+            with open(path, **JSON_ENCODING) as f:
+                dct = json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logger.warning("Ignoring corrupted tree snapshot at %s", path)
+            return None
+        if dct.get("version") != cls.VERSION:
+            logger.info(
+                "Ignoring tree snapshot at %s saved in format version %s (expected %s)",
+                path,
+                dct.get("version"),
+                cls.VERSION,
+            )
+            return None
+        return cls(
+            project_id=dct["project_id"],
+            scanned=isoparse(dct["scanned"]),
+            taken=isoparse(dct["taken"]),
+            leaves=[TreeLeaf.fromdict(d) for d in dct["leaves"]],
+        )
+
+    def save(self, path: Path):
+        """Saves the snapshot to the given path"""
+        dct = {
+            "version": self.VERSION,
+            "project_id": self.project_id,
+            "scanned": self.scanned.isoformat(),
+            "taken": self.taken.isoformat(),
+            "leaves": [leaf.asdict() for leaf in self.leaves],
+        }
+        save_json(dct, path)
+
+    def updated(
+        self, taken: datetime, subjects: ty.Dict[str, ty.List[TreeLeaf]]
+    ) -> TreeSnapshot:
+        """Returns a new snapshot with the rescanned leaves of modified subjects merged
+        in
+
+        Parameters
+        ----------
+        taken : datetime
+            the time the query for modified containers began
+        subjects : dict[str, list[TreeLeaf]]
+            the complete list of leaves for each modified subject (keyed by subject
+            ID), replacing all existing leaves of that subject. Leaves of sessions
+            that have moved between subjects are also replaced
+
+        Returns
+        -------
+        TreeSnapshot
+            the updated snapshot
+        """
+        by_session = {
+            leaf.session_id: leaf
+            for leaf in self.leaves
+            if leaf.subject_id not in subjects
+        }
+        for subject_leaves in subjects.values():
+            by_session.update((leaf.session_id, leaf) for leaf in subject_leaves)
+        return type(self)(
+            project_id=self.project_id,
+            scanned=self.scanned,
+            taken=taken,
+            leaves=sort_leaves(by_session.values()),
+        )
+
+
+@attrs.define(frozen=True)
+class TreeFilter:
+    """Criteria on the labels of the subjects of a project, which are pushed down to
+    the queries used to scan it so that the server only returns the sessions of the
+    matching subjects.
+
+    Criteria on the sessions are left to ``DataTree.add_leaf`` to apply, as the
+    default IDs of axes outside of the hierarchy (e.g. the timepoint of a
+    [subject, session] hierarchy) are assigned by counting the sessions of each
+    subject before the criteria are applied, and would change if only the matching
+    sessions were scanned
+
+    Parameters
+    ----------
+    subjects : list[str] or str, optional
+        the labels of the subjects to include or a regular expression they must match
+    """
+
+    subjects: ty.Optional[LabelCriterion] = attrs.field(
+        default=None, converter=lambda c: tuple(c) if isinstance(c, list) else c
+    )
+
+    @classmethod
+    def from_dataset(cls, dataset: ty.Optional[ty.Any]) -> ty.Optional[TreeFilter]:
+        """Creates a filter from the inclusion criteria of a dataset on the first layer
+        of its hierarchy, which corresponds to the labels of the subjects of the
+        project, returning None if there aren't any or they can't be pushed down"""
+        if dataset is None or not dataset.hierarchy:
+            return None
+        include = getattr(dataset, "include", None) or {}
+        layer = str(dataset.hierarchy[0])
+        criterion = include.get(layer)
+        if not criterion:
+            return None
+        # If the IDs of only some of the axes of the first layer are inferred from
+        # the labels, the rest are numbered across all of the subjects, so they must
+        # all be scanned
+        axes = set(str(a) for a in dataset.space[layer].span())
+        inferred = axes.intersection(getattr(dataset, "id_patterns", None) or {})
+        if inferred and inferred != axes:
+            return None
+        return cls(subjects=criterion)
+
+    def matches(self, leaf: TreeLeaf) -> bool:
+        """Whether a scanned leaf matches the criteria (with the semantics of the
+        ``Dataset.include`` criteria they were created from)"""
+        return self._matches(leaf.subject_label, self.subjects)
+
+    def expression(self, subject_field: str) -> ty.Optional[str]:
+        """Translates the criteria into a filter expression of the Flywheel API, e.g.
+        "subject.label=|[sub01,sub02]". Criteria that can't be expressed are left out,
+        so the expression may match a superset of the leaves that match the filter
+
+        Parameters
+        ----------
+        subject_field : str
+            the field holding the subject label in the listed records (e.g. "label"
+            when listing subjects or "subject.label" in data views)
+
+        Returns
+        -------
+        str or None
+            the filter expression, or None if the criteria can't be expressed
+        """
+        return self._condition(subject_field, self.subjects)
+
+    @classmethod
+    def in_expressions(cls, field: str, values: ty.Iterable[str]) -> ty.List[str]:
+        """Filter expressions that together select the records whose field is one of
+        the values (e.g. container IDs), split so that each holds at most
+        `MAX_FILTER_VALUES` values"""
+        values = sorted(values)
+        return [
+            f"{field}=|[{','.join(values[i:i + MAX_FILTER_VALUES])}]"
+            for i in range(0, len(values), MAX_FILTER_VALUES)
+        ]
+
+    @classmethod
+    def _condition(
+        cls, field: str, criterion: ty.Optional[LabelCriterion]
+    ) -> ty.Optional[str]:
+        if not criterion:
+            return None
+        values = [criterion] if isinstance(criterion, str) else list(criterion)
+        if any(FILTER_RESERVED_CHARS.intersection(v) for v in values):
+            return None
+        if isinstance(criterion, str):
+            # Criteria are matched from the start of the label, like `re.match`
+            return f"{field}=~^(?:{criterion})"
+        if len(values) > MAX_FILTER_VALUES:
+            return None
+        return f"{field}=|[{','.join(values)}]"
+
+    @classmethod
+    def _matches(cls, label: str, criterion: ty.Optional[LabelCriterion]) -> bool:
+        if not criterion:
+            return True
+        if isinstance(criterion, str):
+            return bool(re.match(criterion, label))
+        return label in criterion
@@ -2,6 +2,8 @@ from __future__ import annotations
 import typing as ty
 import attrs
 from arcana.core.deploy.command.base import ContainerCommand
+from arcana.flywheel.data import Flywheel
+from .gear import GearJob
 
 if ty.TYPE_CHECKING:
     from .app import ExampleApp
@@ -11,6 +13,11 @@ if ty.TYPE_CHECKING:
 class ExampleCommand(ContainerCommand):
 
     image: ty.Optional[ExampleApp] = None
+    # The gear job the command is being executed in, if any, which is set by the
+    # entrypoint and isn't part of the specification of the command
+    gear_job: ty.Optional[GearJob] = attrs.field(
+        default=None, eq=False, repr=False, metadata={"asdict": False}
+    )
 
     # Hard-code the data_space of XNAT commands to be clinical
     # DATA_SPACE = Clinical
@@ -43,6 +50,18 @@ class ExampleCommand(ContainerCommand):
 
         return config
 
+    def load_dataset(self, *args, **kwargs):
+        """Loads the dataset (see ``ContainerCommand.load_dataset``), registering the
+        inputs staged by the gear job with its store so they are used in place and
+        installing the snapshot of the dataset handed to the job by its launcher"""
+        dataset = super().load_dataset(*args, **kwargs)
+        if self.gear_job is not None and isinstance(dataset.store, Flywheel):
+            dataset.store.register_staged_files(self.gear_job.staged_files())
+            snapshot = self.gear_job.snapshot()
+            if snapshot is not None and snapshot.dataset_id == dataset.id:
+                dataset.store.install_job_snapshot(snapshot)
+        return dataset
+
     def init_config(self):
         """Initialises the configuration dictionary
 
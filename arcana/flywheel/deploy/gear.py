@@ -0,0 +1,194 @@
+"""
+Reading of the job configuration and input manifest of the Flywheel gear the app is
+running in, so that the inputs staged on local disk by Flywheel can be used in place
+"""
+from __future__ import annotations
+import os
+import json
+import logging
+import typing as ty
+from pathlib import Path
+import attrs
+from arcana.flywheel.data.job import JobSnapshot, SNAPSHOT_KEY, TREE_INPUT
+
+
+logger = logging.getLogger("arcana")
+
+
+GEAR_DIR_ENV = "FLYWHEEL"
+DEFAULT_GEAR_DIR = "/flywheel/v0"
+CONFIG_FILE = "config.json"
+MANIFEST_FILE = "manifest.json"
+
+
+@attrs.define
+class StagedFile:
+    """A file of a container that has been staged on local disk by Flywheel as an
+    input of the gear job
+
+    Parameters
+    ----------
+    container_type : str
+        the type of the container the file belongs to (e.g. "acquisition")
+    container_id : str
+        the ID of the container
+    name : str
+        the name of the file within the container
+    path : Path
+        the path of the staged file
+    size : int, optional
+        the size of the file reported by the server
+    """
+
+    container_type: str
+    container_id: str
+    name: str
+    path: Path = attrs.field(converter=Path)
+    size: ty.Optional[int] = None
+
+
+@attrs.define
+class GearJob:
+    """The job the app is running as within a Flywheel gear
+
+    Parameters
+    ----------
+    base_dir : Path
+        the base directory of the gear (i.e. /flywheel/v0)
+    config : dict[str, Any]
+        the job configuration (i.e. the contents of config.json)
+    manifest : dict[str, Any]
+        the gear manifest (i.e. the contents of manifest.json)
+    """
+
+    base_dir: Path = attrs.field(converter=Path)
+    config: ty.Dict[str, ty.Any] = attrs.field(factory=dict)
+    manifest: ty.Dict[str, ty.Any] = attrs.field(factory=dict)
+
+    @classmethod
+    def detect(cls, base_dir: ty.Optional[Path] = None) -> ty.Optional[GearJob]:
+        """Loads the job if the process is running within a gear, i.e. if the job
+        configuration and the gear manifest are present in the gear directory
+
+        Parameters
+        ----------
+        base_dir : Path, optional
+            the base directory of the gear, by default the value of the FLYWHEEL
+            environment variable or /flywheel/v0
+
+        Returns
+        -------
+        GearJob or None
+            the job, or None if not running in a gear
+        """
+        if base_dir is None:
+            base_dir = os.environ.get(GEAR_DIR_ENV, DEFAULT_GEAR_DIR)
+        base_dir = Path(base_dir)
+        if not (
+            (base_dir / CONFIG_FILE).exists() and (base_dir / MANIFEST_FILE).exists()
+        ):
+            return None
+        return cls.load(base_dir)
+
+    @classmethod
+    def load(cls, base_dir: Path) -> GearJob:
+        base_dir = Path(base_dir)
+        with open(base_dir / CONFIG_FILE) as f:
+            config = json.load(f)
+        with open(base_dir / MANIFEST_FILE) as f:
+            manifest = json.load(f)
+        return cls(base_dir=base_dir, config=config, manifest=manifest)
+
+    @property
+    def job_id(self) -> ty.Optional[str]:
+        return self.config.get("job", {}).get("id")
+
+    @property
+    def destination(self) -> ty.Dict[str, str]:
+        return self.config.get("destination", {})
+
+    def snapshot(self) -> ty.Optional[JobSnapshot]:
+        """The snapshot of the dataset handed to the job by its launcher, either as a
+        (JSON-encoded) configuration value or an input file. Jobs launched in a batch
+        are handed the entries of their row in the configuration and the tree of the
+        dataset, which is shared by the batch, as a separate input file
+
+        Returns
+        -------
+        JobSnapshot or None
+            the snapshot, or None if the job wasn't handed one (or it was taken by a
+            different version of the store)
+        """
+        value = self.config.get("config", {}).get(SNAPSHOT_KEY)
+        if value is not None:
+            dct = json.loads(value) if isinstance(value, str) else value
+            if "leaves" not in dct:
+                tree_path = self._input_path(TREE_INPUT)
+                if tree_path is None:
+                    logger.warning(
+                        "Job snapshot has no tree and the '%s' input isn't staged",
+                        TREE_INPUT,
+                    )
+                    return None
+                with open(tree_path) as f:
+                    dct = {**json.load(f), **dct}
+            return JobSnapshot.fromdict(dct)
+        path = self._input_path(SNAPSHOT_KEY)
+        if path is not None:
+            return JobSnapshot.load(path)
+        return None
+
+    def _input_path(self, name: str) -> ty.Optional[Path]:
+        location = self.config.get("inputs", {}).get(name, {}).get("location")
+        if not (location and location.get("path")):
+            return None
+        return Path(location["path"])
+
+    def staged_files(self) -> ty.List[StagedFile]:
+        """The file inputs of the job that have been staged on local disk. Inputs that
+        aren't declared as files in the manifest, are missing or don't have the size
+        reported by the server are skipped (so they are downloaded as usual)
+
+        Returns
+        -------
+        list[StagedFile]
+            the staged files
+        """
+        declared = self.manifest.get("inputs", {})
+        staged = []
+        for name, inpt in self.config.get("inputs", {}).items():
+            if (
+                name in (SNAPSHOT_KEY, TREE_INPUT)
+                or inpt.get("base") != "file"
+                or declared.get(name, {}).get("base") != "file"
+            ):
+                continue
+            hierarchy = inpt.get("hierarchy", {})
+            location = inpt.get("location", {})
+            if not (hierarchy.get("id") and location.get("path")):
+                logger.debug("Input '%s' of gear job has no location", name)
+                continue
+            staged_file = StagedFile(
+                container_type=hierarchy.get("type"),
+                container_id=hierarchy["id"],
+                name=location.get("name", Path(location["path"]).name),
+                path=location["path"],
+                size=inpt.get("object", {}).get("size"),
+            )
+            try:
+                size = staged_file.path.stat().st_size
+            except OSError:
+                logger.warning(
+                    "Input '%s' of gear job is not staged at %s", name, staged_file.path
+                )
+                continue
+            if staged_file.size is not None and size != staged_file.size:
+                logger.warning(
+                    "Staged input '%s' of gear job is %s bytes, expected %s",
+                    name,
+                    size,
+                    staged_file.size,
+                )
+                continue
+            staged.append(staged_file)
+        return staged
@@ -0,0 +1,53 @@
+import json
+import pickle
+from fileformats.generic import FileSet
+from arcana.common import Clinical
+from arcana.flywheel.deploy.gear import GearJob
+from arcana.flywheel.testing import MockFlywheel
+
+
+def test_staged_gear_inputs(tmp_path):
+    site = MockFlywheel()
+    project_id = site.add_synthetic_project(
+        "gear",
+        num_subjects=1,
+        num_sessions=1,
+        num_acquisitions=1,
+        files_per_acquisition=2,
+        file_size=256,
+    )
+    acquisition_id = site.project_containers[(project_id, "acquisition")][0]
+    gear_dir = tmp_path / "gear"
+    inputs = {}
+    for i, fwfile in enumerate(site.containers[acquisition_id].files):
+        staged = gear_dir / "input" / f"input{i}" / fwfile.name
+        staged.parent.mkdir(parents=True)
+        staged.write_bytes(fwfile.read())
+        inputs[f"input{i}"] = {
+            "base": "file",
+            "hierarchy": {"type": "acquisition", "id": acquisition_id},
+            "location": {"path": str(staged), "name": fwfile.name},
+            "object": {"size": fwfile.size},
+        }
+    (gear_dir / "config.json").write_text(json.dumps({"inputs": inputs}))
+    (gear_dir / "manifest.json").write_text(
+        json.dumps({"inputs": {n: {"base": "file"} for n in inputs}})
+    )
+    assert GearJob.detect(tmp_path) is None
+    job = GearJob.detect(gear_dir)
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    store = site.store(cache_dir)
+    store.register_staged_files(job.staged_files())
+    # The staged files are carried over to the copies of the store passed to workers
+    store = site.connect(pickle.loads(pickle.dumps(store)))
+    dataset = store.define_dataset(
+        "gear", space=Clinical, hierarchy=["subject", "session"]
+    )
+    dataset.add_source("scan", FileSet, path="scan00")
+    row = next(iter(dataset.rows("session")))
+    fileset = row["scan"]
+    assert "download_file" not in site.calls
+    assert sorted(p.resolve() for p in fileset.fspaths) == sorted(
+        (gear_dir / "input").glob("*/*")
+    )
@@ -0,0 +1,783 @@
+"""
+In-process stand-in for a Flywheel site, which implements the subset of the SDK client
+used by the store against synthetic data held in memory, so that the store can be
+tested and benchmarked offline
+"""
+from __future__ import annotations
+import io
+import re
+import json
+import time
+import random
+import bisect
+import functools
+import tarfile
+import hashlib
+import itertools
+import threading
+import typing as ty
+from types import SimpleNamespace
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import attrs
+import requests
+import flywheel
+from .data.api import Flywheel
+from .data.pool import ClientPool
+from .data.checksums import format_digest
+
+
+# Condition of a filter expression of the listing endpoints and data views, e.g.
+# "modified>2020-01-01T00:00:00", "label=~^sub" or "parents.session=|[id1,id2]"
+FILTER_CONDITION = re.compile(
+    r"(?P<field>[\w.]+)(?P<op>=\||=~|>)(?P<value>\[[^\]]*\]|[^,]*)(?:,|$)"
+)
+
+
+def parse_filter(
+    expression: ty.Optional[str],
+) -> ty.List[ty.Tuple[str, str, ty.Any]]:
+    """Parses the subset of the filter syntax of the Flywheel API used by the store
+    into (field, operator, value) conditions"""
+    conditions = []
+    pos = 0
+    while expression and pos < len(expression):
+        match = FILTER_CONDITION.match(expression, pos)
+        if match is None:
+            raise flywheel.ApiException(status=400, reason=f"Bad filter {expression}")
+        field, op, value = match.group("field", "op", "value")
+        if op == "=|":
+            value = value[1:-1].split(",")
+        elif op == ">":
+            value = datetime.fromisoformat(value).replace(tzinfo=timezone.utc)
+        conditions.append((field, op, value))
+        pos = match.end()
+    return conditions
+
+
+def matches_filter(
+    conditions: ty.List[ty.Tuple[str, str, ty.Any]], get_field: ty.Callable
+) -> bool:
+    """Whether a record matches all the parsed conditions of a filter"""
+    for field, op, value in conditions:
+        actual = get_field(field)
+        if op == "=|":
+            matched = actual in value
+        elif op == "=~":
+            matched = actual is not None and re.search(value, actual) is not None
+        else:
+            matched = actual is not None and actual > value
+        if not matched:
+            return False
+    return True
+
+
+@attrs.define
+class MockFile:
+    """A file stored in a container of the mock site. The contents of synthetic files
+    are generated from their seed on demand, so large projects don't need to be held
+    in memory
+
+    Parameters
+    ----------
+    name : str
+        the name of the file
+    size : int
+        the size of the file in bytes
+    seed : str, optional
+        seed the contents of synthetic files are generated from
+    contents : bytes, optional
+        the contents of uploaded files
+    """
+
+    name: str
+    size: int
+    seed: ty.Optional[str] = None
+    contents: ty.Optional[bytes] = attrs.field(default=None, repr=False)
+    _hash: ty.Optional[str] = attrs.field(default=None, repr=False)
+
+    @property
+    def hash(self) -> str:
+        if self._hash is None:
+            self._hash = format_digest("sha384", hashlib.sha384(self.read()).hexdigest())
+        return self._hash
+
+    def read(self) -> bytes:
+        if self.contents is not None:
+            return self.contents
+        return hashlib.shake_128(self.seed.encode()).digest(self.size)
+
+
+@attrs.define
+class MockContainer:
+    """A container (i.e. project, subject, session, acquisition or analysis) in the
+    mock site, with the attributes of the corresponding SDK models that are accessed
+    by the store"""
+
+    id: str
+    container_type: str
+    label: str
+    parents: SimpleNamespace
+    parent: ty.Optional[SimpleNamespace] = None
+    info: ty.Optional[ty.Dict[str, ty.Any]] = attrs.field(factory=dict)
+    files: ty.List[MockFile] = attrs.field(factory=list)
+    created: datetime = attrs.field(factory=lambda: datetime.now(timezone.utc))
+    modified: datetime = attrs.field(factory=lambda: datetime.now(timezone.utc))
+    timestamp: ty.Optional[datetime] = None
+    age: ty.Optional[int] = None
+    info_exists: bool = False
+
+    def listed(self) -> MockContainer:
+        """The view of the container returned in listings, which (like the server)
+        only flags whether the container has info instead of including it"""
+        return attrs.evolve(self, info=None, info_exists=bool(self.info))
+
+    def fetched(self) -> MockContainer:
+        return attrs.evolve(self, info=dict(self.info), files=list(self.files))
+
+    def touch(self):
+        self.modified = datetime.now(timezone.utc)
+
+
+@attrs.define
+class MockJob:
+    """A gear job launched on the mock site, which is left pending until it is
+    transitioned by the test (see `MockFlywheel.run_jobs`)"""
+
+    id: str
+    gear_id: str
+    destination: SimpleNamespace
+    config: ty.Dict[str, ty.Any] = attrs.field(factory=dict)
+    tags: ty.List[str] = attrs.field(factory=list)
+    inputs: ty.Dict[str, ty.Any] = attrs.field(factory=dict)
+    state: str = "pending"
+    modified: datetime = attrs.field(factory=lambda: datetime.now(timezone.utc))
+
+
+@attrs.define
+class MockFlywheel:
+    """The state of a mock Flywheel site shared by all the clients connected to it
+
+    Parameters
+    ----------
+    latency : float
+        the time (in seconds) each request to the site takes before it is handled
+    bandwidth : float, optional
+        the rate (in bytes per second) files are transferred at, by default
+        unlimited
+    group : str
+        the group new projects are created in
+    """
+
+    latency: float = 0.0
+    bandwidth: ty.Optional[float] = None
+    group: str = "arcana_tests"
+    containers: ty.Dict[str, MockContainer] = attrs.field(factory=dict, repr=False)
+    # IDs of projects keyed by group and label
+    projects: ty.Dict[ty.Tuple[str, str], str] = attrs.field(factory=dict, repr=False)
+    # IDs of the containers of each type in each project, and the children of each
+    # type of each container, in creation (i.e. ID) order
+    project_containers: ty.Dict[ty.Tuple[str, str], ty.List[str]] = attrs.field(
+        factory=dict, repr=False
+    )
+    child_containers: ty.Dict[ty.Tuple[str, str], ty.List[str]] = attrs.field(
+        factory=dict, repr=False
+    )
+    calls: ty.Dict[str, int] = attrs.field(factory=dict, repr=False)
+    lock: threading.RLock = attrs.field(factory=threading.RLock, init=False, repr=False)
+    _id_counter: ty.Iterator[int] = attrs.field(
+        factory=lambda: itertools.count(1), init=False, repr=False
+    )
+    _lineages: ty.Dict[str, ty.Tuple[SimpleNamespace, SimpleNamespace]] = attrs.field(
+        factory=dict, init=False, repr=False
+    )
+    jobs: ty.Dict[str, MockJob] = attrs.field(factory=dict, repr=False)
+    # IDs of the containers to download keyed by download ticket
+    _tickets: ty.Dict[str, ty.List[str]] = attrs.field(
+        factory=dict, init=False, repr=False
+    )
+
+    def client(self) -> MockClient:
+        """Creates a new client connected to the site, e.g. to be used as the factory
+        of the client pool of a store"""
+        return MockClient(self)
+
+    def store(self, cache_dir: ty.Union[str, Path], **kwargs) -> Flywheel:
+        """Creates a store connected to the site
+
+        Parameters
+        ----------
+        cache_dir : str or Path
+            the cache directory of the store
+        **kwargs
+            passed through to the store
+        """
+        return self.connect(Flywheel(server="mock", cache_dir=cache_dir, **kwargs))
+
+    def connect(self, store: Flywheel) -> Flywheel:
+        """Connects an existing store to the site, e.g. one that has been unpickled
+        in a worker process"""
+        store._client_pool = ClientPool(
+            factory=self.client,
+            max_clients=store.max_connections,
+            http_pool_size=max(store.download_threads, store.upload_threads),
+        )
+        return store
+
+    def add_synthetic_project(
+        self,
+        label: str,
+        num_subjects: int = 10,
+        num_sessions: int = 5,
+        num_acquisitions: int = 20,
+        files_per_acquisition: int = 1,
+        file_size: int = 1024,
+    ) -> str:
+        """Adds a project populated with synthetic subjects, sessions and acquisitions
+        (up to e.g. 10000 x 5 x 20) without the latency of creating them through the
+        API
+
+        Parameters
+        ----------
+        label : str
+            label of the project, which is also the ID of the dataset in the store
+        num_subjects : int
+            the number of subjects in the project
+        num_sessions : int
+            the number of sessions of each subject
+        num_acquisitions : int
+            the number of acquisitions in each session
+        files_per_acquisition : int
+            the number of files in each acquisition
+        file_size : int
+            the size of each file in bytes
+
+        Returns
+        -------
+        str
+            the ID of the project
+        """
+        with self.lock:
+            project_id = self._add_project(label)
+            start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+            # Synthetic containers predate any snapshots of the project, so they
+            # aren't picked up by listings of modified containers
+            dates = {"created": start, "modified": start}
+            for i in range(num_subjects):
+                subject_label = f"SUBJ{i:05}"
+                subject_id = self._add_child(
+                    "subject", project_id, subject_label, **dates
+                )
+                for j in range(num_sessions):
+                    # Session labels are unique within the project, as the session
+                    # IDs of clinical datasets are
+                    session_id = self._add_child(
+                        "session",
+                        subject_id,
+                        f"{subject_label}_MR{j:02}",
+                        timestamp=start + timedelta(days=j),
+                        **dates,
+                    )
+                    for k in range(num_acquisitions):
+                        acq_label = f"scan{k:02}"
+                        acquisition_id = self._add_child(
+                            "acquisition", session_id, acq_label, **dates
+                        )
+                        self.containers[acquisition_id].files = [
+                            MockFile(
+                                name=f"{acq_label}_{f}.dat",
+                                size=file_size,
+                                seed=f"{acquisition_id}/{f}",
+                            )
+                            for f in range(files_per_acquisition)
+                        ]
+        return project_id
+
+    def request(self, method_name: str, num_bytes: int = 0):
+        """Simulates the latency of a request (and the transfer of its payload)"""
+        with self.lock:
+            self.calls[method_name] = self.calls.get(method_name, 0) + 1
+        delay = self.latency
+        if self.bandwidth and num_bytes:
+            delay += num_bytes / self.bandwidth
+        if delay:
+            time.sleep(delay)
+
+    def run_jobs(self, num_jobs: int, state: str = "complete") -> ty.List[MockJob]:
+        """Transitions the oldest jobs that haven't finished to the given state"""
+        with self.lock:
+            jobs = [
+                j
+                for j in self.jobs.values()
+                if j.state not in ("complete", "failed", "cancelled")
+            ][:num_jobs]
+            for job in jobs:
+                job.state = state
+                job.modified = datetime.now(timezone.utc)
+        return jobs
+
+    def create_ticket(self, container_ids: ty.List[str]) -> str:
+        with self.lock:
+            for container_id in container_ids:
+                self.get_container(container_id)
+            ticket = self._new_id()
+            self._tickets[ticket] = list(container_ids)
+        return ticket
+
+    def archive(self, ticket: str) -> bytes:
+        """Generates the tar archive of the containers of a download ticket, with
+        the files of each container under the labels of its ancestors"""
+        with self.lock:
+            try:
+                container_ids = self._tickets.pop(ticket)
+            except KeyError:
+                raise flywheel.ApiException(status=404, reason="Not found") from None
+            members = []
+            for container_id in container_ids:
+                container = self.containers[container_id]
+                labels = [
+                    self.containers[getattr(container.parents, t)].label
+                    for t in ("project", "subject", "session")
+                    if getattr(container.parents, t, None) in self.containers
+                ]
+                prefix = "/".join(["scitran", self.group] + labels + [container.label])
+                members.extend((f"{prefix}/{f.name}", f) for f in container.files)
+        buffer = io.BytesIO()
+        with tarfile.open(fileobj=buffer, mode="w|") as tar:
+            for name, mock_file in members:
+                contents = mock_file.read()
+                info = tarfile.TarInfo(name)
+                info.size = len(contents)
+                tar.addfile(info, io.BytesIO(contents))
+        self.request("download_ticket", num_bytes=buffer.tell())
+        return buffer.getvalue()
+
+    def get_container(self, container_id: str) -> MockContainer:
+        try:
+            return self.containers[container_id]
+        except KeyError:
+            raise flywheel.ApiException(status=404, reason="Not found") from None
+
+    def list_containers(
+        self,
+        project_id: str,
+        container_type: str,
+        parent_id: ty.Optional[str] = None,
+        limit: ty.Optional[int] = None,
+        after_id: ty.Optional[str] = None,
+        filter: ty.Optional[str] = None,
+    ) -> ty.List[MockContainer]:
+        """Lists the containers of a type in a project (or the children of a parent
+        container) in ID order, implementing the paging and filtering of the listing
+        endpoints"""
+        conditions = parse_filter(filter)
+        with self.lock:
+            if parent_id is not None:
+                ids = self.child_containers.get((parent_id, container_type), [])
+            else:
+                ids = self.project_containers.get((project_id, container_type), [])
+            # Conditions on IDs are looked up directly, like indexed queries
+            for field, op, value in conditions:
+                if op != "=|":
+                    continue
+                if field == "_id":
+                    ids = sorted(set(value).intersection(ids))
+                elif field.startswith("parents."):
+                    parent_type = field.split(".", 1)[1]
+                    ids = sorted(
+                        i
+                        for p in value
+                        if self.containers.get(p)
+                        and self.containers[p].container_type == parent_type
+                        for i in self.child_containers.get((p, container_type), [])
+                    )
+            start = bisect.bisect_right(ids, after_id) if after_id is not None else 0
+            listed = []
+            for container_id in itertools.islice(ids, start, None):
+                container = self.containers[container_id]
+                if conditions and not matches_filter(
+                    conditions, functools.partial(self.container_field, container)
+                ):
+                    continue
+                listed.append(container.listed())
+                if limit is not None and len(listed) == limit:
+                    break
+        return listed
+
+    def container_field(self, container: MockContainer, field: str) -> ty.Any:
+        """The value of a field of a container referenced in a filter"""
+        if field == "_id":
+            return container.id
+        if field in ("label", "modified"):
+            return getattr(container, field)
+        if field.startswith("parents."):
+            return getattr(container.parents, field.split(".", 1)[1], None)
+        if field == "subject.label":
+            return self.containers[container.parents.subject].label
+        raise flywheel.ApiException(status=400, reason=f"Can't filter on {field}")
+
+    def _new_id(self) -> str:
+        # IDs increase monotonically like the object IDs of the server, so listings
+        # sorted by ID are in creation order
+        return f"{next(self._id_counter):024x}"
+
+    def _add_project(self, label: str) -> str:
+        if (self.group, label) in self.projects:
+            raise flywheel.ApiException(status=409, reason="Conflict")
+        project_id = self._new_id()
+        self.containers[project_id] = MockContainer(
+            id=project_id,
+            container_type="project",
+            label=label,
+            parents=SimpleNamespace(group=self.group),
+        )
+        self.projects[(self.group, label)] = project_id
+        return project_id
+
+    def _add_child(
+        self, container_type: str, parent_id: str, label: str, **kwargs
+    ) -> str:
+        """Adds a container to a parent container, returning its ID"""
+        parents, parent = self._lineage(parent_id)
+        container = MockContainer(
+            id=self._new_id(),
+            container_type=container_type,
+            label=label,
+            parents=parents,
+            parent=parent,
+            **kwargs,
+        )
+        self.containers[container.id] = container
+        self.project_containers.setdefault(
+            (parents.project, container_type), []
+        ).append(container.id)
+        self.child_containers.setdefault((parent_id, container_type), []).append(
+            container.id
+        )
+        return container.id
+
+    def _lineage(self, parent_id: str) -> ty.Tuple[SimpleNamespace, SimpleNamespace]:
+        """The "parents" and "parent" references of the children of a container, which
+        are shared between them to keep large synthetic projects compact"""
+        try:
+            return self._lineages[parent_id]
+        except KeyError:
+            pass
+        parent = self.get_container(parent_id)
+        lineage = self._lineages[parent_id] = (
+            SimpleNamespace(**vars(parent.parents), **{parent.container_type: parent_id}),
+            SimpleNamespace(id=parent_id, type=parent.container_type),
+        )
+        return lineage
+
+
+class MockClient:
+    """Implements the methods of the Flywheel SDK client used by the store against a
+    mock site. Like the SDK client, it can be shared between threads
+
+    Parameters
+    ----------
+    site : MockFlywheel
+        the site the client is connected to
+    """
+
+    def __init__(self, site: MockFlywheel):
+        self.site = site
+        self.api_client = SimpleNamespace(
+            rest_client=SimpleNamespace(session=requests.Session())
+        )
+        self.analyses_api = MockAnalysesApi(self)
+        self.containers_api = MockContainersApi(self)
+        self.files_api = MockFilesApi(self)
+        self.jobs_api = MockJobsApi(self)
+        self.View = SimpleNamespace
+
+    def shutdown(self):
+        pass
+
+    # Lookups
+
+    def lookup(self, path: str):
+        self.site.request("lookup")
+        group, label = path.split("/", 1)
+        with self.site.lock:
+            try:
+                project_id = self.site.projects[(group, label)]
+            except KeyError:
+                raise flywheel.ApiException(status=404, reason="Not found") from None
+            return self.site.containers[project_id].fetched()
+
+    def get(self, container_id: str):
+        self.site.request("get")
+        with self.site.lock:
+            return self.site.get_container(container_id).fetched()
+
+    def get_subject(self, subject_id: str):
+        self.site.request("get_subject")
+        with self.site.lock:
+            return self.site.get_container(subject_id).fetched()
+
+    # Listings
+
+    def get_project_subjects(self, project_id: str, **kwargs):
+        self.site.request("get_project_subjects")
+        return self.site.list_containers(project_id, "subject", **kwargs)
+
+    def get_project_sessions(self, project_id: str, **kwargs):
+        self.site.request("get_project_sessions")
+        return self.site.list_containers(project_id, "session", **kwargs)
+
+    def get_subject_sessions(self, subject_id: str, **kwargs):
+        self.site.request("get_subject_sessions")
+        project_id = self.site.get_container(subject_id).parents.project
+        return self.site.list_containers(
+            project_id, "session", parent_id=subject_id, **kwargs
+        )
+
+    def get_project_acquisitions(self, project_id: str, **kwargs):
+        self.site.request("get_project_acquisitions")
+        return self.site.list_containers(project_id, "acquisition", **kwargs)
+
+    def get_project_analyses(self, project_id: str, **kwargs):
+        self.site.request("get_project_analyses")
+        return self.site.list_containers(
+            project_id, "analysis", parent_id=project_id, **kwargs
+        )
+
+    def get_analyses(self, container_type: str, container_id: str, subcontainer: str):
+        self.site.request("get_analyses")
+        with self.site.lock:
+            return [
+                a
+                for a in self.site.list_containers(container_id, "analysis")
+                if a.parent.type + "s" == subcontainer
+            ]
+
+    def read_view_data(
+        self, view, project_id: str, skip=0, limit=None, filter=None, **kwargs
+    ):
+        self.site.request("read_view_data")
+        conditions = parse_filter(filter)
+        with self.site.lock:
+            session_ids = list(
+                self.site.project_containers.get((project_id, "session"), [])
+            )
+            if getattr(view, "sort", True):
+                session_ids.sort()
+            else:
+                # The rows of unsorted views are returned in whatever order the
+                # server reads them in, which isn't stable between requests
+                random.Random(self.site.calls["read_view_data"]).shuffle(session_ids)
+            rows = []
+            for session_id in session_ids:
+                session = self.site.containers[session_id]
+                subject = self.site.containers[session.parents.subject]
+                rows.append(
+                    {
+                        "subject.id": subject.id,
+                        "subject.label": subject.label,
+                        "session.id": session.id,
+                        "session.label": session.label,
+                        "session.timestamp": (
+                            session.timestamp.isoformat() if session.timestamp else None
+                        ),
+                        "session.age": session.age,
+                    }
+                )
+            rows = [r for r in rows if matches_filter(conditions, r.get)]
+        return io.BytesIO(
+            json.dumps(rows[skip : skip + limit if limit else None]).encode()
+        )
+
+    # Creation and modification
+
+    def add_project(self, body: dict) -> str:
+        self.site.request("add_project")
+        with self.site.lock:
+            return self.site._add_project(body["label"])
+
+    def add_subject(self, body: dict) -> str:
+        self.site.request("add_subject")
+        with self.site.lock:
+            self._check_unique(
+                body["project"], "subject", body["label"], parent_id=body["project"]
+            )
+            return self.site._add_child("subject", body["project"], body["label"])
+
+    def add_session(self, body: dict) -> str:
+        self.site.request("add_session")
+        with self.site.lock:
+            subject_id = body["subject"]["_id"]
+            self._check_unique(
+                body["project"], "session", body["label"], parent_id=subject_id
+            )
+            return self.site._add_child("session", subject_id, body["label"])
+
+    def add_acquisition(self, body) -> str:
+        self.site.request("add_acquisition")
+        with self.site.lock:
+            return self.site._add_child("acquisition", body.session, body.label)
+
+    def add_project_analysis(self, project_id: str, body) -> str:
+        self.site.request("add_project_analysis")
+        with self.site.lock:
+            return self.site._add_child("analysis", project_id, body.label)
+
+    def add_subject_analysis(self, subject_id: str, body) -> str:
+        self.site.request("add_subject_analysis")
+        with self.site.lock:
+            return self.site._add_child("analysis", subject_id, body.label)
+
+    def add_session_analysis(self, session_id: str, body) -> str:
+        self.site.request("add_session_analysis")
+        with self.site.lock:
+            return self.site._add_child("analysis", session_id, body.label)
+
+    def modify_container_info(self, container_id: str, body: dict):
+        self.site.request("modify_container_info")
+        with self.site.lock:
+            container = self.site.get_container(container_id)
+            container.info.update(body.get("set", {}))
+            for key in body.get("delete", []):
+                container.info.pop(key, None)
+            container.touch()
+
+    # File transfers
+
+    def upload_file_to_container(self, container_id: str, file_spec):
+        self._upload_file("upload_file_to_container", container_id, file_spec)
+
+    def upload_output_to_analysis(self, analysis_id: str, file_spec):
+        self._upload_file("upload_output_to_analysis", analysis_id, file_spec)
+
+    def _upload_file(self, method_name: str, container_id: str, file_spec):
+        contents = file_spec.contents
+        if hasattr(contents, "read"):
+            contents = contents.read()
+        self.site.request(method_name, num_bytes=len(contents))
+        uploaded = MockFile(name=file_spec.name, size=len(contents), contents=contents)
+        with self.site.lock:
+            container = self.site.get_container(container_id)
+            container.files = [
+                f for f in container.files if f.name != file_spec.name
+            ] + [uploaded]
+            container.touch()
+
+    # Jobs
+
+    def add_job(self, body):
+        self.site.request("add_job")
+        with self.site.lock:
+            self.site.get_container(body.destination.id)
+            job = MockJob(
+                id=self.site._new_id(),
+                gear_id=body.gear_id,
+                destination=SimpleNamespace(
+                    type=body.destination.type, id=body.destination.id
+                ),
+                config=dict(body.config or {}),
+                tags=list(body.tags or []),
+                inputs=dict(body.inputs or {}),
+            )
+            self.site.jobs[job.id] = job
+        return SimpleNamespace(id=job.id)
+
+    def create_download_ticket(self, body):
+        ticket = self.site.create_ticket([n.id for n in body.nodes])
+        self.site.request("create_download_ticket")
+        return SimpleNamespace(ticket=ticket)
+
+    def _download_file(self, container_id: str, file_name: str, **kwargs):
+        with self.site.lock:
+            container = self.site.get_container(container_id)
+            try:
+                mock_file = next(f for f in container.files if f.name == file_name)
+            except StopIteration:
+                raise flywheel.ApiException(status=404, reason="Not found") from None
+        self.site.request("download_file", num_bytes=mock_file.size)
+        return MockResponse(mock_file.read())
+
+    def _check_unique(
+        self,
+        project_id: str,
+        container_type: str,
+        label: str,
+        parent_id: ty.Optional[str] = None,
+    ):
+        for container in self.site.list_containers(
+            project_id, container_type, parent_id=parent_id
+        ):
+            if container.label == label:
+                raise flywheel.ApiException(status=409, reason="Conflict")
+
+
+@attrs.define
+class MockAnalysesApi:
+    client: MockClient
+
+    def download_output_from_analysis_with_http_info(
+        self, analysis_id: str, file_name: str, **kwargs
+    ):
+        return self.client._download_file(analysis_id, file_name)
+
+
+@attrs.define
+class MockContainersApi:
+    client: MockClient
+
+    def download_file_from_container_with_http_info(
+        self, container_id: str, file_name: str, **kwargs
+    ):
+        return self.client._download_file(container_id, file_name)
+
+
+@attrs.define
+class MockFilesApi:
+    client: MockClient
+
+    def download_ticket_with_http_info(self, ticket: str, **kwargs):
+        return MockResponse(self.client.site.archive(ticket))
+
+
+@attrs.define
+class MockJobsApi:
+    client: MockClient
+
+    def get_all_jobs(
+        self,
+        tags: ty.Optional[str] = None,
+        filter: ty.Optional[str] = None,
+        limit: ty.Optional[int] = None,
+        after_id: ty.Optional[str] = None,
+    ):
+        site = self.client.site
+        site.request("get_all_jobs")
+        conditions = parse_filter(filter)
+        with site.lock:
+            listed = []
+            for job_id in sorted(site.jobs):
+                job = site.jobs[job_id]
+                if after_id is not None and job_id <= after_id:
+                    continue
+                if tags is not None and tags not in job.tags:
+                    continue
+                if not matches_filter(conditions, functools.partial(getattr, job)):
+                    continue
+                listed.append(attrs.evolve(job))
+                if limit is not None and len(listed) == limit:
+                    break
+        return listed
+
+
+@attrs.define
+class MockResponse:
+    """Streamed response to a file download"""
+
+    contents: bytes = attrs.field(repr=False)
+
+    def iter_content(self, chunk_size: int = 1):
+        for start in range(0, len(self.contents), chunk_size):
+            yield self.contents[start : start + chunk_size]
+
+    def close(self):
+        pass
@@ -11,7 +11,7 @@ from arcana.core.data.set import Dataset
 from arcana.core.data.row import DataRow
 from arcana.testing.data.blueprint import SIMPLE_DATASET
 from arcana.core.data.store import LocalStore
-from arcana.flywheel.data import Flywheel
+from arcana.flywheel.testing import MockFlywheel
 
 try:
     from pydra import set_input_validator
@@ -82,28 +82,45 @@ def install_and_launch_app(
     raise NotImplementedError
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        "--benchmark-scale",
+        choices=["smoke", "full"],
+        default="smoke",
+        help=(
+            "size of the synthetic projects the store is benchmarked against, "
+            "'full' being 10000 subjects x 5 sessions x 20 acquisitions"
+        ),
+    )
+    parser.addoption(
+        "--benchmark-latency",
+        type=float,
+        default=0.0,
+        help="latency (in seconds) of each request to the mock Flywheel site",
+    )
+    parser.addoption(
+        "--benchmark-json",
+        default=None,
+        help="path to save the results of the benchmarks to",
+    )
+
+
 ############
 # FIXTURES #
 ############
 
 
 @pytest.fixture
-def data_store(work_dir: Path, arcana_home, request):
+def flywheel_site() -> MockFlywheel:
+    """An in-process mock of a Flywheel site, so the store tests run offline"""
+    return MockFlywheel()
+
+
+@pytest.fixture
+def data_store(flywheel_site: MockFlywheel, work_dir: Path, arcana_home, request):
     cache_dir = work_dir / "remote-cache"
     cache_dir.mkdir()
-    if TEST_STORE_PASSWORD is None:
-        raise NotImplementedError(
-            "Need to set values of 'TEST_STORE_URI', 'TEST_STORE_USER' and "
-            f"'TEST_STORE_PASSWORD' in {__file__} to point to a valid account on "
-            "an instance of the remote store that can be used for testing, i.e. "
-            "allow the creation of dummy test data.\n\n"
-            "IT SHOULD NOT BE A PRODUCTION SERVER!!"
-        )
-    store = Flywheel(
-        server="dummy",
-        cache_dir=cache_dir,
-        password=TEST_STORE_PASSWORD,
-    )
+    store = flywheel_site.store(cache_dir)
     store.save("test_mock_store")
     yield store
 